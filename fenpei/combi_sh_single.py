@@ -97,44 +97,47 @@ class CombiSingle(ShJobSingle):
 		self._queue_children()
 		for job in self._child_jobs:
 			if job.find_status() == self.CRASHED:
-				self._log('{0:s} crashed because {1:s} crashed'.format(self, job), level=3)
+				self._log('{0:} crashed because {1:} crashed'.format(self, job), level=3)
 				return self.CRASHED
 		return super(CombiSingle, self).find_status()
 
+	def status_files(self):
+		return [pth for job in self._child_jobs for pth in job.status_files()]
+
 	def is_prepared(self):
 		self._queue_children()
 		for job in self._child_jobs:
 			if not job.is_prepared():
-				self._log('{0:s} not prepared because {1:s} is not'.format(self, job), level=3)
+				self._log('{0:} not prepared because {1:} is not'.format(self, job), level=3)
 				return False
-		self._log('{0:s} prepared because all {1:d} children are'.format(self, len(self._child_jobs)), level=3)
+		self._log('{0:} prepared because all {1:d} children are'.format(self, len(self._child_jobs)), level=3)
 		return True
 
 	def is_started(self):
 		self._queue_children()
 		for job in self._child_jobs:
 			if not job.is_started():
-				self._log('{0:s} not started because {1:s} is not'.format(self, job), level=3)
+				self._log('{0:} not started because {1:} is not'.format(self, job), level=3)
 				return False
-		self._log('{0:s} started because all {1:d} children are'.format(self, len(self._child_jobs)), level=3)
+		self._log('{0:} started because all {1:d} children are'.format(self, len(self._child_jobs)), level=3)
 		return True
 
 	def is_running(self):
 		self._queue_children()
 		for job in self._child_jobs:
 			if job.is_running():
-				self._log('{0:s} running because {1:s} is'.format(self, job), level=3)
+				self._log('{0:} running because {1:} is'.format(self, job), level=3)
 				return True
-		self._log('{0:s} not running because not all {1:d} children are'.format(self, len(self._child_jobs)), level=3)
+		self._log('{0:} not running because not all {1:d} children are'.format(self, len(self._child_jobs)), level=3)
 		return False
 
 	def is_complete(self):
 		self._queue_children()
 		for job in self._child_jobs:
 			if not job.is_complete():
-				self._log('{0:s} not complete because {1:s} is not'.format(self, job), level=3)
+				self._log('{0:} not complete because {1:} is not'.format(self, job), level=3)
 				return False
-		self._log('{0:s} complete because all {1:d} children are'.format(self, len(self._child_jobs)), level=3)
+		self._log('{0:} complete because all {1:d} children are'.format(self, len(self._child_jobs)), level=3)
 		return True
 
 	def prepare(self, verbosity=0, *args, **kwargs):
@@ -152,6 +155,10 @@ class CombiSingle(ShJobSingle):
 				cnt += job.start(node, *args, verbosity=0, **kwargs)
 		return cnt
 
+	def start_cmd(self):
+		""" Children are started individually by .start(). """
+		return None
+
 	def fix(self, verbosity=0, *args, **kwargs):
 		self._queue_children()
 		cnt = 0
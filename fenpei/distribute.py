@@ -0,0 +1,204 @@
+
+"""
+Algorithms to distribute jobs over nodes, used by Queue.distribute_jobs.
+
+Each algorithm takes the job weights and node slots, and returns for every job the index of the node it is assigned to.
+A custom algorithm can be used by passing a callable with the same signature as `method`. Built-in algorithms also
+accept a `stats` dictionary, which they fill with the number of steps taken (and possibly more).
+"""
+
+from collections import defaultdict
+from heapq import heapify, heapreplace
+from random import sample
+from numpy import add, arange, argmin, argpartition, argsort, array, asarray, bincount, float64, inf, intp, \
+	maximum, newaxis, searchsorted, unique, where, zeros
+
+
+def node_cost(loads, slots):
+	"""
+	Cost per node: overloading is penalized quadratically, and leaving slots unused linearly.
+	"""
+	loads, slots = asarray(loads, dtype=float64), asarray(slots, dtype=float64)
+	return maximum(loads - slots, 0) ** 2 + slots / maximum(loads, 1)
+
+
+def distribution_cost(weights, slots, assignment):
+	"""
+	Total cost of a distribution (lower is better).
+	"""
+	loads = bincount(asarray(assignment, dtype=intp), weights=asarray(weights, dtype=float64), minlength=len(slots))
+	return float(node_cost(loads, slots).sum())
+
+
+def distribute_lpt(weights, slots, max_improve_steps=None, stats=None):
+	"""
+	Deterministic longest-processing-time-first: place the heaviest remaining job on the node with the most free slots,
+	then improve the result by moving single jobs while that lowers the cost.
+
+	:param max_improve_steps: maximum number of improving moves (defaults to the number of jobs).
+	:param stats: (optional) dictionary that is filled with the number of improvement steps (including the last one,
+		which finds no improving move) and moves.
+	"""
+	weights = asarray(weights, dtype=float64)
+	slots = asarray(slots, dtype=float64)
+	assignment = zeros(len(weights), dtype=intp)
+	if not len(weights):
+		return assignment
+	""" greedy placement; heap of (-free slots, node) so ties go to the lowest node number """
+	heap = [(-slot, node) for node, slot in enumerate(slots)]
+	heapify(heap)
+	for job in argsort(-weights, kind='mergesort'):
+		free, node = heap[0]
+		assignment[job] = node
+		heapreplace(heap, (free + weights[job], node))
+	""" local improvement: repeatedly make the single move that lowers the total cost most """
+	if stats is not None:
+		stats.update(steps=0, moves=0)
+	if len(slots) < 2:
+		return assignment
+	sizes = unique(weights)
+	size_nrs = searchsorted(sizes, weights)
+	members = defaultdict(list)
+	for job, node in enumerate(assignment):
+		members[node, size_nrs[job]].append(job)
+	counts = zeros((len(slots), len(sizes)), dtype=intp)
+	add.at(counts, (assignment, size_nrs), 1)
+	loads = bincount(assignment, weights=weights, minlength=len(slots))
+	size_range = arange(len(sizes))
+	if max_improve_steps is None:
+		max_improve_steps = len(weights)
+	for step in range(max_improve_steps):
+		""" cost change of removing or adding a job of each size, for each node """
+		costs = node_cost(loads, slots)[:, newaxis]
+		remove_delta = node_cost(loads[:, newaxis] - sizes, slots[:, newaxis]) - costs
+		remove_delta[counts == 0] = inf
+		add_delta = node_cost(loads[:, newaxis] + sizes, slots[:, newaxis]) - costs
+		sources = argmin(remove_delta, axis=0)
+		best_two = argpartition(add_delta, 1, axis=0)[:2]
+		targets = where(best_two[0] == sources, best_two[1], best_two[0])
+		deltas = remove_delta[sources, size_range] + add_delta[targets, size_range]
+		size_nr = int(argmin(deltas))
+		if stats is not None:
+			stats['steps'] += 1
+		if not deltas[size_nr] < -1e-9:
+			break
+		source, target = sources[size_nr], targets[size_nr]
+		job = members[source, size_nr].pop()
+		members[target, size_nr].append(job)
+		assignment[job] = target
+		counts[source, size_nr] -= 1
+		counts[target, size_nr] += 1
+		loads[source] -= sizes[size_nr]
+		loads[target] += sizes[size_nr]
+		if stats is not None:
+			stats['moves'] += 1
+	return assignment
+
+
+class DistributionState(object):
+	"""
+	Jobs per node, with running weight totals per node so that moves and swaps are O(1).
+	"""
+
+	def __init__(self, weights, node_count):
+		self.weights = weights
+		self.jobs = [[] for node in range(node_count)]
+		self.loads = [0.] * node_count
+		self.moves = self.swaps = 0
+
+	def add(self, job, node):
+		self.jobs[node].append(job)
+		self.loads[node] += self.weights[job]
+
+	def move(self, node1, item1, node2):
+		"""
+		Move job number `item1` on `node1` to `node2` (the order of jobs on a node changes).
+		"""
+		jobs1 = self.jobs[node1]
+		job = jobs1[item1]
+		jobs1[item1] = jobs1[-1]
+		jobs1.pop()
+		self.jobs[node2].append(job)
+		self.loads[node1] -= self.weights[job]
+		self.loads[node2] += self.weights[job]
+		self.moves += 1
+
+	def swap(self, node1, item1, node2, item2):
+		job1, job2 = self.jobs[node1][item1], self.jobs[node2][item2]
+		self.jobs[node1][item1], self.jobs[node2][item2] = job2, job1
+		self.loads[node1] += self.weights[job2] - self.weights[job1]
+		self.loads[node2] += self.weights[job1] - self.weights[job2]
+		self.swaps += 1
+
+	def assignment(self):
+		assignment = zeros(len(self.weights), dtype=intp)
+		for node, jobs in enumerate(self.jobs):
+			assignment[array(jobs, dtype=intp)] = node
+		return assignment
+
+
+def distribute_monte_carlo(weights, slots, max_reject_spree=100, stats=None):
+	"""
+	Kind-of-Monte-Carlo: start from a random distribution and randomly swap or move jobs if it lowers the cost,
+	until `max_reject_spree` unfavourable changes are tried in a row. Results differ between runs.
+
+	:param stats: (optional) dictionary that is filled with the number of steps, moves and swaps.
+	"""
+	def cost(weight_1, slots_1, weight_2, slots_2):
+		return max(weight_1 - slots_1, 0) ** 2 + max(weight_2 - slots_2, 0) ** 2 + slots_1 / max(weight_1, 1) + slots_2 / max(weight_2, 1)
+	weights = [float(weight) for weight in weights]
+	slots = [float(slot) for slot in slots]
+	nodes = list(range(len(slots)))
+	""" random initial job distribution """
+	state = DistributionState(weights, len(nodes))
+	for job in range(len(weights)):
+		state.add(job, sample(nodes, 1)[0])
+	if len(nodes) < 2:
+		max_reject_spree = 0
+	""" repeat switching until nothing favourable is found anymore """
+	reject_spree, steps = 0, 0
+	jobs, loads = state.jobs, state.loads
+	while reject_spree < max_reject_spree:
+		node1, node2 = sample(nodes, 2)
+		if len(jobs[node1]) > 0:
+			steps += 1
+			cost_before = cost(loads[node1], slots[node1], loads[node2], slots[node2])
+			item1 = sample(range(len(jobs[node1])), 1)[0]
+			weight1 = weights[jobs[node1][item1]]
+			cost_switch = cost_move = None
+			if len(jobs[node2]) > 0:
+				""" compare the cost of switching two items """
+				item2 = sample(range(len(jobs[node2])), 1)[0]
+				weight2 = weights[jobs[node2][item2]]
+				cost_switch = cost(loads[node1] - weight1 + weight2, slots[node1],
+								   loads[node2] + weight1 - weight2, slots[node2])
+			if cost_before > 0:
+				""" compare the cost of moving an item """
+				cost_move = cost(loads[node1] - weight1, slots[node1],
+								 loads[node2] + weight1, slots[node2])
+			switch_better = cost_switch is not None and cost_switch < cost_before
+			move_better = cost_move is not None and cost_move < cost_before
+			if switch_better or move_better:
+				if switch_better and (cost_move is None or cost_switch < cost_move):
+					state.swap(node1, item1, node2, item2)
+				else:
+					""" move (move if equal, it's easier after all) """
+					state.move(node1, item1, node2)
+				reject_spree = 0
+			else:
+				""" not favorable; don't move """
+				reject_spree += 1
+		else:
+			""" too many empty slots means few rejects but lots of iterations, so in itself a sign to stop """
+			reject_spree += 0.1
+	if stats is not None:
+		stats.update(steps=steps, moves=state.moves, swaps=state.swaps)
+	return state.assignment()
+
+
+DISTRIBUTION_METHODS = {
+	'lpt': distribute_lpt,
+	'montecarlo': distribute_monte_carlo,
+}
+
+
@@ -10,10 +10,13 @@ Your custom job(s) should inherit from this job and extend the relevant methods,
 * start
 * result
 * summary
+
+The core fields are slots. If your job class declares ``__slots__`` too (e.g. ``__slots__ = ()``), its instances
+don't have a __dict__, which makes them much smaller when there are very many jobs.
 """
 
 from re import match
-from sys import stdout
+from sys import stdout, intern
 from bardeen.system import mkdirp
 from time import time
 from os import remove
@@ -22,15 +25,61 @@ from shutil import rmtree
 from .utils import CALC_DIR
 
 
+""" Batch directories, shared by all the jobs in a batch; see _batch_directory. They are forgotten when there are
+more than _BATCH_DIRECTORIES_LIMIT (there are usually only a few batches). """
+_BATCH_DIRECTORIES = {}
+_BATCH_DIRECTORIES_LIMIT = 1024
+
+
+def _batch_directory(batch_name):
+	"""
+	The directory of batch `batch_name` (or CALC_DIR if it's False), created once for all jobs in the batch.
+	"""
+	key = (CALC_DIR, batch_name)
+	if key not in _BATCH_DIRECTORIES:
+		if len(_BATCH_DIRECTORIES) >= _BATCH_DIRECTORIES_LIMIT:
+			_BATCH_DIRECTORIES.clear()
+		_BATCH_DIRECTORIES[key] = intern(join(CALC_DIR, batch_name) if batch_name else CALC_DIR)
+	return _BATCH_DIRECTORIES[key]
+
+
+""" Slot names and descriptors per job class, so that pickling many jobs doesn't walk the mro for each one. """
+_SLOT_DESCRIPTORS = {}
+
+
+def _slot_descriptors(cls):
+	if cls not in _SLOT_DESCRIPTORS:
+		descriptors = []
+		for base in cls.__mro__:
+			slots = base.__dict__.get('__slots__', ())
+			for name in ((slots,) if isinstance(slots, str) else slots):
+				if name in base.__dict__ and name not in ('__dict__', '__weakref__'):
+					descriptors.append((name, base.__dict__[name]))
+		_SLOT_DESCRIPTORS[cls] = tuple(descriptors)
+	return _SLOT_DESCRIPTORS[cls]
+
+
+""" Whether a job class overrides .start() without overriding .start_cmd(); see Job.batch_start_cmd. """
+_CUSTOM_START = {}
+
+
+def _has_custom_start(cls):
+	if cls not in _CUSTOM_START:
+		owner = lambda name: next(base for base in cls.__mro__ if name in base.__dict__)
+		start, start_cmd = owner('start'), owner('start_cmd')
+		_CUSTOM_START[cls] = start is not start_cmd and issubclass(start, start_cmd)
+	return _CUSTOM_START[cls]
+
+
 class Job(object):
 
 	CRASHED, NONE, PREPARED, RUNNING, COMPLETED = -1, 0, 1, 2, 3
 	status_names = {-1: 'crashed', 0: 'nothing', 1: 'prepared', 2: 'running', 3: 'completed'}
 
-	queue = None
-	node = None
-	pid = None
-	status = None
+	""" Only _directory is stored if the directory is set explicitly, otherwise it's derived; see .directory. """
+	__slots__ = ('name', 'weight', 'cluster', 'batch_name', 'force_node', '_directory', 'queue', 'node', 'pid',
+		'status', '_last_status_time', '_crash_score')
+
 	""" Set a group_cls to report results together with another class (that has the same output format). """
 	group_cls = None
 
@@ -48,17 +97,44 @@ class Job(object):
 		self.name = name
 		self.weight = weight
 		self.cluster = None
-		self.batch_name = batch_name
+		self.batch_name = intern(batch_name) if batch_name else batch_name
 		self.force_node = force_node
+		self._directory = None
+		self.queue = self.node = self.pid = None
 		if self.batch_name:
 			assert match('^\w[\w\._-]*$', batch_name)
-			self.directory = join(CALC_DIR, batch_name, name)
 		elif batch_name is None:
 			raise AssertionError('no batch name for {0:}; provide batch_name argument when creating jobs or set it to False'.format(self))
-		elif batch_name is False:
-			self.directory = join(CALC_DIR, name)
 		self.status = self.NONE
 
+	@property
+	def directory(self):
+		"""
+		The job directory: CALC_DIR/batch_name/name (or CALC_DIR/name without batch), unless set explicitly.
+		"""
+		if self._directory is not None:
+			return self._directory
+		return join(_batch_directory(self.batch_name), self.name)
+
+	@directory.setter
+	def directory(self, directory):
+		self._directory = directory
+
+	def __getstate__(self):
+		""" Slots and (for subclasses without __slots__) the __dict__, as one dictionary. """
+		cls = type(self)
+		state = dict(getattr(self, '__dict__', {}))
+		for name, descriptor in _slot_descriptors(cls):
+			try:
+				state[name] = descriptor.__get__(self, cls)
+			except AttributeError:
+				pass
+		return state
+
+	def __setstate__(self, state):
+		for name, value in state.items():
+			setattr(self, name, value)
+
 	def __repr__(self):
 		if hasattr(self, 'name'):
 			return self.name
@@ -105,7 +181,8 @@ class Job(object):
 			with open('%s/node_pid.job' % self.directory, 'r') as fh:
 				lines = fh.read().splitlines()
 				self.node = lines[1]
-				self.pid = int(lines[2])
+				""" pid is usually a number, but can be e.g. a scheduler array task like 123_4 """
+				self.pid = int(lines[2]) if lines[2].isdigit() else lines[2]
 			self._log('job %s loaded' % self.name, level=3)
 			return True
 		except IOError:
@@ -130,9 +207,8 @@ class Job(object):
 				return False
 		if not self.queue:
 			raise Exception('cannot check if %s is running because it is not in a queue' % self)
-		proc_list = self.queue.processes(self.node)
 		try:
-			return self.pid in [proc['pid'] for proc in proc_list if proc is not None]
+			return self.pid in self.queue.process_ids(self.node)
 		except KeyError:
 			raise Exception('node %s for job %s no longer found?' % (self.node, self))
 
@@ -165,6 +241,12 @@ class Job(object):
 			setattr(self, '_last_status_time', time())
 		return self.status
 
+	def status_files(self):
+		"""
+		Paths whose modification times change whenever the status might have changed (used by the optional status index).
+		"""
+		return [self.directory, join(self.directory, 'node_pid.job')]
+
 	def status_str(self):
 		return self.status_names[self.find_status()]
 
@@ -177,10 +259,10 @@ class Job(object):
 		self.status = self.PREPARED
 		if not self.is_prepared():
 			if self.batch_name:
-				mkdirp(join(CALC_DIR, self.batch_name))
+				mkdirp(_batch_directory(self.batch_name))
 			mkdirp(self.directory)
 		if not silent:
-			self._log('preparing {0:s}'.format(self), level=2)
+			self._log('preparing {0:}'.format(self), level=2)
 		""" child method add more steps here """
 
 	def _start_pre(self, *args, **kwargs):
@@ -200,15 +282,18 @@ class Job(object):
 		if not self.is_prepared():
 			self.prepare(silent=True)
 
-	def _start_post(self, node, pid, *args, **kwargs):
+	def _start_post(self, node, pid, check_running=True, *args, **kwargs):
 		"""
 		Some bookkeeping at the end of .start().
+
+		:param check_running: whether to check that the process is running (skipped when starting many jobs at once).
 		"""
 		self.node = node
-		self.pid = pid
+		""" store numeric pids as numbers, like .load() does, so they can be found among the running processes """
+		self.pid = int(pid) if isinstance(pid, str) and pid.isdigit() else pid
 		self.save()
-		if self.is_running():
-			self.STATUS = self.RUNNING
+		if not check_running or self.is_running():
+			self.status = self.RUNNING
 		self._log('starting %s on %s with pid %s' % (self, self.node, self.pid), level=2)
 
 	def start(self, node, *args, **kwargs):
@@ -222,6 +307,23 @@ class Job(object):
 		self._start_post(node, 'pid_here', *args, **kwargs)
 		return True
 
+	def start_cmd(self):
+		"""
+		The command that starts this job (run in its directory), which lets the queue start many jobs at once.
+
+		:return: the command, or None if the job can only be started through .start()
+		"""
+		return None
+
+	def batch_start_cmd(self):
+		"""
+		Like .start_cmd(), but None if a subclass overrides .start() and not .start_cmd(), so that the queue doesn't
+		bypass that .start() when starting many jobs at once.
+		"""
+		if _has_custom_start(type(self)):
+			return None
+		return self.start_cmd()
+
 	def fix(self, *args, **kwargs):
 		"""
 		Some code that can be ran to fix jobs, e.g. after bugfixes or updates.
@@ -256,7 +358,7 @@ class Job(object):
 					self.name, self.is_running(), self.is_complete()))
 		if self.batch_name is not False and isdir(self.directory):
 			rmtree(self.directory, ignore_errors = True)
-			self._log('cleaned up {0:s}'.format(self), level=2)
+			self._log('cleaned up {0:}'.format(self), level=2)
 			return True
 		return False
 
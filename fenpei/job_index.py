@@ -0,0 +1,219 @@
+
+"""
+Index of the jobs in a queue by path, parameter hash and parameter values, so that looking up jobs (e.g. for
+compare_jobs or --jobs) doesn't need a pass over all jobs every time.
+
+The index is updated when jobs are added; it assumes that the names and parameters (substitutions) of jobs don't
+change. Indices on other attributes are not kept.
+"""
+
+from collections import OrderedDict
+from operator import attrgetter
+from .job_sh_single import ShJobSingle, param_hashes
+from .utils import compare_key
+
+
+class _MultiMap(object):
+	"""
+	Map from key to jobs that stores a single job per key directly (which is by far the most common).
+	"""
+
+	def __init__(self):
+		self.first = {}
+		self.more = OrderedDict()
+
+	def add(self, key, job):
+		if key in self.first:
+			self.more.setdefault(key, []).append(job)
+		else:
+			self.first[key] = job
+
+	def get(self, key):
+		if key not in self.first:
+			return []
+		return [self.first[key]] + self.more.get(key, [])
+
+	def items(self):
+		"""
+		:return: (key, list of jobs) for all keys, in the order they were added.
+		"""
+		for key, job in self.first.items():
+			yield key, [job] + self.more.get(key, [])
+
+
+""" Job attributes that don't change, besides the substitutions of ShJobSingle jobs. """
+_FIXED_ATTRIBUTES = frozenset(('name', 'batch_name'))
+
+
+def _fixed(job, parameters):
+	"""
+	:return: whether the values of `parameters` for `job` can be assumed not to change (they are the name, batch or
+		substitutions), so that an index on them can be kept.
+	"""
+	subs = job.substitutions if isinstance(job, ShJobSingle) else ()
+	attrs = getattr(job, '__dict__', ())
+	return all(name in _FIXED_ATTRIBUTES or (name in subs and name not in attrs) for name in parameters)
+
+
+def _key_getter(parameters):
+	"""
+	:return: function like `utils.compare_key` for `parameters`, but faster.
+	"""
+	getter = attrgetter(*parameters)
+	def get_key(job):
+		try:
+			key = getter(job)
+		except AttributeError:
+			""" raises the error that explains the problem """
+			return compare_key(job, parameters)
+		return key if len(parameters) > 1 else (key,)
+	return get_key
+
+
+class JobIndex(object):
+
+	def __init__(self, jobs=None, param_cache_size=8):
+		"""
+		:param jobs: the list of jobs (usually queue.jobs); jobs appended to it are indexed by .update().
+		:param param_cache_size: number of sets of parameters (for compare_jobs) whose index is kept.
+		"""
+		self.jobs = jobs
+		self.count = 0
+		self.param_cache_size = param_cache_size
+		""" batch_name -> name -> job, with the jobs that have the same path as an earlier one in duplicate_paths """
+		self.paths = {}
+		self.duplicate_paths = []
+		self._by_hash = None
+		self._by_params = OrderedDict()
+		self.update()
+
+	def __getstate__(self):
+		""" The index is rebuilt when needed, rather than copied. """
+		return {'param_cache_size': self.param_cache_size}
+
+	def __setstate__(self, state):
+		self.__init__(param_cache_size=state['param_cache_size'])
+
+	def update(self):
+		"""
+		Index the jobs that were appended to .jobs since the last update.
+		"""
+		if self.jobs is None:
+			return
+		new_jobs = self.jobs[self.count:]
+		self.count = len(self.jobs)
+		if self._by_hash is not None:
+			param_hashes([job for job in new_jobs if isinstance(job, ShJobSingle)])
+		for job in new_jobs:
+			self._add(job)
+
+	def _add(self, job):
+		names = self.paths.setdefault(job.batch_name, {})
+		if job.name in names:
+			self.duplicate_paths.append(job)
+		else:
+			names[job.name] = job
+		if self._by_hash is not None:
+			hsh = getattr(job, 'param_hash', None)
+			if hsh is not None:
+				self._by_hash.add(hsh, job)
+		for parameters, index in list(self._by_params.items()):
+			if not _fixed(job, parameters):
+				""" the new job doesn't have these parameters, or they may change; the index is made when used """
+				del self._by_params[parameters]
+				continue
+			index.add(_key_getter(parameters)(job), job)
+
+	def by_name(self, name):
+		"""
+		:return: list of jobs called `name` (in any batch).
+		"""
+		found = [names[name] for names in self.paths.values() if name in names]
+		return found + [job for job in self.duplicate_paths if job.name == name]
+
+	def names(self):
+		"""
+		:return: set of the names of all jobs.
+		"""
+		names = set()
+		for batch_names in self.paths.values():
+			names.update(batch_names.keys())
+		return names
+
+	def by_hash(self):
+		"""
+		:return: _MultiMap from parameter hash to jobs, for jobs that have a param_hash (like ShJobSingle).
+		"""
+		if self._by_hash is None:
+			jobs = self.jobs[:self.count]
+			param_hashes([job for job in jobs if isinstance(job, ShJobSingle)])
+			self._by_hash = _MultiMap()
+			for job in jobs:
+				hsh = getattr(job, 'param_hash', None)
+				if hsh is not None:
+					self._by_hash.add(hsh, job)
+		return self._by_hash
+
+	def by_params(self, parameters):
+		"""
+		:param parameters: tuple of job attributes, see `utils.compare_jobs`.
+		:return: _MultiMap from tuples of values of `parameters` to jobs. The most recently used ones are kept, but
+			only for attributes that don't change (see _fixed); others are looked up again every time.
+		"""
+		if parameters in self._by_params:
+			self._by_params[parameters] = self._by_params.pop(parameters)
+			return self._by_params[parameters]
+		index, get_key, fixed = _MultiMap(), _key_getter(parameters), True
+		for job in self.jobs[:self.count]:
+			index.add(get_key(job), job)
+			fixed = fixed and _fixed(job, parameters)
+		if fixed:
+			self._by_params[parameters] = index
+			while len(self._by_params) > max(self.param_cache_size, 1):
+				self._by_params.popitem(last=False)
+		return index
+
+	def compare_jobs(self, parameters, filter=None):
+		"""
+		Like `utils.compare_jobs`, but using the index.
+		"""
+		if not hasattr(parameters, '__iter__') or isinstance(parameters, str):
+			parameters = (parameters,)
+		parameters = tuple(parameters)
+		assert len(parameters) > 0, 'Provide a job attribute to compare jobs.'
+		index = self.by_params(parameters)
+		if filter is None:
+			for key, jobs in index.more.items():
+				raise AssertionError(('Can not compare jobs on "{0:}" since jobs "{1:}" and "{2:}" both have value <{3:}>, '
+					'but values should be unique.').format(parameters, index.first[key], jobs[0], key))
+			return OrderedDict(index.first)
+		jobmap = OrderedDict()
+		for key, jobs in index.items():
+			for job in jobs:
+				if filter(job):
+					assert key not in jobmap, ('Can not compare jobs on "{0:}" since jobs "{1:}" and "{2:}" both have value '
+						'<{3:}>, but values should be unique.').format(parameters, jobmap[key], job, key)
+					jobmap[key] = job
+		return jobmap
+
+	def duplicate_parameters(self):
+		"""
+		:return: list of groups of jobs that have identical parameters but different names.
+		"""
+		index = self.by_hash()
+		groups = []
+		for hsh in index.more.keys():
+			""" jobs with the same hash almost always have the same parameters, but compare them to be sure """
+			same = []
+			for job in index.get(hsh):
+				params = sorted(zip(job.parameter_names, job.get_param_tuple()))
+				for group_params, group in same:
+					if group_params == params:
+						group.append(job)
+						break
+				else:
+					same.append((params, [job]))
+			groups.extend(group for params, group in same if len(set(job.name for job in group)) > 1)
+		return groups
+
+
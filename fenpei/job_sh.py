@@ -11,22 +11,30 @@ Instead of :ref: prepare and :ref: start, you can override:
 """
 
 from socket import gethostname
-from collections import Mapping
-from os import listdir, symlink
+from collections import Counter, OrderedDict
+from json import dump, load
+try:
+	from collections.abc import Mapping
+except ImportError:
+	from collections import Mapping
+from os import chmod, scandir, stat
 from os.path import join, basename, isdir, isfile, dirname, exists, islink
-from shutil import copyfile
+from stat import S_IXUSR, S_IXGRP
+from sys import intern
 from bardeen.system import mkdirp
 from fenpei.job import Job
-from fenpei.shell import run_shell
+from fenpei.materialize import materialize, MODES, FALLBACKS
 from datetime import datetime
 from time import time
+import xxhash
 
-from fenpei.utils import substitute, FormattingException
+from fenpei.utils import substitute, FormattingException, SourceCache, creating_batch
 from .shell import git_current_hash
 
 
 def extend_substitutions(subst, name, batch, directory, git_hash=None):
-	timestr = datetime.now().strftime('%Y-%m-%d %H:%M') + ' (%d)' % time()
+	""" interned, since these are the same for many jobs """
+	timestr = intern(datetime.now().strftime('%Y-%m-%d %H:%M') + ' (%d)' % time())
 	if git_hash is None:
 		git_hash = git_current_hash()
 	if isinstance(subst, Mapping):
@@ -34,7 +42,7 @@ def extend_substitutions(subst, name, batch, directory, git_hash=None):
 		subst['batch_name'] = batch
 		subst['now'] = timestr
 		subst['directory'] = directory
-		subst['hostname'] = gethostname()
+		subst['hostname'] = intern(gethostname())
 		subst['git_commit'] = git_hash
 	elif subst is None:
 		pass
@@ -42,9 +50,85 @@ def extend_substitutions(subst, name, batch, directory, git_hash=None):
 		raise NotImplementedError('I haven\'t thought about this, maybe it\'s not needed anyway.')
 
 
+""" Expanded file specifications, shared by all jobs; see expand_files. There is usually one per job class, but they
+are forgotten when there are more than _EXPANDED_FILES_LIMIT. """
+_EXPANDED_FILES = {}
+_EXPANDED_FILES_LIMIT = 256
+
+
+def _expand_dir(pre_path, source_pth, target_pth, triples, mtimes):
+	"""
+	Expand (predir, source, target) into the triples of all the files in that directory (if it is one), recording
+	the modification time of every directory that is read.
+	"""
+	fullpath = join(pre_path, source_pth)
+	if not isdir(fullpath):
+		triples.append((pre_path, source_pth, target_pth))
+		return
+	mtimes[fullpath] = stat(fullpath).st_mtime_ns
+	for entry in sorted(scandir(fullpath), key=lambda entry: entry.name):
+		sub_source, sub_target = join(source_pth, entry.name), join(target_pth, entry.name)
+		if entry.is_dir():
+			_expand_dir(pre_path, sub_source, sub_target, triples, mtimes)
+		else:
+			triples.append((pre_path, sub_source, sub_target))
+
+
+def _mtimes_unchanged(mtimes):
+	for pth, mtime in mtimes.items():
+		try:
+			if stat(pth).st_mtime_ns != mtime:
+				return False
+		except OSError:
+			return False
+	return True
+
+
+def expand_files(specs, not_found=OSError):
+	"""
+	Expand file specifications (predir, source, target) into all the files they contain. The result is cached for
+	the combination of specifications, and used as long as the modification times of the directories involved
+	(including those containing the specified files) don't change. Those are checked once for a batch of jobs
+	that is created together (see `utils.iter_jobs`), and for every job otherwise.
+
+	:return: dictionary from each specification to a list of triples for its files.
+	:raise not_found: if one of the files doesn't exist.
+	"""
+	batch = creating_batch()
+	cached = _EXPANDED_FILES.get(specs)
+	if cached is not None:
+		expanded, mtimes, checked = cached
+		if batch is not None and checked == batch:
+			return expanded
+		if _mtimes_unchanged(mtimes):
+			_EXPANDED_FILES[specs] = (expanded, mtimes, batch)
+			return expanded
+	elif len(_EXPANDED_FILES) >= _EXPANDED_FILES_LIMIT:
+		_EXPANDED_FILES.clear()
+	expanded, mtimes = {}, {}
+	for filepath in specs:
+		pth = join(*filepath[:2])
+		if not exists(pth):
+			raise not_found('"%s" is not a valid file or directory' % pth)
+		parent = dirname(pth.rstrip('/')) or '.'
+		mtimes[parent] = stat(parent).st_mtime_ns
+		expanded[filepath] = []
+		_expand_dir(filepath[0], filepath[1], filepath[2], expanded[filepath], mtimes)
+	_EXPANDED_FILES[specs] = (expanded, mtimes, batch)
+	return expanded
+
+
 class ShJob(Job):
 
-	def __init__(self, name, substitutions, weight=1, batch_name=None, formatter='jinja2', use_symlink=True, force_node=None):
+	__slots__ = ('files', 'formatter', 'use_symlink', 'link_mode', 'link_counts')
+
+	""" File that .prepare() writes in the job directory when done, so that .is_prepared() needs only one stat. """
+	PREPARED_MANIFEST = '.fenpei_prepared.json'
+	""" Set to True to make .is_prepared() check the manifest contents and all files. """
+	deep_verify = False
+
+	def __init__(self, name, substitutions, weight=1, batch_name=None, formatter='jinja2', use_symlink=True, force_node=None,
+			link_mode=None):
 		"""
 		Create a executable or shell job object, provided a number of files or directories which will be copied,
 		and (optionally) substitutions for each of them.
@@ -53,11 +137,15 @@ class ShJob(Job):
 		substitutions, or None; e.g. {'run.sh': {'R': 15, 'method': 'ccsd(t)'}} will copy
 		:raise ShJob.FileNotFound: subclass of OSError, indicating the files argument contains data that is invalid
 
+		:param link_mode: how files without substitutions are put in the job directory: 'symlink', 'hardlink',
+		'reflink' or 'copy' (falling back to the next option if not possible, see `fenpei.materialize`); the default
+		is 'symlink', or 'copy' if use_symlink is False. With 'hardlink', the run file is cloned or copied instead,
+		since it is made executable (and hard links share permissions with the source).
 		For other parameters, see :ref: Job.
 
-		Files will be copied if bool(files) is True (for substitutions), otherwise it will be attempted to
-		hard-link them (use True to prevent that with no substitutions); if you use a directory, /path/ copies
-		files from it and /path copies the directory with files; directory substitutions apply to contained files.
+		Files will be copied if bool(files) is True (for substitutions), otherwise they are linked according to
+		link_mode; if you use a directory, /path/ copies files from it and /path copies the directory with files;
+		directory substitutions apply to contained files.
 		"""
 		assert ' ' not in self.run_file(), 'there should be no whitespace in run file'
 		super(ShJob, self).__init__(name=name, weight=weight, batch_name=batch_name, force_node=force_node)
@@ -68,6 +156,8 @@ class ShJob(Job):
 		self.files.update(substitutions)
 		self.formatter = formatter
 		self.use_symlink = use_symlink
+		self.link_mode = link_mode or ('symlink' if use_symlink else 'copy')
+		assert self.link_mode in MODES, 'unknown link_mode "{0:}"'.format(link_mode)
 		self.files = self._fix_files(self.files)
 
 	@classmethod
@@ -100,42 +190,53 @@ class ShJob(Job):
 
 		Turns all string filepaths into tuples of directory and filename.
 
-		Expands all directories into lists of files.
+		Expands all directories into lists of files (using a cache that is shared by all jobs, see `expand_files`).
 
 		:raise ShJob.FileNotFound: subclass of OSError, indicating the one of the files doesn't exist
 		"""
-		def expand_dir(pre_path, source_pth, target_pth):
-			"""
-			Expand a tuple (predir, postdir) into all the files in that directory.
-			"""
-			fullpath = join(pre_path, source_pth)
-			subs = []
-			if isdir(fullpath):
-				for subpath in listdir(fullpath):
-					subs.extend(expand_dir(pre_path=pre_path,
-						source_pth= join(fullpath, subpath).lstrip(pre_path),
-						target_pth=target_pth))
-				return subs
-			else:
-				return [(pre_path, source_pth, target_pth)]
-
-		newfiles = {}
+		specs = OrderedDict()
 		for filepath, subst in files.items():
 			if not isinstance(filepath, tuple) and not isinstance(filepath, list):
 				""" change string path into tuple """
 				filepath = dirname(filepath), basename(filepath), basename(filepath)
 			if len(filepath) == 2:
 				filepath = filepath[0], filepath[1], filepath[1]
-			for pth_triple in expand_dir(*filepath):
-				""" recursively expand a directory into all it's files """
+			specs[tuple(filepath)] = subst
+		expanded = expand_files(tuple(specs.keys()), self.FileNotFound)
+		newfiles = {}
+		for filepath, subst in specs.items():
+			for pth_triple in expanded[filepath]:
 				newfiles[pth_triple] = subst
-			if not exists(join(*filepath[:2])):
-				raise self.FileNotFound('"%s" is not a valid file or directory' % join(*filepath[:2]))
 		return newfiles
 
-	def is_prepared(self):
+	def is_prepared(self, deep=None):
 		"""
-		See if prepared by checking the existence of every file.
+		See if prepared by checking that the manifest, which is written at the end of .prepare(), exists.
+
+		:param deep: also check the manifest contents and the existence of every file (default .deep_verify);
+			this also happens for jobs that were prepared before manifests existed.
+		"""
+		deep = self.deep_verify if deep is None else deep
+		manifest_path = join(self.directory, self.PREPARED_MANIFEST)
+		if not deep:
+			if isfile(manifest_path):
+				return True
+			return self._files_present()
+		try:
+			with open(manifest_path, 'r') as fh:
+				manifest = load(fh)
+		except (IOError, OSError, ValueError):
+			return self._files_present()
+		if manifest.get('files') != self._prepared_files():
+			self._log('{0:s} is not prepared because its files changed since it was prepared'.format(self.name), 3)
+			return False
+		if manifest.get('hash') != self._template_hash():
+			self._log('{0:s} was prepared from different files or templates than the current ones'.format(self.name))
+		return self._files_present()
+
+	def _files_present(self):
+		"""
+		Check the existence of every file.
 		"""
 		for fromroot, frompth, topth in self.files.keys():
 			if not isfile(join(self.directory, topth)) and not islink(join(self.directory, topth)):
@@ -146,13 +247,43 @@ class ShJob(Job):
 			return False
 		return True
 
-	def prepare(self, *args, **kwargs):
+	def _prepared_files(self):
+		return sorted(topth for fromroot, frompth, topth in self.files.keys())
+
+	def _template_hash(self, sources=None):
+		"""
+		Hash of the file list and the content of the files with substitutions (before substituting).
+		"""
+		if sources is None:
+			sources = SourceCache()
+		hsh = xxhash.xxh64()
+		for (fromroot, frompth, topth), subst in sorted(self.files.items(), key=lambda item: item[0]):
+			hsh.update('{0:s}\t{1:s}\n'.format(join(fromroot, frompth), topth).encode('utf-8'))
+			if subst and isinstance(subst, Mapping):
+				try:
+					hsh.update(sources.read(join(fromroot, frompth)).encode('utf-8'))
+				except (IOError, OSError):
+					hsh.update(b'-')
+		return hsh.hexdigest()
+
+	def _write_manifest(self, sources=None):
+		with open(join(self.directory, self.PREPARED_MANIFEST), 'w+') as fh:
+			dump({'files': self._prepared_files(), 'hash': self._template_hash(sources)}, fh)
+
+	def prepare(self, *args, sources=None, **kwargs):
 		"""
 		Prepares the job for execution by copying or linking all the files, and substituting values where applicable.
+
+		:param sources: (optional, keyword only) a `utils.SourceCache` shared by all jobs that are prepared, so that
+			each source file is only read once.
 		"""
 		super(ShJob, self).prepare(*args, **kwargs)
 		if self.is_prepared():
 			return False
+		if sources is None:
+			sources = SourceCache()
+		""" (requested, used) link modes and how often they were used, for the summary in Queue.prepare """
+		self.link_counts = Counter()
 		for (fromroot, frompth, topth), subst in self.files.items():
 			sourcefilepath = join(fromroot, frompth)
 			destfilepath = join(self.directory, topth)
@@ -163,46 +294,49 @@ class ShJob(Job):
 			if subst:
 				""" copy files and possibly substitute """
 				if isinstance(subst, Mapping):
-					with open(sourcefilepath, 'r') as fhr:
-						with open(destfilepath, 'w+') as fhw:
-							inp = fhr.read()
-							try:
-								if hasattr(self.formatter, '__call__'):
-									# noinspection PyCallingNonCallable
-									outp = self.formatter(inp, subst, job=self, filename=sourcefilepath)
-								else:
-									outp = substitute(inp, subst, formatter=self.formatter, job=self, filename=sourcefilepath)
-								fhw.write(outp)
-							except FormattingException as err:
-								self._log('{0:}'.format(err))
-								self.cleanup()
-								return False
-				else:
-					if self.use_symlink:
-						symlink(sourcefilepath, destfilepath)
-					else:
-						copyfile(sourcefilepath, destfilepath)
-			else:
-				""" Soft-link files if possible and allowed by settings """
-				if self.use_symlink:
-					symlink(sourcefilepath, destfilepath)
-				else:
-					copyfile(sourcefilepath, destfilepath)
-		if isfile(join(self.directory, self.run_file())):
-			run_shell(cmd = 'chmod ug+x "%s"' % join(self.directory, self.run_file()), wait = True)
+					inp = sources.read(sourcefilepath)
+					try:
+						if hasattr(self.formatter, '__call__'):
+							# noinspection PyCallingNonCallable
+							outp = self.formatter(inp, subst, job=self, filename=sourcefilepath)
+						else:
+							outp = substitute(inp, subst, formatter=self.formatter, job=self, filename=sourcefilepath)
+					except FormattingException as err:
+						self._log('{0:}'.format(err))
+						self.cleanup()
+						return False
+					with open(destfilepath, 'w+') as fhw:
+						fhw.write(outp)
+					continue
+			""" link files if possible and allowed by settings """
+			mode = self.link_mode
+			if mode == 'hardlink' and topth == self.run_file():
+				""" the run file is made executable, which should not change the source file """
+				mode = FALLBACKS[mode]
+			self.link_counts[self.link_mode, materialize(sourcefilepath, destfilepath, mode)] += 1
+		run_path = join(self.directory, self.run_file())
+		if isfile(run_path):
+			chmod(run_path, stat(run_path).st_mode | S_IXUSR | S_IXGRP)
 		else:
 			raise self.FileNotFound(('.run_file() "%s" not found after preparation; make sure it\'s origin is in ' +
 				'.get_files() or in __init__ substitutions argument') % self.run_file())
+		if self._files_present():
+			self._write_manifest(sources)
 		return True
 
+	def start_cmd(self):
+		"""
+		Command to execute the run file; if you override .start() but not this, the queue uses .start().
+		"""
+		""" nohup, bg and std redirect should be handeled by queue """
+		return './{0:s}'.format(self.run_file())  # no abspath, not necessary, and is publicly visible in queue
+
 	def start(self, node, *args, **kwargs):
 		"""
 		Start the job and store node/pid.
 		"""
 		self._start_pre(*args, **kwargs)
-		""" nohup, bg and std redirect should be handeled by queue """
-		cmd = './{0:s}'.format(self.run_file())  # no abspath, not necessary, and is publicly visible in queue
-		pid = self.queue.run_cmd(job=self, cmd=cmd)
+		pid = self.queue.run_cmd(job=self, cmd=self.start_cmd())
 		self._start_post(node, pid, *args, **kwargs)
 		return True
 
@@ -6,23 +6,154 @@ Automatically adds all substitutions as attributes to the job.
 """
 
 from collections import OrderedDict
-from copy import copy
+try:
+	from collections.abc import Mapping
+except ImportError:
+	from collections import Mapping
 from json import dump, load
 from logging import warning
+from operator import itemgetter
 from os import remove
 from os.path import join, exists
 from pickle import dumps
+from types import MappingProxyType
 
-import xxhash
+from xxhash import xxh64_hexdigest
 
 from fenpei.job_sh import ShJob, extend_substitutions
-from fenpei.shell import run_cmds
+from fenpei.materialize import MODES
+from fenpei.utils import chmod_tree
+
+
+""" Values that are the same for many jobs, like parameter names and file layouts; see _shared and _layout.
+There is usually one per job class (or set of files), but they are forgotten (only sharing is lost) when there are
+more than _SHARED_LIMIT, so that e.g. a long-running monitor doesn't keep growing them. """
+_SHARED = {}
+_LAYOUTS = {}
+_SHARED_LIMIT = 1024
+
+
+def _shared(value):
+	"""
+	:return: an object equal to (hashable) `value` that is shared by all jobs that use it.
+	"""
+	if value not in _SHARED and len(_SHARED) >= _SHARED_LIMIT:
+		_SHARED.clear()
+	return _SHARED.setdefault(value, value)
+
+
+def _layout(pairs):
+	"""
+	:param pairs: tuple of (fileinfo, whether the file has substitutions)
+	:return: read-only map from fileinfo to whether it has substitutions, shared by all jobs with these files.
+	"""
+	if pairs not in _LAYOUTS:
+		if len(_LAYOUTS) >= _SHARED_LIMIT:
+			_LAYOUTS.clear()
+		_LAYOUTS[pairs] = MappingProxyType(OrderedDict(pairs))
+	return _LAYOUTS[pairs]
+
+
+class _FileMap(Mapping):
+	"""
+	Read-only map from file to substitutions for ShJobSingle, where all files with substitutions share one view
+	of the substitutions. To change the files of a job, assign a new dictionary to .files instead.
+	"""
+
+	__slots__ = ('_layout', '_view')
+
+	def __init__(self, layout, substitutions):
+		self._layout = layout
+		self._view = MappingProxyType(substitutions)
+
+	def __getitem__(self, fileinfo):
+		return self._view if self._layout[fileinfo] else None
+
+	def __iter__(self):
+		return iter(self._layout)
+
+	def __len__(self):
+		return len(self._layout)
+
+	def items(self):
+		view = self._view
+		return [(fileinfo, view if has_subs else None) for fileinfo, has_subs in self._layout.items()]
+
+	def values(self):
+		view = self._view
+		return [view if has_subs else None for has_subs in self._layout.values()]
+
+
+""" Types for which repr is canonical (the same for equal values, and different for different values or types). """
+_REPR_TYPES = frozenset((type(None), bool, int, float, complex, str, bytes))
+
+
+def _canonical(value):
+	"""
+	Text for a parameter value that is the same for equal values of the same type (subclasses, like numpy floats,
+	count as their base type). Unlike pickle, it doesn't depend on e.g. the order of dictionaries or sets.
+
+	For tuples of _REPR_TYPES values, this is the same as repr.
+	"""
+	if type(value) in _REPR_TYPES:
+		return repr(value)
+	for base in (int, float, complex, str, bytes):
+		if isinstance(value, base):
+			return base.__repr__(value)
+	if isinstance(value, tuple):
+		return '({0:s}{1:s})'.format(', '.join(_canonical(item) for item in value), ',' if len(value) == 1 else '')
+	if isinstance(value, list):
+		return '[{0:s}]'.format(', '.join(_canonical(item) for item in value))
+	if isinstance(value, Mapping):
+		return '{{{0:s}}}'.format(', '.join(sorted('{0:s}: {1:s}'.format(_canonical(key), _canonical(val))
+			for key, val in value.items())))
+	if isinstance(value, (set, frozenset)):
+		if not value:
+			return 'set()'
+		return '{{{0:s}}}'.format(', '.join(sorted(_canonical(item) for item in value)))
+	return 'pickle:{0:s}'.format(dumps(value, protocol=2).hex())
+
+
+def _param_getter(names):
+	"""
+	:return: function that gets the values of parameters `names` from substitutions as a tuple, and the text for
+		the names in the hash.
+	"""
+	if len(names) > 1:
+		return itemgetter(*names), repr(tuple(names))
+	return (lambda subs: tuple(subs[name] for name in names)), repr(tuple(names))
+
+
+def param_hashes(jobs):
+	"""
+	Hash the parameters of all `jobs` in one pass, and store the hashes on the jobs (see ShJobSingle.param_hash).
+
+	:return: list with the hash of each job.
+	"""
+	getters, hashes = {}, []
+	for job in jobs:
+		if job._param_hash is None:
+			names = job.parameter_names
+			if names not in getters:
+				getters[names] = _param_getter(sorted(names))
+			getter, text = getters[names]
+			values = getter(job.substitutions)
+			""" the values are usually simple, and then repr does everything at once """
+			if _REPR_TYPES.issuperset(map(type, values)):
+				text += repr(values)
+			else:
+				text += _canonical(values)
+			job._param_hash = xxh64_hexdigest(text.encode('utf-8', 'surrogatepass'))
+		hashes.append(job._param_hash)
+	return hashes
 
 
 class ShJobSingle(ShJob):
 
+	__slots__ = ('substitutions', 'parameter_names', '_file_layout', '_param_hash')
+
 	def __init__(self, name, subs, sub_files=(), nosub_files=(), weight=1, batch_name=None,
-			defaults_version=1, formatter='jinja2', skip_checks=False, use_symlink=True, force_node=None):
+			defaults_version=1, formatter='jinja2', skip_checks=False, use_symlink=True, force_node=None, link_mode=None):
 		"""
 		Similar to ShJob.
 
@@ -31,10 +162,12 @@ class ShJobSingle(ShJob):
 		:param nosub_files: files as-is (no substitutions).
 		:param defaults_version: which version of defaults? (Exists to keep old jobs working).
 		:param formatter: which formatter to use for files (%, .format, jinja, ..; see `utils.py`).
+		:param link_mode: how files without substitutions are added (symlink, hardlink, reflink or copy; see ShJob).
 		"""
 		""" Defaults for substitutions. """
-		subs_with_defaults = copy(self.get_default_subs(version=defaults_version))
-		self.parameter_names = list(subs_with_defaults.keys())
+		subs_with_defaults = dict(self.get_default_subs(version=defaults_version))
+		self.parameter_names = _shared(tuple(subs_with_defaults.keys()))
+		self._param_hash = None
 		for sub in subs.keys():
 			if sub not in subs_with_defaults:
 				warning('job "{0:}" has unknown substitution parameter "{1:s}" = "{2:}"'.format(self, sub, subs[sub]))
@@ -42,40 +175,76 @@ class ShJobSingle(ShJob):
 		subs_with_defaults['defaults_version'] = defaults_version
 		""" Check/make sure that combiantions of parameters are acceptable """
 		checked_subs = self.check_and_update_subs(subs_with_defaults, skip_checks=skip_checks)
-		""" Substitutions as job properties. """
+		""" Substitutions are available as job properties through __getattr__. """
 		self.substitutions = checked_subs
-		for key, val in checked_subs.items():
-			setattr(self, key, val)
 		""" Override the whole ShJob init because it's very inefficient if all substitutions are the same """
 		""" This skips one inheritance level! """
 		super(ShJob, self).__init__(name=name, weight=weight, batch_name=batch_name, force_node=force_node)
 		self.formatter = formatter
 		self.use_symlink = use_symlink
+		self.link_mode = link_mode or ('symlink' if use_symlink else 'copy')
+		assert self.link_mode in MODES, 'unknown link_mode "{0:}"'.format(link_mode)
 		extend_substitutions(self.substitutions, name, batch_name, self.directory)
-		if not hasattr(self.__class__, '_FIXED_CACHE'):
-			""" Create the (path, name) -> subst map, but use True instead of the map. """
-			files = {filepath: None for filepath in self.get_nosub_files() + list(nosub_files)}
-			files.update({filepath: True for filepath in self.get_sub_files() + list(sub_files)})
-			self.__class__._FIXED_CACHE = self._fix_files(files)
-		""" Now fill in the substitutions (in a copied version). """
-		self.files = {fileinfo: (copy(self.substitutions) if subs is True else None) for (fileinfo, subs) in self.__class__._FIXED_CACHE.items()}
-		self.parameter_file_path = join(self.directory, 'parameters.json')
+		""" Create the (path, name) -> subst map, but use True instead of the map (expanding is cached for all jobs). """
+		files = OrderedDict((filepath, None) for filepath in self.get_nosub_files() + list(nosub_files))
+		files.update((filepath, True) for filepath in self.get_sub_files() + list(sub_files))
+		""" Only store which files have substitutions (the same for all jobs of a class); see .files """
+		self._file_layout = _layout(tuple((fileinfo, subs is True) for (fileinfo, subs) in self._fix_files(files).items()))
+
+	@property
+	def files(self):
+		"""
+		Read-only map from file to substitutions, where all files with substitutions share one view of .substitutions
+		(unless a dictionary was assigned to .files).
+		"""
+		if isinstance(self._file_layout, MappingProxyType):
+			return _FileMap(self._file_layout, self.substitutions)
+		return self._file_layout
+
+	@files.setter
+	def files(self, files):
+		self._file_layout = files
+
+	@property
+	def parameter_file_path(self):
+		return join(self.directory, 'parameters.json')
+
+	def __getattr__(self, name):
+		"""
+		Substitutions can be used as attributes (only called for names that are not found otherwise).
+		"""
+		if not name.startswith('__') and name != 'substitutions':
+			try:
+				return self.substitutions[name]
+			except (KeyError, AttributeError):
+				pass
+		raise AttributeError('\'{0:s}\' object has no attribute \'{1:s}\''.format(self.__class__.__name__, name))
+
+	def __getstate__(self):
+		state = super(ShJobSingle, self).__getstate__()
+		if isinstance(self._file_layout, MappingProxyType):
+			state['_file_layout'] = tuple(self._file_layout.items())
+		return state
+
+	def __setstate__(self, state):
+		super(ShJobSingle, self).__setstate__(state)
+		""" unpickling makes copies, so share these again """
+		if isinstance(self._file_layout, tuple):
+			self._file_layout = _layout(self._file_layout)
+		self.parameter_names = _shared(tuple(self.parameter_names))
 	
 	def get_param_tuple(self):
 		return tuple(self.substitutions[name] for name in self.parameter_names)
 	
-	def _calc_param_hash(self):
-		h = xxhash.xxh32()
-		for nm in sorted(self.parameter_names):
-			h.update(dumps(self.substitutions[nm]))
-		return h.hexdigest().rstrip('=')
-
 	@property
 	def param_hash(self):
-		ShJobSingle._HASH_CACHE = getattr(ShJobSingle, '_HASH_CACHE', {})
-		if id(self) not in ShJobSingle._HASH_CACHE:
-			ShJobSingle._HASH_CACHE[id(self)] = self._calc_param_hash()
-		return ShJobSingle._HASH_CACHE[id(self)]
+		"""
+		Hash of the parameter values, computed once per job (so parameters should not be changed after using it).
+		For many jobs, `param_hashes` is faster.
+		"""
+		if self._param_hash is None:
+			param_hashes((self,))
+		return self._param_hash
 
 	def check_and_update_subs(self, subs, *args, **kwargs):
 		return subs
@@ -117,8 +286,7 @@ class ShJobSingle(ShJob):
 	def prepare(self, verbosity=0, *args, **kwargs):
 		status = super(ShJobSingle, self).prepare(verbosity=verbosity, *args, **kwargs)
 		self.store_config()
-		chcmd = 'chmod 750 -R "{0:s}"'.format(self.directory)
-		outp = run_cmds((chcmd,), queue=self.queue)
+		chmod_tree(self.directory, 0o750)
 		return status
 
 	def fix(self, verbosity=0, force=False, *args, **kwargs):
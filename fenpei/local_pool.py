@@ -0,0 +1,117 @@
+
+"""
+Start jobs on the local machine with bounded concurrency: jobs wait in a pending queue and the next one is started
+as soon as enough slots are free, so the machine stays busy without being overloaded. Used by LocalQueue.
+"""
+
+from collections import deque, OrderedDict
+from multiprocessing import cpu_count
+from os import devnull
+from os.path import join
+from shlex import split
+from subprocess import Popen, STDOUT
+from threading import Condition, Thread
+
+
+class LocalPool(object):
+
+	def __init__(self, slots=None):
+		"""
+		:param slots: total job weight that can run at once (defaults to the number of processors).
+		"""
+		self.slots = slots or cpu_count()
+		self.used = 0
+		self.pending = deque()
+		self.running = OrderedDict()
+		""" Jobs that could not be started, with the error. """
+		self.failed = []
+		self._cond = Condition()
+
+	def __getstate__(self):
+		""" Child processes belong to this process, so a copy (e.g. in a worker process) starts out empty. """
+		return {'slots': self.slots}
+
+	def __setstate__(self, state):
+		self.__init__(slots=state['slots'])
+
+	def submit(self, job, cmd, on_start=None, on_fail=None):
+		"""
+		Start `cmd` in the directory of `job` when there are enough free slots (which may be immediately).
+
+		:param cmd: the command, like the path of the run file; it is started directly, not through a shell.
+		:param on_start: function that is called with the pid once the job is started.
+		:param on_fail: function that is called with the error if the job could not be started (it is also added
+			to .failed).
+		:return: False if the job was already waiting, True otherwise.
+		"""
+		assert job.directory
+		with self._cond:
+			if any(waiting[0].directory == job.directory for waiting in self.pending):
+				return False
+			self.pending.append((job, cmd, on_start, on_fail))
+			self._fill()
+		return True
+
+	def _fill(self):
+		"""
+		Start pending jobs while they fit; a job heavier than all slots is started when nothing else runs.
+		"""
+		while self.pending:
+			job, cmd, on_start, on_fail = self.pending[0]
+			if self.running and self.used + job.weight > self.slots:
+				break
+			self.pending.popleft()
+			try:
+				with open(join(job.directory, 'all_output.txt'), 'w+') as out, open(devnull, 'r') as inp:
+					proc = Popen(split(cmd), cwd=job.directory, stdin=inp, stdout=out, stderr=STDOUT, start_new_session=True)
+			except (OSError, IOError) as err:
+				self.failed.append((job, err))
+				if on_fail is not None:
+					on_fail(err)
+				continue
+			self.running[proc.pid] = (proc, job.weight)
+			self.used += job.weight
+			watcher = Thread(target=self._watch, args=(proc,))
+			watcher.daemon = True
+			watcher.start()
+			if on_start is not None:
+				on_start(proc.pid)
+		self._cond.notify_all()
+
+	def _watch(self, proc):
+		"""
+		Wait for a job to finish, then free its slots and start pending jobs.
+		"""
+		proc.wait()
+		with self._cond:
+			self.used -= self.running.pop(proc.pid)[1]
+			self._fill()
+
+	def running_pids(self):
+		"""
+		:return: frozenset of the pids of jobs that were started by this pool and did not finish yet.
+		"""
+		with self._cond:
+			return frozenset(self.running.keys())
+
+	def join(self, timeout=None):
+		"""
+		Wait until every pending job has been started.
+
+		:return: True if there are no more pending jobs.
+		"""
+		with self._cond:
+			self._cond.wait_for(lambda: not self.pending, timeout)
+			return not self.pending
+
+	def wait(self, timeout=None):
+		"""
+		Wait until every job has finished.
+
+		:return: True if all jobs finished.
+		"""
+		with self._cond:
+			self._cond.wait_for(lambda: not self.pending and not self.running, timeout)
+			return not self.pending and not self.running
+
+
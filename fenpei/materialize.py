@@ -0,0 +1,96 @@
+
+"""
+Ways to put a source file (without substitutions) into a job directory: symlink, hardlink, reflink (a copy-on-write
+clone, on file systems like btrfs and xfs) or copy. If a way is not possible, e.g. hard links between file systems,
+the next one from FALLBACKS is used.
+
+Note that hard links share their permissions with the source file.
+"""
+
+from errno import EXDEV, EOPNOTSUPP, ENOTTY, EINVAL, EPERM
+from os import link, remove, stat, symlink
+from os.path import dirname
+from shutil import copyfile
+from threading import Lock
+
+try:
+	from fcntl import ioctl
+except ImportError:
+	ioctl = None
+
+
+""" Linux ioctl request to clone a file. """
+FICLONE = 0x40049409
+
+MODES = ('symlink', 'hardlink', 'reflink', 'copy')
+
+FALLBACKS = {
+	'symlink': 'copy',
+	'hardlink': 'reflink',
+	'reflink': 'copy',
+	'copy': None,
+}
+
+""" Errors that mean a mode doesn't work between two file systems at all (rather than for one file). """
+UNSUPPORTED_ERRORS = frozenset((EXDEV, EOPNOTSUPP, ENOTTY, EINVAL))
+
+""" Errors after which the next mode is tried; e.g. EPERM for hard links to files of other users (on systems with
+protected hardlinks), which only concerns that file. Other errors (like an existing destination) are raised. """
+FALLBACK_ERRORS = UNSUPPORTED_ERRORS | frozenset((EPERM,))
+
+_unsupported = set()
+_unsupported_lock = Lock()
+
+
+def reflink(source, dest):
+	"""
+	Clone `source` to `dest`, sharing the data until either is changed.
+	"""
+	if ioctl is None:
+		raise OSError(EOPNOTSUPP, 'reflinks are not supported on this platform')
+	with open(source, 'rb') as src:
+		with open(dest, 'wb') as dst:
+			try:
+				ioctl(dst.fileno(), FICLONE, src.fileno())
+				return
+			except (IOError, OSError):
+				pass
+	remove(dest)
+	raise OSError(EOPNOTSUPP, 'could not clone "{0:s}"'.format(source))
+
+
+MAKERS = {
+	'symlink': symlink,
+	'hardlink': link,
+	'reflink': reflink,
+	'copy': copyfile,
+}
+
+
+def materialize(source, dest, mode='symlink'):
+	"""
+	Put `source` at `dest` using `mode`, or the fallbacks of that mode if it doesn't work.
+
+	:return: the mode that was used.
+	"""
+	assert mode in MODES, 'unknown mode "{0:}"; use one of {1:}'.format(mode, ', '.join(MODES))
+	devices = None
+	while True:
+		if mode in ('hardlink', 'reflink'):
+			if devices is None:
+				devices = (stat(source).st_dev, stat(dirname(dest) or '.').st_dev)
+			if (mode,) + devices in _unsupported:
+				mode = FALLBACKS[mode]
+				continue
+		try:
+			MAKERS[mode](source, dest)
+			return mode
+		except (IOError, OSError) as err:
+			if FALLBACKS[mode] is None or err.errno not in FALLBACK_ERRORS:
+				raise
+			if devices is not None and err.errno in UNSUPPORTED_ERRORS:
+				with _unsupported_lock:
+					_unsupported.add((mode,) + devices)
+			mode = FALLBACKS[mode]
+
+
@@ -0,0 +1,74 @@
+
+"""
+Check specific processes through /proc/<pid>/stat, instead of listing (and parsing) every process with ps.
+"""
+
+from os.path import isdir
+
+
+""" Process states that mean the process is no longer running (zombie or dead). """
+DEAD_STATES = frozenset('ZXx')
+
+
+def has_proc():
+	return isdir('/proc')
+
+
+def parse_stat(line):
+	"""
+	Parse the content of /proc/<pid>/stat. The name is between parentheses and can contain spaces and parentheses
+	itself, so the last closing one ends it.
+
+	:return: dict with pid, name, state and ppid
+	"""
+	head, _, tail = line.rpartition(')')
+	pid, _, name = head.partition('(')
+	fields = tail.split()
+	return {
+		'pid': int(pid),
+		'name': name,
+		'state': fields[0],
+		'ppid': int(fields[1]),
+	}
+
+
+def parse_stats(text):
+	"""
+	Parse the output of remote_stat_cmd (one stat per line), skipping processes that are not running.
+	"""
+	procs = (parse_stat(line) for line in text.splitlines() if line.strip())
+	return [proc for proc in procs if proc['state'] not in DEAD_STATES]
+
+
+def read_stats(pids):
+	"""
+	Read /proc/<pid>/stat on this machine for each of `pids`.
+
+	:return: list of process dicts for the pids that are running
+	"""
+	procs = []
+	for pid in pids:
+		try:
+			with open('/proc/{0:d}/stat'.format(pid), 'r') as fh:
+				proc = parse_stat(fh.read())
+		except (IOError, OSError, ValueError):
+			continue
+		if proc['state'] not in DEAD_STATES:
+			procs.append(proc)
+	return procs
+
+
+def alive_pids(pids):
+	"""
+	:return: frozenset of those `pids` that belong to running processes on this machine.
+	"""
+	return frozenset(proc['pid'] for proc in read_stats(pids))
+
+
+def remote_stat_cmd(pids):
+	"""
+	Shell command that prints /proc/<pid>/stat for each of `pids` that exists, for running on another node.
+	"""
+	return 'cd /proc && cat {0:s} 2>/dev/null; true'.format(' '.join('{0:d}/stat'.format(pid) for pid in pids))
+
+
@@ -10,24 +10,41 @@ Distribute jobs over multiple machines by means of ssh.
 """
 
 from argparse import ArgumentParser, SUPPRESS
-from collections import defaultdict, OrderedDict
+from collections import Counter, defaultdict, OrderedDict
 from datetime import datetime
-from fnmatch import fnmatch
+from fnmatch import filter as fnmatch_filter
 from functools import partial
+from inspect import signature, Parameter
 from logging import warning
 from math import ceil
 from os import remove
 from os.path import basename, join, exists, isfile
-from random import sample
 from subprocess import PIPE
 from subprocess import Popen
 from sys import stdout, stderr
 from time import time, sleep
 from bardeen.inout import reprint
-from fenpei.utils import job_task, compare_jobs, compare_results, job_results
+from fenpei.utils import job_task, jobmap_results, job_results
+from .distribute import DISTRIBUTION_METHODS, distribute_monte_carlo, distribution_cost
 from .job import Job
-from .shell import run_cmds_on
-from .utils import get_pool_light, TMP_DIR, thread_map
+from .job_index import JobIndex
+from .proc import parse_stats, remote_stat_cmd
+from .shell import run_cmds_on, SSHPool
+from .snapshot import ProcessSnapshot
+from .status_index import StatusIndex, job_stamp
+from .utils import get_pool_light, TMP_DIR, thread_map, SourceCache, UnreachableError
+
+
+""" Whether the .prepare() of a job class accepts a `sources` argument; see _accepts_sources. """
+_PREPARE_SOURCES = {}
+
+
+def _accepts_sources(job):
+	cls = type(job)
+	if cls not in _PREPARE_SOURCES:
+		params = signature(cls.prepare).parameters.values()
+		_PREPARE_SOURCES[cls] = any(param.name == 'sources' or param.kind == Parameter.VAR_KEYWORD for param in params)
+	return _PREPARE_SOURCES[cls]
 
 
 class Queue(object):
@@ -40,12 +57,31 @@ class Queue(object):
 		self.weight = None
 		self.limit = None
 		self.jobs = []
+		""" Index of .jobs by path and parameters, which follows .jobs; see _indexed. """
+		self.job_index = JobIndex(self.jobs)
 		self.nodes = []
 		self.slots = []
 		self.distribution = {}
-		self.process_list = {}
-		self.process_time = {}
 		self.parallel = None
+		""" Number of threads for parallel work on jobs (like status checks); None for utils.THREAD_WORKERS. """
+		self.thread_workers = None
+		""" Processes of all nodes; set .process_snapshot.max_age to change how often it is refreshed. """
+		self.process_snapshot = ProcessSnapshot(max_age=3)
+		""" Number of nodes that are contacted concurrently (e.g. for probing, starting jobs or loading processes). """
+		self.node_workers = 16
+		""" How processes are found: 'proc' reads /proc/<pid>/stat for just the pids of jobs, 'ps' lists everything. """
+		self.process_listing = 'proc'
+		self.watched_pids = {}
+		self.probe_timeout = 10
+		""" Maximum number of jobs started on a node in one remote command. """
+		self.launch_chunk = 200
+		""" Algorithm for distributing jobs over nodes; see `fenpei.distribute`. """
+		self.distribution_method = 'lpt'
+		self.distribution_stats = {}
+		""" Set status_index to True to remember finished jobs on disk, see `fenpei.status_index`. """
+		self.status_index = False
+		""" Set ssh_pool to None to use a separate ssh connection for every command. """
+		self.ssh_pool = SSHPool()
 		if jobs:
 			self.add_jobs(jobs)
 		if summary_func is not None:
@@ -58,6 +94,23 @@ class Queue(object):
 		if level <= self.show:
 			stdout.write(txt + '\n')
 
+	@property
+	def node_workers(self):
+		return self._node_workers
+
+	@node_workers.setter
+	def node_workers(self, workers):
+		""" the process snapshot loads nodes with the same concurrency """
+		self._node_workers = workers
+		self.process_snapshot.workers = workers
+
+	def close(self):
+		"""
+		Close any persistent connections to nodes (also happens automatically at exit).
+		"""
+		if self.ssh_pool is not None:
+			self.ssh_pool.close()
+
 	def all_nodes(self):
 		"""
 		Get a list of all nodes (their ssh addresses).
@@ -82,24 +135,41 @@ class Queue(object):
 			if not len(self.nodes):
 				self._log('no nodes found; no availability checked', level=2)
 				return
-		self.slots = []
 		self._log('checking node availability', level=1)
-		for node in self.nodes:
-			outps = run_cmds_on(cmds = ['grep \'model name\' /proc/cpuinfo | wc -l', 'uptime'], node = node, queue = self)
-			if len(outps) == 2:
+		probe_start = time()
+		probes = thread_map(self._probe_node, self.nodes, workers=self.node_workers)
+		self.nodes, self.slots = [], []
+		for node, proc_count, load_1min, latency in probes:
+			if proc_count is not None:
 				""" one slot for every 100% processor available """
-				proc_count = int(outps[0])
-				load_1min = float(outps[1].split()[-3].replace(',', ''))
+				self.nodes.append(node)
 				self.slots.append(max(proc_count - load_1min, 0))
-				self._log('%2d slots assigned to %6s - 1min cpu %4d%% on %d processors' % (round(self.slots[-1]), self.short_node_name(node), 100 * load_1min, proc_count), level=2)
+				self._log('%2d slots assigned to %6s - 1min cpu %4d%% on %d processors (%.2fs)' % (round(self.slots[-1]), self.short_node_name(node), 100 * load_1min, proc_count, latency), level=2)
 			else:
-				""" not accessible for some reason """
-				self._log('%s not accessible' % node)
-				self.nodes.remove(node)
+				""" not accessible for some reason (including timeouts) """
+				self._log('%s not accessible (%.2fs)' % (node, latency))
+		slowest = max(probes, key=lambda probe: probe[3])
+		self._log('probed %d nodes in %.2fs (slowest %s: %.2fs)' % (len(probes), time() - probe_start, self.short_node_name(slowest[0]), slowest[3]), level=2)
 		self._log('found %d idle processors on %d nodes' % (sum(self.slots), len(self.nodes)))
 		self.save_nodes()
 		return True
 
+	def _probe_node(self, node):
+		"""
+		Find the processor count and load of a single node, giving up after `probe_timeout` seconds.
+
+		:return: tuple (node, proc_count, load_1min, latency); counts are None if the node is not accessible
+		"""
+		probe_start = time()
+		outps = run_cmds_on(cmds = ['grep \'model name\' /proc/cpuinfo | wc -l', 'uptime'], node = node, queue = self, timeout = self.probe_timeout)
+		latency = time() - probe_start
+		try:
+			proc_count = int(outps[0])
+			load_1min = float(outps[1].split()[-3].replace(',', ''))
+		except (TypeError, IndexError, ValueError):
+			return node, None, None, latency
+		return node, proc_count, load_1min, latency
+
 	def save_nodes(self):
 		"""
 		Save the list of nodes to cache.
@@ -146,12 +216,14 @@ class Queue(object):
 			self.slots = [float(slot) for slot in fh.read().split()]
 		return True
 
-	def distribute_jobs(self, jobs = None, max_reject_spree = None):
+	def distribute_jobs(self, jobs = None, max_reject_spree = None, method = None):
 		"""
-		Distribute jobs favourably by means of kind-of-Monte-Carlo (only favourable moves).
+		Distribute jobs favourably over the nodes, using .distribution_method unless another `method` is given.
 
 		:param jobs: (optional) the jobs to be distributed; uses self.jobs if not provided
-		:param max_reject_spree: (optional) stopping criterion; stop when this many unfavourable moves tried in a row
+		:param max_reject_spree: (optional) stopping criterion for 'montecarlo'; stop when this many unfavourable moves tried in a row
+			(only for 'montecarlo'; a ValueError is raised if it is given for another method)
+		:param method: (optional) 'lpt' (deterministic), 'montecarlo' (random) or a callable, see `fenpei.distribute`
 		:return: distribution, a dictionary with node *indixes* as keys and lists of jobs on that node as values
 		"""
 		if not len(self.slots) > 0:
@@ -159,58 +231,36 @@ class Queue(object):
 		if jobs is None:
 			jobs = self.jobs
 		assert len(self.nodes) == len(self.slots)
-		# max_reject_spree = 2 * len(self.nodes) if max_reject_spree is None else max_reject_spree
+		assert len(self.nodes) > 0, 'there are no nodes to distribute jobs over'
+		method = self.distribution_method if method is None else method
+		if max_reject_spree is not None and not (isinstance(method, str) and method == 'montecarlo'):
+			raise ValueError('max_reject_spree is only used by the "montecarlo" distribution method, not by "{0:}"'
+				.format(getattr(method, '__name__', method)))
 		self._log('distributing %d jobs with weight %d over %d slots' % (len(jobs), self.total_weight(jobs), sum(self.slots)))
-		def cost(weight_1, slots_1, weight_2, slots_2):
-			return max(weight_1 - slots_1, 0) ** 2 + max(weight_2 - slots_2, 0) ** 2 + slots_1 / max(weight_1, 1) + slots_2 / max(weight_2, 1)
-		""" clear the list """
+		weights = [job.weight for job in jobs]
+		stats = {}
+		distribute_start = time()
+		if hasattr(method, '__call__'):
+			assignment = method(weights, self.slots)
+		elif method == 'montecarlo' and max_reject_spree is not None:
+			assignment = distribute_monte_carlo(weights, self.slots, max_reject_spree=max_reject_spree, stats=stats)
+		elif method in DISTRIBUTION_METHODS:
+			assignment = DISTRIBUTION_METHODS[method](weights, self.slots, stats=stats)
+		else:
+			raise ValueError('distribution method "{0:}" not known; use a callable or one of {1:s}'
+				.format(method, ', '.join(sorted(DISTRIBUTION_METHODS.keys()))))
+		stats['time'] = time() - distribute_start
+		self.distribution_stats = stats
 		distribution = {}
 		for node_nr in range(len(self.nodes)):
 			distribution[node_nr] = []
-		""" random initial job distribution """
-		for job in jobs:
-			node_nr = sample(distribution.keys(), 1)[0]
-			distribution[node_nr].append(job)
-		""" repeat switching until nothing favourable is found anymore """
-		reject_spree, steps = 0, 0
-		while reject_spree < 100:
-			node1, node2 = sample(distribution.keys(), 2)
-			if len(distribution[node1]) > 0:
-				steps += 1
-				cost_before = cost(self.total_weight(distribution[node1]), self.slots[node1],
-								   self.total_weight(distribution[node2]), self.slots[node2])
-				item1 = sample(range(len(distribution[node1])), 1)[0]
-				cost_switch = cost_move = None
-				if len(distribution[node2]) > 0:
-					""" compare the cost of switching two items """
-					item2 = sample(range(len(distribution[node2])), 1)[0]
-					cost_switch = cost(self.total_weight(distribution[node1]) - distribution[node1][item1].weight + distribution[node2][item2].weight, self.slots[node1],
-									   self.total_weight(distribution[node2]) + distribution[node1][item1].weight - distribution[node2][item2].weight, self.slots[node2])
-				if cost_before > 0:
-					""" compare the cost of moving an item """
-					cost_move = cost(self.total_weight(distribution[node1]) - distribution[node1][item1].weight, self.slots[node1],
-									 self.total_weight(distribution[node2]) + distribution[node1][item1].weight, self.slots[node2])
-				""" note that None < X for any X, so this works even if only cost_before has an actual value """
-				if (cost_switch < cost_before and cost_switch is not None) or (cost_move < cost_before and cost_move is not None):
-					if cost_switch < cost_move and cost_switch is not None:
-						""" switch """
-						tmp = distribution[node1][item1]
-						distribution[node1][item1] = distribution[node2][item2]
-						distribution[node2][item2] = tmp
-					elif cost_move is not None:
-						""" move (move if equal, it's easier after all) """
-						distribution[node2].append(distribution[node1][item1])
-						del distribution[node1][item1]
-					reject_spree = 0
-				else:
-					""" not favorable; don't move """
-					reject_spree += 1
-			else:
-				""" too many empty slots means few rejectsbut lots of iterations, so in itself a sign to stop """
-				reject_spree += 0.1
+		for job, node_nr in zip(jobs, assignment):
+			distribution[int(node_nr)].append(job)
 		self.distribution = distribution
 		""" report results """
-		self._log('distribution found after {0:d} steps'.format(steps))
+		self._log('distribution found by {0:} after {1:} steps in {2:.3f}s with cost {3:.2f}'.format(
+			getattr(method, '__name__', method), stats.get('steps', '?'), stats['time'],
+			distribution_cost(weights, self.slots, assignment)))
 		self._log(self.text_distribution(distribution), level=2)
 		return self.distribution
 
@@ -260,20 +310,96 @@ class Queue(object):
 
 	def processes(self, node):
 		"""
-		Get processes on specific node and cache them.
+		Get processes on specific node (from the cached snapshot of all nodes).
+		"""
+		procs = self.process_snapshot.get_processes(node, self._load_processes, self._snapshot_refresh)
+		if procs is None:
+			raise UnreachableError('can not connect to %s; are you on the cluster?' % node)
+		return procs
+
+	def process_ids(self, node):
+		"""
+		Get the set of process ids on specific node (from the cached snapshot of all nodes), to check if jobs run.
+		"""
+		pids = self.process_snapshot.get_pids(node, self._load_processes, self._snapshot_refresh)
+		if pids is None:
+			raise UnreachableError('can not connect to %s; are you on the cluster?' % node)
+		return pids
+
+	def _snapshot_refresh(self):
+		"""
+		Called before the process snapshot loads nodes.
+
+		:return: the nodes that have jobs, so that they are all loaded at once rather than one at a time.
+		"""
+		if self.process_listing == 'proc':
+			self.find_watched_pids()
+			return list(self.watched_pids.keys())
+		if self.process_listing == 'ps':
+			return list(set(job.node for job in self.jobs if job.node is not None))
+		return None
+
+	def find_watched_pids(self):
+		"""
+		Find the process ids of jobs for each node (loading them for jobs that don't have one yet), so that only
+		those have to be checked. Called before the process snapshot is refreshed; during a status pass (see
+		get_status) this happens only once, also if more nodes are loaded later in the pass.
+
+		Only numeric pids can be checked in /proc; other ids (like scheduler job ids) are not watched, which is why
+		SlurmQueue and QsubQueue use their scheduler's listing instead.
+		"""
+		if self.watched_pids is not None and self.process_snapshot.is_pinned():
+			return
+		unloaded = [job for job in self.jobs if job.pid is None]
+		if unloaded:
+			thread_map(lambda job: job.load(), unloaded, workers=self.thread_workers)
+		watched, unwatched = defaultdict(set), 0
+		for job in self.jobs:
+			if job.node is None or job.pid is None:
+				continue
+			if isinstance(job.pid, int):
+				watched[job.node].add(job.pid)
+			elif isinstance(job.pid, str) and job.pid.isdigit():
+				watched[job.node].add(int(job.pid))
+			else:
+				unwatched += 1
+		if unwatched:
+			self._log('%d jobs have a process id that is not a number and can not be checked in /proc' % unwatched, level=2)
+		self.watched_pids = dict(watched)
+
+	def _load_processes(self, node):
+		"""
+		Load the processes on a node; used by the process snapshot.
+
+		:return: list of process dicts, or None if the node could not be reached
+		"""
+		if self.process_listing != 'proc':
+			return self._load_processes_ps(node)
+		pids = sorted((self.watched_pids or {}).get(node, ()))
+		if not pids:
+			return []
+		self._log('checking %d processes on %s' % (len(pids), node), level=3)
+		outp = run_cmds_on([
+			remote_stat_cmd(pids),
+		], node = node, queue = self)
+		if outp is None:
+			return None
+		process_list = parse_stats(outp[0])
+		for proc in process_list:
+			proc['node'] = node
+		return process_list
+
+	def _load_processes_ps(self, node):
+		"""
+		Load all processes on a node from `ps ux`.
 		"""
-		if node in self.process_time.keys():
-			if time() - self.process_time[node] < 3:
-				return self.process_list[node]
 		self._log('loading processes for %s' % node, level=3)
-		self.process_time[node] = time()
-		self.process_list[node] = []
 		outp = run_cmds_on([
 			'ps ux',
 		], node = node, queue = self)
 		if outp is None:
-			self._log('can not connect to %s; are you on the cluster?' % node)
-			exit()
+			return None
+		process_list = []
 		for line in outp[0].splitlines()[1:]:
 			cells = line.split()
 			ps_dict = {
@@ -285,8 +411,8 @@ class Queue(object):
 				'node': node,
 			}
 			if not ps_dict['name'] == '-bash' and not ps_dict['name'].startswith('sshd: ') and not ps_dict['name'] == 'ps ux':
-				self.process_list[node].append(ps_dict)
-		return self.process_list[node]
+				process_list.append(ps_dict)
+		return process_list
 
 	def add_job(self, job):
 		"""
@@ -309,11 +435,34 @@ class Queue(object):
 	def get_jobs(self):
 		return self.jobs
 
+	def _indexed(self):
+		"""
+		The index of .jobs, after indexing the jobs that were added (or rebuilding it if .jobs was replaced).
+		"""
+		if self.job_index.jobs is not self.jobs or self.job_index.count > len(self.jobs):
+			self.job_index = JobIndex(self.jobs, param_cache_size=self.job_index.param_cache_size)
+		else:
+			self.job_index.update()
+		return self.job_index
+
 	def compare_jobs(self, parameters, filter=None):
-		return compare_jobs(self.jobs, parameters, filter=filter)
+		return self._indexed().compare_jobs(parameters, filter=filter)
 	
 	def compare_results(self, parameters, filter=None):
-		return compare_results(self.jobs, parameters, filter=filter)
+		return jobmap_results(self.compare_jobs(parameters, filter=filter))
+
+	def duplicate_parameters(self):
+		"""
+		:return: list of groups of jobs with identical parameters but different names (for jobs with a param_hash).
+		"""
+		return self._indexed().duplicate_parameters()
+
+	def show_duplicate_parameters(self, *args, **kwargs):
+		groups = self.duplicate_parameters()
+		for jobs in groups:
+			self._log('same parameters: {0:s}'.format(', '.join(
+				join(job.batch_name, job.name) if job.batch_name else job.name for job in jobs)))
+		self._log('found {0:d} groups of jobs with identical parameters'.format(len(groups)))
 	
 	def result(self, parallel=None, *args, **kwargs):
 		parallel = self.parallel if parallel is None else parallel
@@ -371,13 +520,32 @@ class Queue(object):
 		cmds = [
 			'cd \'%s\'' % job.directory,
 			cmd,
-			'echo "$\!"' # pid
+			'echo "\\$!"' # pid
 		]
 		outp = run_cmds_on(cmds, node = job.node, queue = self)
 		if not outp:
 			raise self.CmdException('job %s could not be started' % self)
 		return str(int(outp[-1]))
 
+	def run_cmds_batch(self, jobs, cmds, node):
+		"""
+		Start several jobs on one node using a single remote command script.
+
+		:param jobs: the jobs that are being started
+		:param cmds: for each job, the command to run in its directory (nohup, & and output redirection are added)
+		:param node: the node to start the jobs on
+		:return: list of process ids (str) in the same order as jobs, with None for jobs that could not be started
+		"""
+		script = []
+		for job, cmd in zip(jobs, cmds):
+			assert job.directory
+			script.append('cd \'{0:s}\' && {{ nohup {1:s} &> all_output.txt & echo "\\$!"; }} || echo "-"'
+				.format(job.directory, cmd))
+		outp = run_cmds_on(script, node = node, queue = self)
+		if not outp or len(outp) != len(jobs):
+			raise self.CmdException('jobs on %s could not be started' % node)
+		return [pid if pid.isdigit() else None for pid in outp]
+
 	def stop_job(self, node, pid):
 		"""
 		Kill an individual job, specified by pid given during start ('pid' could also e.g. be a queue number).
@@ -386,15 +554,28 @@ class Queue(object):
 
 	def prepare(self, parallel=None, *args, **kwargs):
 		"""
-		Prepare all the currently added jobs (make files etc).
+		Prepare all the currently added jobs (make files etc). Source files are read once for all jobs, and the jobs
+		are written using a pool of threads if parallel.
 		"""
 		parallel = self.parallel if parallel is None else parallel
+		sources = SourceCache()
+		""" jobs whose .prepare() doesn't accept sources (e.g. custom ones without **kwargs) read files themselves """
+		with_sources, without_sources = job_task('prepare', sources=sources, **kwargs), job_task('prepare', **kwargs)
+		prepare = lambda job: (with_sources if _accepts_sources(job) else without_sources)(job)
 		if parallel:
-			statuses = thread_map(job_task('prepare', **kwargs), self.jobs)
+			statuses = thread_map(prepare, self.jobs, workers=self.thread_workers)
 		else:
-			statuses = (job.prepare(**kwargs) for job in self.jobs)
+			statuses = [prepare(job) for job in self.jobs]
 		prepare_count = sum(int(status) for status in statuses)
 		self._log('prepared %d jobs' % prepare_count)
+		self._log('read %d source files for them' % len(sources.texts), level=2)
+		link_counts = Counter()
+		for job, status in zip(self.jobs, statuses):
+			if status:
+				link_counts.update(getattr(job, 'link_counts', ()))
+		if link_counts:
+			self._log('added files: ' + ', '.join('%d %s' % (count, used) if used == requested else
+				'%d %s (instead of %s)' % (count, used, requested) for (requested, used), count in sorted(link_counts.items())))
 
 	def start(self, parallel=None, verbosity=0, *args, **kwargs):
 		"""
@@ -408,15 +589,53 @@ class Queue(object):
 		self._log('starting {0:d} jobs with weight {1:d}'.format(
 			len(start_jobs), sum((job.weight for job in start_jobs), 0)), level=2)
 		distribution = self.distribute_jobs(jobs=start_jobs)
-		start_cnt = 0
-		for node_nr, jobs in distribution.items():
-			""" Removed parallism here because it made things slower (and more complicated). """
-			for job in jobs:
-				node = self.nodes[node_nr]
-				if job.is_started():
-					job.cleanup(**kwargs)
+		node_jobs = [(self.nodes[node_nr], jobs) for node_nr, jobs in distribution.items() if jobs]
+		parallel = self.parallel if parallel is None else parallel
+		start_node = partial(self._start_on_node, **kwargs)
+		if parallel and len(node_jobs) > 1:
+			start_counts = thread_map(start_node, node_jobs, workers=self.node_workers)
+		else:
+			start_counts = [start_node(item) for item in node_jobs]
+		self._log('started {0:d} jobs'.format(sum(start_counts, 0)), level=1)
+
+	def _start_on_node(self, node_jobs, **kwargs):
+		"""
+		Start jobs on a single node; jobs that have a .start_cmd() are started together using run_cmds_batch.
+
+		:param node_jobs: tuple of the node and the list of jobs to start on it
+		:return: the number of jobs started
+		"""
+		node, jobs = node_jobs
+		batch_jobs, batch_cmds, start_cnt = [], [], 0
+		for job in jobs:
+			if job.is_started():
+				job.cleanup(**kwargs)
+			cmd = job.batch_start_cmd()
+			if cmd is None:
 				start_cnt += job.start(node, **kwargs)
-		self._log('started {0:d} jobs'.format(start_cnt, level=1))
+			else:
+				job._start_pre(**kwargs)
+				batch_jobs.append(job)
+				batch_cmds.append(cmd)
+		return start_cnt + self._start_batch(node, batch_jobs, batch_cmds, **kwargs)
+
+	def _start_batch(self, node, jobs, cmds, **kwargs):
+		"""
+		Start jobs (already checked by ._start_pre) on `node` by running `cmds`, .launch_chunk jobs per remote command.
+
+		:return: the number of jobs started
+		"""
+		start_cnt = 0
+		for k in range(0, len(jobs), self.launch_chunk):
+			chunk = jobs[k:k + self.launch_chunk]
+			pids = self.run_cmds_batch(chunk, cmds[k:k + self.launch_chunk], node)
+			for job, pid in zip(chunk, pids):
+				if pid is None:
+					self._log('job {0:} could not be started on {1:}'.format(job, node))
+					continue
+				job._start_post(node, pid, check_running=False, **kwargs)
+				start_cnt += 1
+		return start_cnt
 
 	def select_start_jobs(self, weight, limit, restart, job_status=None):
 		"""
@@ -487,24 +706,18 @@ class Queue(object):
 					int((avail - used) / 1024), int(100 * (1 - float(used) / avail))))
 
 	def _same_path_check(self, fail=False):
-		pths = set()
-		found = 0
-		for job in self.jobs:
-			if (job.batch_name, job.name) in pths:
-				if job.batch_name:
-					pthname = '{0:s}/{1:s}'.format(job.batch_name, job.name)
-				else:
-					pthname = job.name
-				msg = 'there are multiple jobs with location {0:s}'.format(pthname)
-				if fail:
-					raise AssertionError(msg)
-				found += 1
-				if found >= 3:
-					warning(msg + '. Stopping duplicate checks now.')
-					break
-				warning(msg)
-			pths.add((job.batch_name, job.name))
-		return pths
+		for found, job in enumerate(self._indexed().duplicate_paths):
+			if job.batch_name:
+				pthname = '{0:s}/{1:s}'.format(job.batch_name, job.name)
+			else:
+				pthname = job.name
+			msg = 'there are multiple jobs with location {0:s}'.format(pthname)
+			if fail:
+				raise AssertionError(msg)
+			if found >= 2:
+				warning(msg + '. Stopping duplicate checks now.')
+				break
+			warning(msg)
 
 	def fix(self, parallel=None, *args, **kwargs):
 		"""
@@ -512,7 +725,7 @@ class Queue(object):
 		"""
 		parallel = self.parallel if parallel is None else parallel
 		if parallel:
-			statuses = thread_map(job_task('fix', **kwargs), self.jobs)
+			statuses = thread_map(job_task('fix', **kwargs), self.jobs, workers=self.thread_workers)
 		else:
 			statuses = (job.fix(**kwargs) for job in self.jobs)
 		fix_count = sum(int(status) for status in statuses)
@@ -534,7 +747,7 @@ class Queue(object):
 		parallel = self.parallel if parallel is None else parallel
 		if parallel:
 			#statuses = get_pool_light().map(job_task('cleanup', **kwargs), self.jobs)
-			statuses = thread_map(job_task('cleanup', skip_conflicts=self.restart, **kwargs), self.jobs)
+			statuses = thread_map(job_task('cleanup', skip_conflicts=self.restart, **kwargs), self.jobs, workers=self.thread_workers)
 		else:
 			statuses = (job.cleanup(skip_conflicts=self.restart, **kwargs) for job in self.jobs)
 		cleanup_count = sum(int(status) for status in statuses)
@@ -545,13 +758,13 @@ class Queue(object):
 		Get list of statusses.
 		"""
 		parallel = self.parallel if parallel is None else parallel
-		if parallel:
-			status_res = thread_map(job_task('find_status', **kwargs), self.jobs)
-			statuses = dict(zip(self.jobs, status_res))
-		else:
-			statuses = {}
-			for job in self.jobs:
-				statuses[job] = job.find_status(**kwargs)
+		with self.process_snapshot.pinned():
+			""" jobs may have been started since the last pass, so find the pids to watch again (once) """
+			self.watched_pids = None
+			if self.status_index:
+				statuses = self._find_statuses_indexed(parallel=parallel, **kwargs)
+			else:
+				statuses = self._find_statuses(self.jobs, parallel=parallel, **kwargs)
 		# status_count = defaultdict(int)
 		status_list = defaultdict(list)
 		for job, status in statuses.items():
@@ -559,6 +772,41 @@ class Queue(object):
 			status_list[status].append(job)
 		return status_list
 
+	def _find_statuses(self, jobs, parallel, **kwargs):
+		"""
+		:return: dictionary of job -> status.
+		"""
+		if parallel:
+			status_res = thread_map(job_task('find_status', **kwargs), jobs, workers=self.thread_workers)
+			statuses = dict(zip(jobs, status_res))
+		else:
+			statuses = {}
+			for job in jobs:
+				statuses[job] = job.find_status(**kwargs)
+		return statuses
+
+	def _find_statuses_indexed(self, parallel, **kwargs):
+		"""
+		Like _find_statuses, but skip jobs with a final status in the status index, unless their files changed.
+		"""
+		indices, stamps, statuses, check_jobs = {}, {}, {}, []
+		for job in self.jobs:
+			if job.batch_name not in indices:
+				indices[job.batch_name] = StatusIndex(job.batch_name)
+			stamps[job] = job_stamp(job)
+			status = indices[job.batch_name].lookup(job.name, stamps[job])
+			if status is None:
+				check_jobs.append(job)
+			else:
+				job.status = statuses[job] = status
+		self._log('status index: {0:d} of {1:d} jobs need to be checked'.format(len(check_jobs), len(self.jobs)), level=3)
+		statuses.update(self._find_statuses(check_jobs, parallel=parallel, **kwargs))
+		for job in check_jobs:
+			indices[job.batch_name].record(job.name, statuses[job], stamps[job])
+		for index in indices.values():
+			index.save()
+		return statuses
+
 	def show_status(self, status_list, verbosity=0):
 		"""
 		Show list of statusses.
@@ -689,7 +937,8 @@ class Queue(object):
 		"""
 		Filter jobs by pattern or file, for --jobs argument.
 		"""
-		keep_jobs = []
+		index = self._indexed() if jobs is self.jobs else JobIndex(jobs)
+		keep_ids = set()
 		if '/' in arg or '\\' in arg:
 			self._log('jobs argument "{0:s}" interpreted as file since it contains / or \\'.format(arg), level=3)
 			assert isfile(arg), '--jobs argument seems to be a file path, but the file does not exist'
@@ -697,39 +946,33 @@ class Queue(object):
 				requested = set(pth.strip() for pth in fh.read().splitlines())
 				if '' in requested: requested.remove('')
 				self._log('filtering jobs by {0:d} names from "{1:s}"'.format(len(requested), arg), level=2)
-				for job in jobs:
-					if job.name in requested:
-						keep_jobs.append(job)
-						requested.remove(job.name)
-				# self.jobs = keep
-				unmatched = requested
+				unmatched = []
+				for name in requested:
+					found = index.by_name(name)
+					keep_ids.update(id(job) for job in found)
+					if not found:
+						unmatched.append(name)
 		else:
 			parts = arg.split()
 			self._log('{0:d} jobs arguments interpreted as patterns since they do not contains / or \\'
 				.format(len(parts)), level=3)
 			requested = dict((ptrn, 0) for ptrn in parts)
 			self._log('filtering jobs by {0:d} patterns'.format(len(requested)), level=2)
-			if len(jobs) * len(requested) > 500:
+			""" literal names are looked up directly, only real patterns are matched against all names """
+			patterns = [ptrn for ptrn in requested.keys() if any(char in ptrn for char in '*?[')]
+			if len(jobs) * len(patterns) > 500:
 				warning('many jobs and/or many --jobs filters; this may take a while')
-			for job in jobs:
-				do_keep = False
-				if job.name in requested:
-					# Shortcut without patterns
-					requested[job.name] += 1
-					do_keep = True
-				else:
-					# No literal match, try patterns (slow)
-					for ptrn in requested.keys():
-						if fnmatch(job.name, ptrn):
-							requested[ptrn] += 1
-							do_keep = True
-				if do_keep:
-					keep_jobs.append(job)
+			names = index.names() if patterns else ()
+			for ptrn in requested.keys():
+				for name in (fnmatch_filter(names, ptrn) if ptrn in patterns else (ptrn,)):
+					found = index.by_name(name)
+					requested[ptrn] += len(found)
+					keep_ids.update(id(job) for job in found)
 			unmatched = tuple(ptrn for ptrn, cnt in requested.items() if not cnt)
 		if unmatched:
 			raise ValueError('Specifically requested job(s) [{0:s}] was/were not found.'
 				.format(', '.join(unmatched)))
-		return keep_jobs
+		return [job for job in jobs if id(job) in keep_ids]
 	
 	def run_argv(self):
 		"""
@@ -766,6 +1009,7 @@ class Queue(object):
 		parser.add_argument('-s', '--status', dest='actions', action='append_const', const=self.status, help='show job status')
 		parser.add_argument('-m', '--monitor', dest='actions', action='append_const', const=self.continuous_status, help='show job status every few seconds')
 		parser.add_argument('-x', '--result', dest='actions', action='append_const', const=wrap_summary, help='run analysis code to summarize results')
+		parser.add_argument('--duplicates', dest='actions', action='append_const', const=self.show_duplicate_parameters, help='list jobs that have identical parameters but different names')
 		parser.add_argument('-t', '--whyfail', dest='actions', action='append_const', const=self.crash_reason, help ='print a list of failed jobs with the reason why they failed')
 		parser.add_argument('-j', '--serial', dest='parallel', action='store_false', help='make job commands (start, fix, etc) serial (parallel is faster but order is inconsistent)')
 		parser.add_argument('--jobs', dest='jobs', action='store', type=str, help=('if argument contains \ or /, it should be a file containing a job name per line; '
@@ -832,8 +1076,12 @@ class Queue(object):
 
 		self.parallel = args.parallel
 		if actions:
-			for action in actions:
-				action(verbosity=args.verbosity, parallel=args.parallel, force=args.force)
+			try:
+				for action in actions:
+					action(verbosity=args.verbosity, parallel=args.parallel, force=args.force)
+			except UnreachableError as err:
+				self._log(str(err))
+				exit(1)
 
 		return [str(action) for action in actions]
 
@@ -3,12 +3,33 @@
 Run jobs on local machine, e.g. for testing.
 """
 
+from atexit import register
+from multiprocessing import cpu_count
+from fenpei.local_pool import LocalPool
+from fenpei.proc import has_proc, read_stats
 from fenpei.queue import Queue
 from fenpei.shell import run_cmds
 
 
 class LocalQueue(Queue):
 
+	def __init__(self, jobs=None, summary_func=None, slots=None, use_pool=False):
+		"""
+		:param slots: total job weight to run at once (defaults to the number of processors).
+		:param use_pool: start jobs directly from this process, keeping jobs that don't fit yet in a pending queue
+			(see `fenpei.local_pool`); fenpei waits at exit until every pending job is started.
+		"""
+		self.local_slots = slots or cpu_count()
+		self.local_pool = LocalPool(slots=self.local_slots) if use_pool else None
+		super(LocalQueue, self).__init__(jobs=jobs, summary_func=summary_func)
+		if self.local_pool is not None:
+			register(self._join_pool)
+
+	def _join_pool(self):
+		if self.local_pool.pending:
+			self._log('waiting until {0:d} pending jobs are started'.format(len(self.local_pool.pending)))
+		self.local_pool.join()
+
 	def all_nodes(self):
 		self.nodes = ['localhost']
 		self._log('nodes: localhost', level=2)
@@ -17,11 +38,11 @@ class LocalQueue(Queue):
 	def node_availability(self):
 		if not self.nodes:
 			self.all_nodes()
-		self.slots = [10]
+		self.slots = [self.local_slots]
 		self._log('availability: localhost', level=2)
 		return True
 
-	def distribute_jobs(self, jobs=None, max_reject_spree=None):
+	def distribute_jobs(self, jobs=None, max_reject_spree=None, method=None):
 		if not self.slots:
 			self.node_availability()
 		if jobs is None:
@@ -32,22 +53,53 @@ class LocalQueue(Queue):
 		self._log('distribution: all on localhost', level=2)
 		return self.distribution
 
-	def processes(self, node):
+	def _load_processes(self, node):
 		"""
-		Get processes on specific node and cache them.
+		Check the processes of jobs on the local machine (from /proc if available, otherwise list them with ps).
 		"""
+		if self.process_listing == 'proc' and has_proc():
+			pids = set((self.watched_pids or {}).get(node, ()))
+			if self.local_pool is not None:
+				pids.update(self.local_pool.running_pids())
+			self._log('checking %d processes on %s' % (len(pids), node), level=3)
+			process_list = read_stats(sorted(pids))
+			for proc in process_list:
+				proc['node'] = node
+			return process_list
 		self._log('loading processes for %s' % node, level=3)
-		self.process_list[node] = []
 		outp = run_cmds([
 			'ps ux',
 		], queue = self)
+		if outp is None:
+			return None
+		process_list = []
 		for line in outp[0].splitlines()[1:]:
 			cells = line.split()
-			self.process_list[node].append({
+			process_list.append({
 				'pid':  int(cells[1]),
 				'node': node,
 			})
-		return self.process_list[node]
+		return process_list
+
+	def _start_batch(self, node, jobs, cmds, **kwargs):
+		"""
+		See Queue._start_batch(), but with .use_pool, hand the jobs to the local pool, which starts them when
+		there are free slots; jobs that have to wait are counted as queued rather than started.
+		"""
+		if self.local_pool is None:
+			return super(LocalQueue, self)._start_batch(node, jobs, cmds, **kwargs)
+		started = []
+		for job, cmd in zip(jobs, cmds):
+			def start_post(pid, job=job):
+				started.append(job)
+				job._start_post(node, pid, check_running=False, **kwargs)
+			def start_failed(err, job=job):
+				self._log('job {0:} could not be started: {1:}'.format(job, err))
+			self.local_pool.submit(job, cmd, on_start=start_post, on_fail=start_failed)
+		start_cnt = len(started)
+		if self.local_pool.pending:
+			self._log('{0:d} jobs are queued until slots are free'.format(len(self.local_pool.pending)), level=1)
+		return start_cnt
 
 	def run_cmd(self, job, cmd):
 		"""
@@ -57,13 +109,19 @@ class LocalQueue(Queue):
 		cmds = [
 			'cd \'{0:s}\';'.format(job.directory),
 			'nohup {0:s} &> all_output.txt &'.format(cmd),
-			'echo "$\!"'  # pid
+			'echo "\\$!"'  # pid
 		]
 		outp = run_cmds(cmds, queue=self)
 		if not outp:
 			raise self.CmdException('job {0:} could not be started'.format(self))
 		return str(int(outp[-1]))
 
+	def run_cmds_batch(self, jobs, cmds, node):
+		"""
+		See Queue.run_cmds_batch(), but run everything on local machine.
+		"""
+		return super(LocalQueue, self).run_cmds_batch(jobs, cmds, node=None)
+
 	def stop_job(self, node, pid):
 		"""
 		Kill an individual job, specified by pid given during start ('pid' could also e.g. be a queue number).
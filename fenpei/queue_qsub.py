@@ -3,22 +3,99 @@
 	Queue using qsub to start jobs.
 """
 
-from os import popen
-from os.path import join
+from os import popen, chmod, fdopen, remove
+from os.path import basename, dirname, join
+from tempfile import mkstemp
+from bardeen.system import mkdirp
 from repoze.lru import lru_cache
 from fenpei.shell import run_cmds
 from fenpei.queue import Queue
+from fenpei.utils import CALC_DIR, UnreachableError
 from re import findall
-from xml.dom.minidom import parse
+from collections import OrderedDict
+from xml.etree.ElementTree import iterparse
+
+
+""" Runs the command for one array task (numbered from 1), in the job directory from the map file. """
+ARRAY_DISPATCH = '''#!/bin/bash
+line="$(sed -n "${{SGE_TASK_ID}}p" '{map_path:s}')"
+cd "${{line%%$'\\t'*}}" || exit 1
+exec bash -c "${{line#*$'\\t'}}" > qsub.out 2> qsub.err
+'''
+
+
+def task_ids(tasks):
+	"""
+	Expand a qstat task specification like '4' or '1-7:2,9' to a list of task ids.
+	"""
+	ids = []
+	for part in tasks.split(','):
+		step = 1
+		if ':' in part:
+			part, step = part.split(':')
+		if '-' in part:
+			first, last = part.split('-')
+			ids.extend(range(int(first), int(last) + 1, int(step)))
+		else:
+			ids.append(int(part))
+	return ids
+
+
+def parse_qstat(source):
+	"""
+	Parse `qstat -xml -r` output incrementally, dropping each job element once it has been read.
+
+	:param source: filename or file object with the xml.
+	:return: OrderedDict of job number to a dictionary of properties; array tasks are stored separately, by
+		'<job number>.<task id>' strings.
+	"""
+	jobs = OrderedDict()
+	parents = []
+	for event, elem in iterparse(source, events=('start', 'end')):
+		if event == 'start':
+			parents.append(elem)
+			continue
+		parents.pop()
+		if elem.tag != 'job_list':
+			continue
+		qstatqueue = elem.findtext('queue_name') or '(no queue yet)'
+		try:
+			node = qstatqueue.split('@')[1].split('.')[0]
+		except IndexError:
+			node = None
+		nr = int(elem.findtext('JB_job_number'))
+		tasks = elem.findtext('tasks')
+		pids = ['{0:d}.{1:d}'.format(nr, task) for task in task_ids(tasks)] if tasks else [nr]
+		for pid in pids:
+			jobs[pid] = {
+				'pid': pid,
+				'name': elem.findtext('JB_name'),
+				'user': elem.findtext('JB_owner'),
+				'queue': qstatqueue,
+				'node': node,
+				'state': elem.findtext('state'),
+			}
+		elem.clear()
+		if parents:
+			parents[-1].remove(elem)
+	return jobs
 
 
 class QsubQueue(Queue):
 
 	DEFAULT_QSUB_NAME = 'queuename'
 
-	def __init__(self, jobs=None, qname=None, summary_func=None):
+	def __init__(self, jobs=None, qname=None, summary_func=None, use_arrays=False):
+		"""
+		:param use_arrays: submit jobs for the same queue together as array jobs (one qsub call).
+		"""
 		self.qname = qname or self.DEFAULT_QSUB_NAME
 		super(QsubQueue, self).__init__(jobs=jobs, summary_func=summary_func)
+		self.process_snapshot.max_age = 2.5
+		self.process_listing = 'qstat'
+		self.use_arrays = use_arrays
+		""" Maximum number of tasks in one array (grid engine's max_aj_tasks is 75000 by default). """
+		self.array_max = 75000
 
 	def all_nodes(self):
 		"""
@@ -34,7 +111,7 @@ class QsubQueue(Queue):
 	def node_availability(self):
 		raise NotImplementedError('this should not be implemented for %s because the qsub-queue does the distributing' % self.__class__)
 
-	def distribute_jobs(self, jobs=None, max_reject_spree=None):
+	def distribute_jobs(self, jobs=None, max_reject_spree=None, method=None):
 		"""
 		Let qsub do the distributing by placing everything in general queue.
 		"""
@@ -46,66 +123,106 @@ class QsubQueue(Queue):
 	@lru_cache(10)
 	def _test_qstat(self):
 		if run_cmds(['qstat'], queue = self) is None:
-			self._log('qstat does not work on this machine; run this code from a node that has access to the queue')
-			exit()
+			raise UnreachableError('qstat does not work on this machine; run this code from a node that has access to the queue')
 
 	def _get_qstat(self):
 		"""
-		Get qstat for current user as a dictionary of properties.
+		Get qstat for current user as a dictionary of properties per job number.
 
 		Based on http://stackoverflow.com/questions/26104116/qstat-and-long-job-names
 		"""
 		f = popen('qstat -xml -r')
-		dom = parse(f)
-		jobelem = dom.getElementsByTagName('job_info')
-		joblist = jobelem[0].getElementsByTagName('job_list')
-		jobs = []
-		for job in joblist:
-			jobstate = job.getElementsByTagName('state')[0].childNodes[0].data
-			try:
-				qstatqueue = job.getElementsByTagName('queue_name')[0].childNodes[0].data
-			except IndexError:
-				qstatqueue = '(no queue yet)'
-			try:
-				node = qstatqueue.split('@')[1].split('.')[0]
-			except IndexError:
-				node = None
-			if 'E' in jobstate:
-				jobs.append(None)
-			jobs.append({
-				'pid': int(job.getElementsByTagName('JB_job_number')[0].childNodes[0].data),
-				'name': job.getElementsByTagName('JB_name')[0].childNodes[0].data,
-				'user': job.getElementsByTagName('JB_owner')[0].childNodes[0].data,
-				'queue': qstatqueue,
-				'node': node,
-				'state': jobstate,
-			})
-		return jobs
+		try:
+			return parse_qstat(f)
+		finally:
+			f.close()
 
-	@lru_cache(maxsize=100, timeout=2.5)
-	def processes(self, node):
+	def _load_processes(self, node):
 		"""
-		Get process info from qstat.
+		Load the qstat queue (for all nodes at once); used by the process snapshot.
 		"""
 		self._test_qstat()
 		self._log('loading processes for %s' % node, level=3)
-		return self._get_qstat()
+		return list(self._get_qstat().values())
+
+	def processes(self, node):
+		"""
+		Get process info from qstat; the node is ignored, there is one snapshot of the queue.
+		"""
+		return super(QsubQueue, self).processes(self.qname)
+
+	def process_ids(self, node):
+		"""
+		Set of queued job ids, to check if jobs are running; the node is ignored.
+		"""
+		return super(QsubQueue, self).process_ids(self.qname)
 
 	def stop_job(self, node, pid):
 		"""
-		Remove individual job from queue.
+		Remove individual job from queue (pid can be an array task, like 123.4).
 		"""
-		run_cmds(['qdel %s' % pid], queue = self)
+		if '.' in str(pid):
+			run_cmds(['qdel {0:s} -t {1:s}'.format(*str(pid).split('.'))], queue = self)
+		else:
+			run_cmds(['qdel %s' % pid], queue = self)
 
-	def run_cmd(self, job, cmd):
+	def run_cmds_batch(self, jobs, cmds, node):
 		"""
-		Start an individual job by means of queueing a shell command.
+		Queue the jobs; one by one, or as array jobs per queue if .use_arrays is set. Qsub does the distributing.
+		"""
+		if not self.use_arrays:
+			return [self.run_cmd(job, cmd) for job, cmd in zip(jobs, cmds)]
+		groups = OrderedDict()
+		for nr, job in enumerate(jobs):
+			groups.setdefault(self._job_queue(job), []).append(nr)
+		pids = [None] * len(jobs)
+		for queue, nrs in groups.items():
+			for k in range(0, len(nrs), self.array_max):
+				chunk = nrs[k:k + self.array_max]
+				if len(chunk) == 1:
+					pids[chunk[0]] = self.run_cmd(jobs[chunk[0]], cmds[chunk[0]], queue=queue)
+					continue
+				chunk_pids = self.run_cmd_array([jobs[nr] for nr in chunk], [cmds[nr] for nr in chunk], queue=queue)
+				for nr, pid in zip(chunk, chunk_pids):
+					pids[nr] = pid
+		return pids
+
+	def _job_queue(self, job):
+		"""
+		The queue to submit `job` to (a specific node if it is forced).
 		"""
-		self._test_qstat()
-		queue = self.qname
 		if job.force_node:
 			queue = '{0:s}@{1:s}'.format(self.qname, job.force_node)
-			self._log('job {0:s} forced queue {1:s}'.format(job, queue), level=2)
+			self._log('job {0:} forced queue {1:s}'.format(job, queue), level=2)
+			return queue
+		return self.qname
+
+	def _submit(self, subcmd, directory, what):
+		"""
+		Run a qsub command in `directory` and return the queue id.
+		"""
+		cmds = [
+			'cd \'%s\'' % directory,
+			subcmd,
+		]
+		outp = run_cmds(cmds, queue = self)
+		self._log(cmds[-1], level=3)
+		if not outp or not outp[1]:
+			raise self.CmdException('%s could not be started (output is empty)' % what)
+		qid = findall(r'Your job(?:-array)? (\d+)[ .]', outp[1])
+		if not qid:
+			raise self.CmdException('%s id could not be found in "%s"' % (what, outp[1]))
+		return int(qid[0])
+
+	def run_cmd(self, job, cmd, queue=None):
+		"""
+		Start an individual job by means of queueing a shell command.
+
+		:param queue: the queue for the job, if already known (see _job_queue).
+		"""
+		self._test_qstat()
+		if queue is None:
+			queue = self._job_queue(job)
 		assert job.directory
 		subcmd = [
 			'qsub',                             # wait in line
@@ -119,17 +236,70 @@ class QsubQueue(Queue):
 				'-o', join(job.directory, 'qsub.out'),  # output directory for the queue
 			'bash -c \'%s\'' % cmd,		    # the actual command (single quotes!)
 		]
-		cmds = [
-			'cd \'%s\'' % job.directory,
-			' '.join(subcmd),
+		return self._submit(' '.join(subcmd), job.directory, 'job %s' % job)
+
+	def run_cmd_array(self, jobs, cmds, queue=None):
+		"""
+		Start several jobs for the same queue as one array job. A generated map file lists the directory and command
+		for each task, and a dispatch script runs the right one for each task. Both are removed by a cleanup job
+		once the whole array is done (or right away if it could not be queued).
+
+		:param queue: the queue for all the jobs, if already known (see _job_queue).
+		:return: list of ids of the array tasks (like 123.4), in the same order as jobs
+		"""
+		self._test_qstat()
+		if queue is None:
+			queue = self._job_queue(jobs[0])
+		array_dir = join(CALC_DIR, '.fenpei_arrays')
+		mkdirp(array_dir)
+		prefix = '{0:s}_{1:d}_'.format(jobs[0].batch_name or 'nobatch', len(jobs))
+		fd, map_path = mkstemp(prefix=prefix, suffix='.map', dir=array_dir)
+		array_name = basename(map_path)[:-len('.map')]
+		with fdopen(fd, 'w') as fh:
+			for job, cmd in zip(jobs, cmds):
+				assert job.directory and '\t' not in job.directory and '\n' not in cmd
+				fh.write('{0:s}\t{1:s}\n'.format(job.directory, cmd))
+		script_path = join(array_dir, '{0:s}.sh'.format(array_name))
+		with open(script_path, 'w+') as fh:
+			fh.write(ARRAY_DISPATCH.format(map_path=map_path))
+		chmod(script_path, 0o750)
+		subcmd = [
+			'qsub',
+				'-t', '1-{0:d}'.format(len(jobs)),  # array tasks, numbered from 1
+				'-b', 'y',
+				'-cwd',
+				'-q', queue,
+				'-N', array_name,
+				'-e', '/dev/null',               # each task writes its own output in the job directory
+				'-o', '/dev/null',
+			'\'%s\'' % script_path,
 		]
-		outp = run_cmds(cmds, queue = self)
-		self._log(cmds[-1], level=3)
-		if not outp or not outp[1]:
-			raise self.CmdException('job %s could not be started (output is empty)' % job)
-		qid = findall(r'Your job (\d+) \("[^"]+"\) has been submitted', outp[1])[0]
-		if not qid:
-			raise self.CmdException('job %s id could not be found in "%s"' % (job, outp[1]))
-		return int(qid)
+		try:
+			array_id = self._submit(' '.join(subcmd), array_dir, 'array of %d jobs' % len(jobs))
+		except Exception:
+			remove(map_path)
+			remove(script_path)
+			raise
+		self._cleanup_array(array_id, array_name, (map_path, script_path))
+		return ['{0:d}.{1:d}'.format(array_id, task) for task in range(1, len(jobs) + 1)]
+
+	def _cleanup_array(self, array_id, array_name, paths):
+		"""
+		Queue a job that removes the files of an array job after all its tasks are done (whether they succeeded or not).
+		"""
+		subcmd = [
+			'qsub',
+				'-hold_jid', str(array_id),      # wait for all tasks of the array
+				'-b', 'y',
+				'-q', self.qname,
+				'-N', '{0:s}_cleanup'.format(array_name),
+				'-e', '/dev/null',
+				'-o', '/dev/null',
+			'rm', '-f',
+		] + ['\'{0:s}\''.format(pth) for pth in paths]
+		try:
+			self._submit(' '.join(subcmd), dirname(paths[0]), 'cleanup of array {0:d}'.format(array_id))
+		except self.CmdException as err:
+			self._log('files of array {0:d} will not be removed: {1:}'.format(array_id, err))
 
 
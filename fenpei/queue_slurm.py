@@ -2,22 +2,45 @@
 """
 Queue using qsub to start jobs.
 """
+from collections import OrderedDict
 from distutils.spawn import find_executable
 from logging import warning
-from os import popen, environ
-from os.path import join
+from os import popen, environ, chmod, fdopen, remove
+from os.path import basename, dirname, join
+from tempfile import mkstemp
+from bardeen.system import mkdirp
 from repoze.lru import lru_cache
 from fenpei.shell import run_cmds
 from fenpei.queue import Queue
+from fenpei.utils import CALC_DIR, UnreachableError
 from re import findall
 
 
+""" Runs the command for one array task, in the job directory from the map file. """
+ARRAY_DISPATCH = '''#!/bin/bash
+line="$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" '{map_path:s}')"
+cd "${{line%%$'\\t'*}}" || exit 1
+exec bash -c "${{line#*$'\\t'}}" &> slurm.all
+'''
+
+
 class SlurmQueue(Queue):
 
-	def __init__(self, jobs=None, partition=None, summary_func=None):
+	def __init__(self, jobs=None, partition=None, summary_func=None, use_arrays=False):
+		"""
+		:param use_arrays: submit jobs with the same resources together as job arrays (one sbatch call).
+		"""
 		self.partition = partition or 'thchem'
 		super(SlurmQueue, self).__init__(jobs=jobs, summary_func=summary_func)
 		self.time_limit = '07-00:00:00'
+		self.use_arrays = use_arrays
+		""" Maximum number of tasks in one array (slurm's MaxArraySize is 1001 by default). """
+		self.array_max = 1000
+		""" Status checks for at most this many jobs ask squeue for just those job ids. """
+		self.squeue_jobs_limit = 100
+		self._squeue_job_ids = None
+		self.process_snapshot.max_age = 2.5
+		self.process_listing = 'squeue'
 		if find_executable('sinfo'):
 			partition_info = run_cmds(['sinfo -l --partition {0:s}'.format(self.partition)], queue=self)
 			if partition_info:
@@ -40,7 +63,7 @@ class SlurmQueue(Queue):
 	def node_availability(self):
 		raise NotImplementedError('this should not be implemented for %s because the qsub-queue does the distributing' % self.__class__)
 
-	def distribute_jobs(self, jobs=None, max_reject_spree=None):
+	def distribute_jobs(self, jobs=None, max_reject_spree=None, method=None):
 		"""
 		Let slurm do the distributing by placing everything in general queue.
 		"""
@@ -52,21 +75,27 @@ class SlurmQueue(Queue):
 	@lru_cache(10)
 	def test_slurm(self):
 		if not find_executable('sinfo'):
-			self._log('slurm does not work on this machine; run this code from a node that has access to the queue')
-			exit()
+			raise UnreachableError('slurm does not work on this machine; run this code from a node that has access to the queue')
 
-	def get_slurm_stat(self):
+	def get_slurm_stat(self, job_ids=None):
 		"""
 		Get slurm status for current user as a dictionary of properties.
+
+		:param job_ids: (optional) only get these jobs (ids like 123 or array tasks like 123_4).
 		"""
-		with popen('squeue --partition {0:s} --user $USER --format \'%A %B %P %T %100j\''.format(self.partition)) as fh:
+		jobs_flag = ''
+		if job_ids is not None:
+			if not job_ids:
+				return []
+			jobs_flag = ' --jobs {0:s}'.format(','.join(str(job_id) for job_id in job_ids))
+		with popen('squeue --array --partition {0:s} --user $USER{1:s} --format \'%i %B %P %T %100j\''.format(self.partition, jobs_flag)) as fh:
 			txt = fh.read()
 		parts = [line.split(None, 5) for line in txt.splitlines()[1:]]
 		jobs = []
 		for taskinfo in parts:
 			if taskinfo[3] in ('PENDING', 'RUNNING', 'SUSPENDED', 'COMPLETING', 'COMPLETED'):
 				jobs.append({
-					'pid': int(taskinfo[0]),
+					'pid': int(taskinfo[0]) if taskinfo[0].isdigit() else taskinfo[0],
 					'name': taskinfo[4],
 					# 'user': taskinfo[4],
 					'queue': taskinfo[2],
@@ -78,68 +107,188 @@ class SlurmQueue(Queue):
 					'(it will be assumed to have crashed)').format(taskinfo[0], taskinfo[3]))
 		return jobs
 
-	@lru_cache(maxsize=100, timeout=2.5)
-	def processes(self, node):
+	def _load_processes(self, node):
 		"""
-		Get process info from qstat.
+		Load the slurm queue (for all nodes at once); used by the process snapshot.
 		"""
 		self.test_slurm()
-		self._log('loading processes for %s' % node, level=3)
-		return self.get_slurm_stat()
+		self._log('loading slurm queue', level=3)
+		return self.get_slurm_stat(job_ids=self._squeue_job_ids)
+
+	def processes(self, node):
+		"""
+		Get queued jobs; the node is ignored, there is one snapshot of the slurm queue.
+		"""
+		return super(SlurmQueue, self).processes(self.partition)
+
+	def process_ids(self, node):
+		"""
+		Set of queued job ids, to check if jobs are running; the node is ignored.
+		"""
+		return super(SlurmQueue, self).process_ids(self.partition)
+
+	def get_status(self, parallel=None, **kwargs):
+		"""
+		Like Queue.get_status, but with a single squeue call, restricted to the jobs of this queue if there are few.
+		"""
+		if len(self.jobs) > self.squeue_jobs_limit:
+			return super(SlurmQueue, self).get_status(parallel=parallel, **kwargs)
+		self._squeue_job_ids = [job.pid for job in self.jobs if job.pid is not None or job.load()]
+		self.process_snapshot.expire()
+		try:
+			return super(SlurmQueue, self).get_status(parallel=parallel, **kwargs)
+		finally:
+			self._squeue_job_ids = None
+			self.process_snapshot.expire()
 
 	def stop_job(self, node, pid):
 		"""
-		Remove individual job from queue.
+		Remove individual job from queue (pid can be an array task, like 123_4).
 		"""
-		run_cmds(['scancel {0:d}'.format(pid)], queue=self)
+		run_cmds(['scancel {0:}'.format(pid)], queue=self)
 
-	def run_cmd(self, job, cmd):
+	def run_cmds_batch(self, jobs, cmds, node):
 		"""
-		Start an individual job by means of queueing a shell command.
+		Queue the jobs; one by one, or as job arrays for jobs with the same resources if .use_arrays is set.
 		"""
-		self.test_slurm()
-		assert job.directory
-		node_flags = ()
-		comment = 'batch: {0:s}; job: {1:s}; weight: {2:d}'.format(job.batch_name, job.name, job.weight)
+		if not self.use_arrays:
+			return [self.run_cmd(job, cmd) for job, cmd in zip(jobs, cmds)]
+		groups = OrderedDict()
+		for nr, (job, cmd) in enumerate(zip(jobs, cmds)):
+			groups.setdefault(self._resource_flags(job)[0], []).append(nr)
+		pids = [None] * len(jobs)
+		for flags, nrs in groups.items():
+			for k in range(0, len(nrs), self.array_max):
+				chunk = nrs[k:k + self.array_max]
+				if len(chunk) == 1:
+					pids[chunk[0]] = self.run_cmd(jobs[chunk[0]], cmds[chunk[0]])
+					continue
+				chunk_pids = self.run_cmd_array([jobs[nr] for nr in chunk], [cmds[nr] for nr in chunk])
+				for nr, pid in zip(chunk, chunk_pids):
+					pids[nr] = pid
+		return pids
+
+	def _resource_flags(self, job):
+		"""
+		:return: tuple of sbatch flags for the resources of `job` (jobs with the same flags can share an array)
+			and a description for the comment.
+		"""
+		flags = (
+			'--partition', str(self.partition),
+			'--time', self.time_limit,
+			'--mem', '{0:d}G'.format(2+job.weight),
+			'--ntasks', '1',  # different tasks can be on different nodes
+			'--cpus-per-task', str(max(min(job.weight//1, 10), 1)),
+			'--nodes', '1',
+		)
+		comment = 'weight: {0:d}'.format(job.weight)
 		if job.force_node:
-			node_flags += (
+			flags += (
 				'--nodelist', str(job.force_node),
 				'--no-requeue',
 			)
 			comment = '{0:s}; forced to node: {1:s}'.format(comment, job.force_node)
 		elif 'EXCLUDE_NODES' in environ and environ['EXCLUDE_NODES'].strip():
-			node_flags += (
+			flags += (
 				'--exclude', '"{0:}"'.format(environ['EXCLUDE_NODES']),
 			)
 			comment = '{0:s}; excl: {1:s}'.format(comment, environ['EXCLUDE_NODES'].strip())
-		core_flags = (
-			'sbatch',
-			'--job-name', '"{0:s}"'.format(job.name),
-			'--partition', str(self.partition),
-			'--workdir', '"{0:s}"'.format(job.directory),
-			'--time', self.time_limit,
-			'--mem', '{0:d}G'.format(2+job.weight),
-			'--ntasks', '1',  # different tasks can be on different nodes
-			'--cpus-per-task', str(max(min(job.weight//1, 10), 1)),
-			'--nodes', '1',
-			'--output', '"{0:s}"'.format(join(job.directory, 'slurm.all')),
-			'--error',  '"{0:s}"'.format(join(job.directory, 'slurm.all')),
-		)
 		if getattr(job, 'niceness', True):
-			node_flags += (
+			flags += (
 				'--nice={0:}'.format(getattr(job, 'niceness', 100)),  # otherwise other people can't run
 			)
 			comment = '{0:s}; nice: {1:}'.format(comment, getattr(job, 'niceness', 100))
-		core_flags += ('--comment', '"{0:s}"'.format(comment))
-		subcmd = ' '.join(core_flags + node_flags + ('\'{0:s}\''.format(cmd),))
-		cdcmd = 'cd "{0:s}"'.format(job.directory)
+		return flags, comment
+
+	def _submit(self, subcmd, directory, what):
+		"""
+		Run an sbatch command in `directory` and return the queue id.
+		"""
+		cdcmd = 'cd "{0:s}"'.format(directory)
 		outp = run_cmds((cdcmd, subcmd,), queue=self)
 		self._log(subcmd, level=3)
 		if not outp or not outp[1]:
-			raise self.CmdException('job {0:s} could not be queued (output is empty)'.format(job))
-		qid = findall(r'Submitted batch job (\d+)(\s|$)', outp[1])[0][0]
+			raise self.CmdException('{0:s} could not be queued (output is empty)'.format(what))
+		qid = findall(r'Submitted batch job (\d+)(\s|$)', outp[1])
 		if not qid:
-			raise self.CmdException('job {0:s} id could not be found in "{1:s}"'.format(job, outp[1]))
-		return int(qid)
+			raise self.CmdException('{0:s} id could not be found in "{1:s}"'.format(what, outp[1]))
+		return int(qid[0][0])
 
+	def run_cmd(self, job, cmd):
+		"""
+		Start an individual job by means of queueing a shell command.
+		"""
+		self.test_slurm()
+		assert job.directory
+		flags, comment = self._resource_flags(job)
+		comment = 'batch: {0:s}; job: {1:s}; {2:s}'.format(job.batch_name, job.name, comment)
+		core_flags = (
+			'sbatch',
+			'--job-name', '"{0:s}"'.format(job.name),
+			'--workdir', '"{0:s}"'.format(job.directory),
+			'--output', '"{0:s}"'.format(join(job.directory, 'slurm.all')),
+			'--error',  '"{0:s}"'.format(join(job.directory, 'slurm.all')),
+			'--comment', '"{0:s}"'.format(comment),
+		)
+		subcmd = ' '.join(core_flags + flags + ('\'{0:s}\''.format(cmd),))
+		return self._submit(subcmd, job.directory, 'job {0:}'.format(job))
 
+	def run_cmd_array(self, jobs, cmds):
+		"""
+		Start several jobs with the same resources as one job array. A generated map file lists the directory
+		and command for each array index, and a dispatch script runs the right one for each task. Both are
+		removed by a cleanup job once the whole array is done (or right away if it could not be queued).
+
+		:return: list of ids of the array tasks (like 123_4), in the same order as jobs
+		"""
+		self.test_slurm()
+		array_dir = join(CALC_DIR, '.fenpei_arrays')
+		mkdirp(array_dir)
+		prefix = '{0:s}_{1:d}_'.format(jobs[0].batch_name or 'nobatch', len(jobs))
+		fd, map_path = mkstemp(prefix=prefix, suffix='.map', dir=array_dir)
+		array_name = basename(map_path)[:-len('.map')]
+		with fdopen(fd, 'w') as fh:
+			for job, cmd in zip(jobs, cmds):
+				assert job.directory and '\t' not in job.directory and '\n' not in cmd
+				fh.write('{0:s}\t{1:s}\n'.format(job.directory, cmd))
+		script_path = join(array_dir, '{0:s}.sh'.format(array_name))
+		with open(script_path, 'w+') as fh:
+			fh.write(ARRAY_DISPATCH.format(map_path=map_path))
+		chmod(script_path, 0o750)
+		flags, comment = self._resource_flags(jobs[0])
+		comment = 'batch: {0:s}; array of {1:d} jobs; {2:s}'.format(jobs[0].batch_name, len(jobs), comment)
+		core_flags = (
+			'sbatch',
+			'--array', '0-{0:d}'.format(len(jobs) - 1),
+			'--job-name', '"{0:s}"'.format(array_name),
+			'--output', '/dev/null',
+			'--error', '/dev/null',
+			'--comment', '"{0:s}"'.format(comment),
+		)
+		subcmd = ' '.join(core_flags + flags + ('\'{0:s}\''.format(script_path),))
+		try:
+			array_id = self._submit(subcmd, array_dir, 'array of {0:d} jobs'.format(len(jobs)))
+		except Exception:
+			remove(map_path)
+			remove(script_path)
+			raise
+		self._cleanup_array(array_id, array_name, (map_path, script_path))
+		return ['{0:d}_{1:d}'.format(array_id, index) for index in range(len(jobs))]
+
+	def _cleanup_array(self, array_id, array_name, paths):
+		"""
+		Queue a job that removes the files of a job array after all its tasks are done (whether they succeeded or not).
+		"""
+		subcmd = ' '.join((
+			'sbatch',
+			'--dependency', 'afterany:{0:d}'.format(array_id),
+			'--partition', str(self.partition),
+			'--job-name', '"{0:s}_cleanup"'.format(array_name),
+			'--output', '/dev/null',
+			'--error', '/dev/null',
+			'--wrap', '"rm -f {0:s}"'.format(' '.join('\'{0:s}\''.format(pth) for pth in paths)),
+		))
+		try:
+			self._submit(subcmd, dirname(paths[0]), 'cleanup of array {0:d}'.format(array_id))
+		except self.CmdException as err:
+			self._log('files of array {0:d} will not be removed: {1:}'.format(array_id, err))
@@ -1,7 +1,14 @@
 
 import sys
-from os import getcwd
+from atexit import register
+from os import getcwd, killpg
+from shutil import rmtree
+from signal import SIGKILL
 from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+from threading import Lock, Timer
+from weakref import WeakSet
+from .utils import TMP_DIR
 
 """
 	Keep a list of processes to stop them from being terminated if their reference goes out of scope.
@@ -9,11 +16,37 @@ from subprocess import Popen, PIPE
 process_memory = []
 
 
+def _kill_group(process, timed_out):
+	"""
+	Kill a process started by run_shell, including children (like ssh); used for timeouts.
+	"""
+	timed_out.append(True)
+	try:
+		killpg(process.pid, SIGKILL)
+	except OSError:
+		pass
+
+
 # only tested with wait = True
-def run_shell(cmd, wait):
+def run_shell(cmd, wait, timeout=None):
+	"""
+	:param timeout: (optional) seconds after which the command is killed and None returned (only with wait).
+	"""
 	if wait:
-		process = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
-		outp, err = process.communicate()
+		process = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True, start_new_session=True)
+		timed_out = []
+		timer = None
+		if timeout is not None:
+			timer = Timer(timeout, _kill_group, (process, timed_out))
+			timer.start()
+		try:
+			outp, err = process.communicate()
+		finally:
+			if timer is not None:
+				timer.cancel()
+		if timed_out:
+			sys.stderr.write('command timed out after {0:}s: {1:s}\n'.format(timeout, cmd))
+			return None
 		if err:
 			sys.stderr.write(err.strip())
 			return None
@@ -25,7 +58,7 @@ def run_shell(cmd, wait):
 	return None
 
 
-def run_cmds_on(cmds, node, wait=True, queue=None):
+def run_cmds_on(cmds, node, wait=True, queue=None, timeout=None):
 	"""
 	Run several commands on a local or remote machine.
 
@@ -33,6 +66,7 @@ def run_cmds_on(cmds, node, wait=True, queue=None):
 	:param node:
 	:param wait:
 	:param queue:
+	:param timeout: (optional) seconds to wait for the commands before giving up (returns None)
 	:return: list of stdout for each command if succesful, None otherwise
 	:raise: no exceptions; writes to sys.stderr for problems
 
@@ -45,24 +79,90 @@ def run_cmds_on(cmds, node, wait=True, queue=None):
 	cmd_str = cmd_str.replace('\\"', '"').replace('"', '\\"').replace('&; ', '& ')
 	if node is None:
 		cmd_str = ('bash -c "%s"' % cmd_str).replace('\n', '')
+	elif getattr(queue, 'ssh_pool', None) is not None:
+		cmd_str = ('%s "%s"' % (queue.ssh_pool.ssh_cmd(node), cmd_str)).replace('\n', '')
 	else:
 		cmd_str = ('ssh %s "%s"' % (node, cmd_str)).replace('\n', '')
 	if queue:
 		queue._log(cmd_str.replace('echo \'%s\'; ' % split_str, ''), level=3)
-	raw_outp = run_shell(cmd_str, wait=wait)
+	raw_outp = run_shell(cmd_str, wait=wait, timeout=timeout)
 	if raw_outp is None:
 		return None
 	outp = [block.strip() for block in raw_outp.split(split_str)]
 	return outp
 
 
+class SSHPool(object):
+	"""
+	Keep one multiplexed ssh connection per node (OpenSSH ControlMaster), so that commands to a node
+	only pay for connecting and authenticating once. Connections are closed by :ref: close, or
+	automatically after `persist` idle seconds if that doesn't happen.
+	"""
+
+	def __init__(self, persist=600):
+		self.persist = persist
+		self.control_dir = None
+		self.nodes = set()
+		self._lock = Lock()
+		_open_pools.add(self)
+
+	def __getstate__(self):
+		""" A copy (e.g. in a worker process) uses the same connections, but doesn't close them at exit. """
+		state = self.__dict__.copy()
+		del state['_lock']
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._lock = Lock()
+
+	def ssh_cmd(self, node):
+		"""
+		:return: the ssh command (without remote command) that reuses the connection to `node`.
+		"""
+		with self._lock:
+			if self.control_dir is None:
+				self.control_dir = mkdtemp(prefix='ssh', dir=TMP_DIR)
+			self.nodes.add(node)
+			control_dir = self.control_dir
+		return 'ssh -o ControlMaster=auto -o ControlPath=\'{0:s}/%C\' -o ControlPersist={1:d} {2:s}'.format(
+			control_dir, self.persist, node)
+
+	def close(self, node=None):
+		"""
+		Close the connection to `node`, or to all nodes if None.
+		"""
+		with self._lock:
+			if self.control_dir is None:
+				return
+			nodes = sorted(self.nodes) if node is None else [node]
+			for close_node in nodes:
+				if close_node in self.nodes:
+					run_shell('ssh -o ControlPath=\'{0:s}/%C\' -O exit {1:s} 2>/dev/null'.format(
+						self.control_dir, close_node), wait=True)
+					self.nodes.remove(close_node)
+			if not self.nodes:
+				rmtree(self.control_dir, ignore_errors=True)
+				self.control_dir = None
+
+
+""" Pools that were created in this process; they are closed at exit, without keeping them (or their queue) alive. """
+_open_pools = WeakSet()
+
+
+@register
+def _close_pools():
+	for pool in list(_open_pools):
+		pool.close()
+
+
 def run_cmds(cmds, wait=True, queue=None):
 	return run_cmds_on(cmds, node=None, wait=wait, queue=queue)
 
 
 def git_current_hash():
 	def getit():
-		process = Popen('git rev-parse --verify HEAD', shell=True, stdout=PIPE, stderr=PIPE)
+		process = Popen('git rev-parse --verify HEAD', shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True)
 		outp, err = process.communicate()
 		if err:
 			return '[no git commit found]'
@@ -0,0 +1,152 @@
+
+"""
+Snapshot of the processes on all nodes, so that checking whether a job runs doesn't need a remote call per job.
+"""
+
+from contextlib import contextmanager
+from threading import Event, RLock
+from time import time
+from .utils import thread_map
+
+
+class ProcessSnapshot(object):
+
+	def __init__(self, max_age=3, workers=16):
+		"""
+		:param max_age: seconds after which the snapshot is refreshed (for all nodes at once); None to only refresh
+			when .expire() is called.
+		:param workers: number of nodes to load concurrently.
+		"""
+		self.max_age = max_age
+		self.workers = workers
+		self.processes = {}
+		self.pids = {}
+		self.time = None
+		self._pinned = 0
+		""" node -> Event that is set when the node has been loaded, for nodes that are being loaded """
+		self._loading = {}
+		self._lock = RLock()
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['_lock'], state['_loading']
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._loading = {}
+		self._lock = RLock()
+
+	def is_stale(self):
+		if self.time is None:
+			return True
+		if self._pinned or self.max_age is None:
+			return False
+		return time() - self.time > self.max_age
+
+	def is_pinned(self):
+		return self._pinned > 0
+
+	def expire(self):
+		"""
+		Mark the snapshot as outdated, so that all known nodes are loaded again when next needed.
+		"""
+		with self._lock:
+			self.time = None
+
+	@contextmanager
+	def pinned(self):
+		"""
+		Don't refresh within this block (e.g. one status pass), unless the snapshot is already stale when entering.
+		"""
+		with self._lock:
+			if self.is_stale():
+				self.expire()
+			self._pinned += 1
+		try:
+			yield self
+		finally:
+			with self._lock:
+				self._pinned -= 1
+
+	def update(self, nodes, load):
+		"""
+		Load the processes for all `nodes` concurrently (without holding the lock), then store them.
+
+		:param load: function that returns a list of process dicts (with at least 'pid') for a node, or None on failure.
+		"""
+		nodes = list(nodes)
+		loaded = thread_map(load, nodes, workers=self.workers)
+		with self._lock:
+			for node, procs in zip(nodes, loaded):
+				self.processes[node] = procs
+				if procs is None:
+					self.pids[node] = None
+				else:
+					self.pids[node] = frozenset(proc['pid'] for proc in procs if proc is not None)
+			if self.time is None:
+				self.time = time()
+
+	def _claim(self, nodes, loading):
+		"""
+		Mark those `nodes` that are not loaded or being loaded as loading (call with the lock).
+
+		:return: set of the claimed nodes
+		"""
+		claimed = set(node for node in nodes if node not in self.pids and node not in self._loading)
+		for node in claimed:
+			self._loading[node] = loading
+		return claimed
+
+	def _ensure(self, node, load, refresh=None):
+		"""
+		Load `node` if needed. Remote calls happen outside the lock; threads that need a node that is already being
+		loaded wait for it.
+
+		:param refresh: (optional) function that is called (once, in this thread) before anything is loaded; it can
+			return more nodes (e.g. all nodes that have jobs), which are then loaded together with `node`.
+		:return: tuple of the processes and the pids of `node`.
+		"""
+		while True:
+			with self._lock:
+				if self.is_stale() and not self._loading:
+					""" refresh every node that was seen before in one concurrent pass """
+					nodes = set(self.processes.keys()) | {node}
+					self.processes, self.pids, self.time = {}, {}, None
+				elif node in self.pids:
+					return self.processes[node], self.pids[node]
+				elif node in self._loading:
+					nodes, loading = None, self._loading[node]
+				else:
+					nodes = {node}
+				if nodes is not None:
+					loading = Event()
+					nodes = self._claim(nodes, loading)
+			if nodes is None:
+				loading.wait()
+				continue
+			try:
+				more = refresh() if refresh is not None else None
+				if more:
+					with self._lock:
+						nodes |= self._claim(more, loading)
+				self.update(nodes, load)
+			finally:
+				with self._lock:
+					for claimed in nodes:
+						self._loading.pop(claimed, None)
+				loading.set()
+
+	def get_pids(self, node, load, refresh=None):
+		"""
+		:return: frozenset of process ids on `node` (None if it could not be loaded).
+		"""
+		return self._ensure(node, load, refresh)[1]
+
+	def get_processes(self, node, load, refresh=None):
+		"""
+		:return: list of process dicts on `node` (None if it could not be loaded).
+		"""
+		return self._ensure(node, load, refresh)[0]
+
+
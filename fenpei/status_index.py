@@ -0,0 +1,85 @@
+
+"""
+Optional on-disk index of job statuses (one sqlite file per batch), so that finished jobs don't have to be checked
+again on every run, as long as the files their status depends on don't change.
+
+Enable it by setting `queue.status_index = True`.
+"""
+
+from os import stat
+from os.path import join, isdir
+from sqlite3 import connect, Error as SqliteError
+from .job import Job
+from .utils import CALC_DIR
+
+
+def job_stamp(job):
+	"""
+	Modification times of the files that the status of `job` depends on, as a string.
+	"""
+	parts = []
+	for pth in job.status_files():
+		try:
+			parts.append('{0:.6f}'.format(stat(pth).st_mtime))
+		except OSError:
+			parts.append('-')
+	return ' '.join(parts)
+
+
+class StatusIndex(object):
+
+	FILENAME = '.fenpei_status.sqlite'
+	""" Statuses that don't change unless the files they depend on do. Crashed jobs are checked every time, since
+	a restarted job can complete by changing only files that are not stamped (like appending to existing output). """
+	FINAL = frozenset((Job.COMPLETED,))
+
+	def __init__(self, batch_name):
+		self.directory = join(CALC_DIR, batch_name) if batch_name else CALC_DIR
+		self.path = join(self.directory, self.FILENAME)
+		self.known = {}
+		self.changed = {}
+		if isdir(self.directory):
+			try:
+				conn = self._connect()
+				try:
+					self.known = dict((name, (status, stamp)) for name, status, stamp
+						in conn.execute('SELECT name, status, stamp FROM status'))
+				finally:
+					conn.close()
+			except SqliteError:
+				self.known = {}
+
+	def _connect(self):
+		conn = connect(self.path)
+		conn.execute('CREATE TABLE IF NOT EXISTS status (name TEXT PRIMARY KEY, status INTEGER, stamp TEXT)')
+		return conn
+
+	def lookup(self, name, stamp):
+		"""
+		:return: the stored status if it is final and the files did not change, None otherwise.
+		"""
+		known = self.known.get(name)
+		if known is not None and known[0] in self.FINAL and known[1] == stamp:
+			return known[0]
+		return None
+
+	def record(self, name, status, stamp):
+		if self.known.get(name) != (status, stamp):
+			self.known[name] = self.changed[name] = (status, stamp)
+
+	def save(self):
+		"""
+		Write changed statuses to disk (if the batch directory exists).
+		"""
+		if not self.changed or not isdir(self.directory):
+			return
+		conn = self._connect()
+		try:
+			with conn:
+				conn.executemany('INSERT OR REPLACE INTO status (name, status, stamp) VALUES (?, ?, ?)',
+					((name, status, stamp) for name, (status, stamp) in self.changed.items()))
+		finally:
+			conn.close()
+		self.changed = {}
+
+
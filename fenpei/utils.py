@@ -1,15 +1,20 @@
 
 from collections import OrderedDict
 from functools import partial
+from itertools import count, islice
 from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
 from tempfile import gettempdir
-#from threading import Thread
 from warnings import warn
 from bardeen.system import mkdirp
 from sys import stderr
-from os import environ, chmod
-from os.path import join, expanduser
+from os import environ, chmod, getpid, walk, lstat
+from os.path import join, expanduser, islink
+from stat import S_ISLNK
+from threading import Lock, local
 from jinja2 import StrictUndefined
+from repoze.lru import lru_cache
+import xxhash
 
 
 class ParameterValidationError(Exception):
@@ -18,11 +23,18 @@ class ParameterValidationError(Exception):
 		self.message = message
 
 
+class UnreachableError(Exception):
+	""" A node (or the queue system) could not be reached; this is raised instead of exiting, also from threads. """
+
+
 if 'CALC_DIR' in environ:
 	CALC_DIR = environ['CALC_DIR']
 else:
 	CALC_DIR = join(expanduser('~'), 'data')
 
+""" Default number of threads for IO-bound work on jobs (like status checks); can be set using FENPEI_THREADS. """
+THREAD_WORKERS = int(environ.get('FENPEI_THREADS', 32))
+
 TMP_DIR = join(gettempdir(), 'fenpei')
 mkdirp(TMP_DIR)
 chmod(TMP_DIR, 0o700)
@@ -37,52 +49,119 @@ def get_pool_light():
 	return getattr(get_pool_light, 'pool')
 
 
-def thread_map(func, data):
+def thread_map(func, data, workers=None):
 	"""
-	http://code.activestate.com/recipes/577360-a-multithreaded-concurrent-version-of-map/
+	Map `func` over `data` using a bounded pool of threads, which helps for IO-bound work (e.g. on network file systems).
+
+	Results are returned in order, and an exception in any call (including SystemExit) is raised again in this thread.
+
+	:param workers: maximum number of threads; THREAD_WORKERS if None.
 	"""
-	#todo: this is disabled
-	return map(func, data)
+	data = list(data)
+	workers = min(workers or THREAD_WORKERS, len(data))
+	if workers <= 1:
+		return [func(item) for item in data]
+	pool = ThreadPool(workers)
+	try:
+		outcomes = pool.map(partial(_capture, func), data)
+	finally:
+		pool.close()
+	for failed, value in outcomes:
+		if failed:
+			raise value
+	return [value for failed, value in outcomes]
 
-	N = len(data)
-	result = [None] * N
 
-	# wrapper to dispose the result in the right slot
-	def task_wrapper(i):
-		result[i] = func(data[i])
+def _capture(func, item):
+	"""
+	Call `func` and return (failed, result or exception); a ThreadPool worker doesn't survive exceptions like
+	SystemExit, which would make pool.map wait forever.
+	"""
+	try:
+		return False, func(item)
+	except BaseException as err:
+		return True, err
 
-	threads = [Thread(target=task_wrapper, args=(i,)) for i in xrange(N)]
-	for t in threads:
-		t.start()
-	for t in threads:
-		t.join()
 
-	return result
+""" The batch of jobs that is being created in this thread (see iter_jobs), so that work that is shared by the jobs
+(like checking expanded directories, see `job_sh.expand_files`) can be done once per batch. """
+_creating = local()
+_batch_numbers = count()
 
 
-def _make_inst(params, JobCls, default_batch=None):
+def creating_batch():
+	"""
+	:return: a token for the batch of jobs that is being created by iter_jobs (also in worker processes), or None.
+	"""
+	return getattr(_creating, 'batch', None)
+
+
+def _make_inst(params, JobCls, default_batch=None, batch=None):
 	if 'batch_name' not in params and default_batch:
 		params['batch_name'] = default_batch
+	_creating.batch = batch
 	try:
 		return JobCls(**params)
 	except ParameterValidationError as err:
 		# note: the job it responsible for logging what went wrong
 		# stderr.write('skipping job because it does not validate: {} ; problem: {}\n'.format(params, err.message))
 		return None
+	finally:
+		_creating.batch = None
 
 
-def create_jobs(JobCls, generator, parallel=True, default_batch=None):
+def _created_windows(make, params, parallel, chunksize, window):
 	"""
-	Create jobs from parameters in parallel.
+	Create jobs for `params` a window at a time, while the next window is already being created (if parallel).
+
+	:return: generator of lists of jobs (or None for parameters that don't validate).
 	"""
-	if parallel:
-		try_jobs = get_pool_light().map(partial(_make_inst, JobCls=JobCls, default_batch=default_batch), tuple(generator))
-	else:
-		try_jobs = list(_make_inst(params, JobCls=JobCls, default_batch=default_batch) for params in generator)
-	real_jobs = list(job for job in try_jobs if job is not None)
-	if len(real_jobs) < len(try_jobs):
-		stderr.write('skipping {} of {} jobs because of validation errors\n'.format(len(try_jobs) - len(real_jobs), len(try_jobs)))
-	return real_jobs
+	windows = iter(lambda: list(islice(params, window)), [])
+	if not parallel:
+		for chunk in windows:
+			yield [make(p) for p in chunk]
+		return
+	pool = get_pool_light()
+	pending = None
+	for chunk in windows:
+		result = pool.map_async(make, chunk, chunksize=chunksize)
+		if pending is not None:
+			yield pending.get()
+		pending = result
+	if pending is not None:
+		yield pending.get()
+
+
+def iter_jobs(JobCls, generator, parallel=True, default_batch=None, chunksize=64, window=4096):
+	"""
+	Create jobs from parameters as they are needed, so that not all parameters (nor all intermediate results) are in
+	memory at once; e.g. `queue.add_jobs(iter_jobs(...))`. Jobs that don't validate are skipped, and reported together
+	at the end.
+
+	:param parallel: create jobs in worker processes; this helps only if creating a job takes longer than sending it back.
+	:param chunksize: number of jobs that a worker creates at once (like for Pool.imap).
+	:param window: number of parameters that are taken from the generator at once (at most two windows are in use).
+	"""
+	batch = (getpid(), next(_batch_numbers))
+	make = partial(_make_inst, JobCls=JobCls, default_batch=default_batch, batch=batch)
+	total = skipped = 0
+	for jobs in _created_windows(make, iter(generator), parallel, chunksize, window):
+		total += len(jobs)
+		for job in jobs:
+			if job is None:
+				skipped += 1
+			else:
+				yield job
+	if skipped:
+		stderr.write('skipping {} of {} jobs because of validation errors\n'.format(skipped, total))
+
+
+def create_jobs(JobCls, generator, parallel=True, default_batch=None, chunksize=64, window=4096):
+	"""
+	Create jobs from parameters in parallel; see iter_jobs for creating them as needed, and for the parameters.
+	"""
+	return list(iter_jobs(JobCls, generator, parallel=parallel, default_batch=default_batch, chunksize=chunksize,
+		window=window))
 
 
 def substitute(text, substitutions, formatter, job=None, filename=None):
@@ -107,38 +186,145 @@ def substitute(text, substitutions, formatter, job=None, filename=None):
 class FormattingException(Exception): pass
 
 
-def substitute_pypercent(text, substitutions, job=None, filename=None):
+@lru_cache(maxsize=64)
+def _joined_lines(text):
 	"""
-	Use old Python % formatting to apply substitutions to a string.
+	Text with line endings normalized like line-by-line formatting does (cached, since templates are repeated a lot).
+	"""
+	return '\n'.join(text.splitlines())
+
+
+def _substitute_lines(text, format_line, filename=None):
+	"""
+	Format `text` line by line, only to find on which line a problem is; used after formatting all at once failed.
 	"""
 	outp = []
 	for nr, line in enumerate(text.splitlines()):
 		try:
-			outp.append((line % substitutions))
+			outp.append(format_line(line))
 		except KeyError as err:
-			raise FormattingException('missing key "{0:s}" in substitution of "{1:s}" on line {2:d}; job not prepared'
+			raise FormattingException('missing key "{0:s}" in substitution of "{1:}" on line {2:d}; job not prepared'
 				.format(str(err).strip('\''), filename, nr + 1))
 		except ValueError:
-			raise FormattingException('substitution of "%s" on line %d encountered a formatting error; job not prepared'
+			raise FormattingException('substitution of "{0:}" on line {1:d} encountered a formatting error; job not prepared'
 				.format(filename, nr + 1))
 	return '\n'.join(outp)
 
 
+def substitute_pypercent(text, substitutions, job=None, filename=None):
+	"""
+	Use old Python % formatting to apply substitutions to a string.
+	"""
+	try:
+		return _joined_lines(text) % substitutions
+	except (KeyError, ValueError):
+		return _substitute_lines(text, lambda line: line % substitutions, filename=filename)
+
+
 def substitute_pyformat(text, substitutions, job=None, filename=None):
 	"""
 	Use new Python .format() to apply substitutions to a string.
 	"""
-	outp = []
-	for nr, line in enumerate(text.splitlines()):
+	try:
+		return _joined_lines(text).format_map(substitutions)
+	except (KeyError, ValueError):
+		return _substitute_lines(text, lambda line: line.format_map(substitutions), filename=filename)
+
+
+class TemplateCache(object):
+	"""
+	Compiled jinja2 templates, compiled once per process through a shared Environment and keyed by the source
+	filename and a hash of the content, so changed files are compiled again. The least recently used templates
+	are dropped when there are more than `maxsize` (0 disables caching).
+	"""
+
+	def __init__(self, maxsize=256):
+		self.maxsize = maxsize
+		self.hits = self.misses = 0
+		self.environment = None
+		self._templates = OrderedDict()
+		self._lock = Lock()
+
+	def _make_environment(self):
 		try:
-			outp.append(line.format(**substitutions))
-		except KeyError as err:
-			raise FormattingException('missing key "{0:s}" in substitution of "{1:s}" on line {2:d}; job not prepared'
-				.format(str(err).strip('\''), filename, nr + 1))
-		except ValueError:
-			raise FormattingException('substitution of "%s" on line %d encountered a formatting error; job not prepared'
-				.format(filename, nr + 1))
-	return '\n'.join(outp)
+			from jinja2 import Environment, __version__ as jinja_version
+		except ImportError as err:
+			raise ImportError('Jinja2 is set as the formatter, but could not be imported: {0:}'.format(err))
+		if tuple(int(part) for part in jinja_version.split('.')[:2]) < (2, 7):
+			raise ImportError('Jinja2 needs at least version 2.7, but you have {0:s}'.format(jinja_version))
+		return Environment(undefined=StrictUndefined, trim_blocks=True, lstrip_blocks=True)
+
+	def get(self, text, filename=None):
+		"""
+		:return: the compiled template for `text` (from `filename`, which is only used as part of the key and for errors).
+		"""
+		from jinja2 import TemplateSyntaxError
+		key = (filename, xxhash.xxh64(text.encode('utf-8')).hexdigest())
+		with self._lock:
+			if self.environment is None:
+				self.environment = self._make_environment()
+			template = self._templates.pop(key, None)
+			if template is not None:
+				self.hits += 1
+				self._templates[key] = template
+				return template
+			self.misses += 1
+		try:
+			template = self.environment.from_string(text)
+		except TemplateSyntaxError as err:
+			raise TemplateSyntaxError('In file {0:}: {1:}'.format(filename, err), err.lineno)
+		if self.maxsize > 0:
+			with self._lock:
+				self._templates[key] = template
+				while len(self._templates) > self.maxsize:
+					self._templates.popitem(last=False)
+		return template
+
+	def clear(self):
+		with self._lock:
+			self._templates.clear()
+			self.hits = self.misses = 0
+
+
+""" Templates used by substitute_jinja2; set TEMPLATE_CACHE.maxsize to change the number of templates kept. """
+TEMPLATE_CACHE = TemplateCache()
+
+
+class SourceCache(object):
+	"""
+	Contents of source files, read once for a whole batch of jobs that is being prepared (see Queue.prepare).
+	"""
+
+	def __init__(self):
+		self.texts = {}
+		self._lock = Lock()
+
+	def read(self, path):
+		text = self.texts.get(path)
+		if text is None:
+			with open(path, 'r') as fh:
+				text = fh.read()
+			with self._lock:
+				text = self.texts.setdefault(path, text)
+		return text
+
+
+def chmod_tree(directory, mode):
+	"""
+	Like `chmod -R`, but without starting a process; symlinks are skipped, and so are hard links (files with more
+	than one link), since they share their permissions with the file they link to.
+	"""
+	chmod(directory, mode)
+	for root, dirs, files in walk(directory):
+		for name in dirs:
+			pth = join(root, name)
+			if not islink(pth):
+				chmod(pth, mode)
+		for name in files:
+			pth = join(root, name)
+			info = lstat(pth)
+			if not S_ISLNK(info.st_mode) and info.st_nlink == 1:
+				chmod(pth, mode)
 
 
 def substitute_jinja2(text, substitutions, job=None, filename=None):
@@ -149,19 +335,18 @@ def substitute_jinja2(text, substitutions, job=None, filename=None):
 	:param substitutions: Also called 'context', contains a mapping of things to replace.
 	:return: Substituted string.
 	"""
-	try:
-		from jinja2 import Template, __version__ as jinja_version
-	except ImportError as err:
-		raise ImportError('Jinja2 is set as the formatter, but '.format(err))
-	if int(jinja_version.split('.')[1]) < 7:
-		raise ImportError('Jinja2 needs at least version 2.7, but you have {0:s}'.format(jinja_version))
-	from jinja2 import TemplateSyntaxError
-	
-	try:
-		template = Template(text, undefined=StrictUndefined, trim_blocks=True, lstrip_blocks=True)
-	except TemplateSyntaxError as err:
-		raise TemplateSyntaxError('In file {0:s}: {1:}'.format(filename, err), err.lineno)
-	return template.render(**substitutions)
+	return TEMPLATE_CACHE.get(text, filename=filename).render(**substitutions)
+
+
+def compare_key(job, parameters):
+	"""
+	:return: tuple of the values of attributes `parameters` of `job`, as used by compare_jobs.
+	"""
+	vals = []
+	for param in parameters:
+		assert hasattr(job, param), 'Can not compare jobs on "{0:s}" since job "{1:}" does not have this attribute.'.format(param, job)
+		vals.append(getattr(job, param))
+	return tuple(vals)
 
 
 def compare_jobs(jobs, parameters, filter=None):
@@ -171,24 +356,16 @@ def compare_jobs(jobs, parameters, filter=None):
 	:param filter: a function that returns True for jobs that should be included.
 	:return: Without parameters, a list of jobs. With parameters, a mapping from parameter to accompanying jobs. Indices are tuples of parameter values.
 	"""
-	if not hasattr(parameters, '__iter__'):
+	if not hasattr(parameters, '__iter__') or isinstance(parameters, str):
 		parameters = (parameters,)
 	assert len(parameters) > 0, 'Provide a job attribute to compare jobs.'
-	def get_key(jb):
-		vals = []
-		for param in parameters:
-			assert hasattr(jb, param), 'Can not compare jobs on "{0:s}" since job "{1:s}" does not have this attribute.'.format(param, jb)
-			vals.append(getattr(jb, param))
-		# if len(vals) == 1:
-		# 	return vals[0]
-		return tuple(vals)
 	jobmap = OrderedDict()
 	if filter is None:
 		filter = lambda obj: True
 	for job in jobs:
 		if filter(job):
-			key = get_key(job)
-			assert key not in jobmap, 'Can not compare jobs on "{0:}" since jobs "{1:s}" and "{2:s}" both have value <{3:}>, but values should be unique.'.format(parameters, jobmap[key], job, key)
+			key = compare_key(job, parameters)
+			assert key not in jobmap, 'Can not compare jobs on "{0:}" since jobs "{1:}" and "{2:}" both have value <{3:}>, but values should be unique.'.format(parameters, jobmap[key], job, key)
 			jobmap[key] = job
 	return jobmap
 
@@ -199,6 +376,13 @@ def compare_results(jobs, parameters, parallel=None, filter=None):
 	"""
 	""" param -> job """
 	jobmap = compare_jobs(jobs, parameters, filter=filter)
+	return jobmap_results(jobmap, parallel=parallel)
+
+
+def jobmap_results(jobmap, parallel=None):
+	"""
+	Replace the jobs in a parameters -> job mapping (like from compare_jobs) by their results, omitting jobs without results.
+	"""
 	""" job -> result """
 	results = job_results(jobs=jobmap.values(), parallel=parallel)
 	""" param -> result [if complete] """
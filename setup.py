@@ -38,6 +38,7 @@ setup(
 	install_requires=[
 		'bardeen',
 		'jinja2',
+		'numpy',
 		'xxhash',
 	],
 )
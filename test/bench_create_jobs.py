@@ -0,0 +1,94 @@
+"""
+	benchmark of creating jobs and adding them to a queue: all parameters at once through the process pool (like
+	before), and streaming with iter_jobs (in worker processes or in this process); each way runs in its own process
+	to measure its peak memory
+	(run directly: python -m test.bench_create_jobs [--jobs N] [--chunksize N])
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from functools import partial
+from os import environ
+from os.path import join
+from resource import getrusage, RUSAGE_SELF
+from shutil import rmtree
+from subprocess import check_output
+from sys import executable
+from tempfile import mkdtemp
+from time import time
+
+from fenpei.job_sh_single import ShJobSingle
+from fenpei.utils import ParameterValidationError
+
+
+METHODS = ('map', 'stream', 'serial')
+SUB_FILES = ('run.sh', 'input.in')
+
+
+class BenchJob(ShJobSingle):
+	__slots__ = ()
+
+	@classmethod
+	def get_default_subs(cls, version=1):
+		return OrderedDict([('alpha', 0), ('beta', 0), ('gamma', 1.), ('label', '')])
+
+	@classmethod
+	def get_sub_files(cls):
+		return [join(environ['FENPEI_BENCH_DIR'], name) for name in SUB_FILES]
+
+	@classmethod
+	def run_file(cls):
+		return 'run.sh'
+
+	def check_and_update_subs(self, subs, *args, **kwargs):
+		if subs['alpha'] == 13:
+			raise ParameterValidationError('alpha can not be 13')
+		return subs
+
+
+def generate(job_count):
+	for k in range(job_count):
+		yield dict(name='job{0:d}'.format(k), subs=dict(alpha=k % 1000, beta=k // 1000, label='point{0:d}'.format(k)))
+
+
+def run_method(method, job_count, chunksize):
+	from fenpei.queue import Queue
+	from fenpei.utils import create_jobs, get_pool_light, iter_jobs, _make_inst
+	get_pool_light()
+	start = time()
+	if method == 'map':
+		jobs = get_pool_light().map(partial(_make_inst, JobCls=BenchJob, default_batch='batch'), tuple(generate(job_count)))
+		queue = Queue(jobs=[job for job in jobs if job is not None])
+	elif method == 'stream':
+		queue = Queue(jobs=iter_jobs(BenchJob, generate(job_count), default_batch='batch', chunksize=chunksize))
+	else:
+		queue = Queue(jobs=iter_jobs(BenchJob, generate(job_count), parallel=False, default_batch='batch'))
+	print('{0:d} {1:.3f} {2:.1f}'.format(len(queue.jobs), time() - start, getrusage(RUSAGE_SELF).ru_maxrss / 1024.))
+
+
+def bench(job_count=100000, chunksize=64):
+	tmp = mkdtemp(prefix='fenpei_bench')
+	env = dict(environ, CALC_DIR=join(tmp, 'calc'), FENPEI_BENCH_DIR=tmp)
+	for name in SUB_FILES:
+		with open(join(tmp, name), 'w+') as fh:
+			fh.write('{{ alpha }}\n')
+	print('{0:>8s}  {1:>7s}  {2:>9s}  {3:>13s}'.format('method', 'jobs', 'time (s)', 'peak RSS (MB)'))
+	try:
+		for method in METHODS:
+			out = check_output([executable, '-m', 'test.bench_create_jobs', '--method', method, '--jobs', str(job_count),
+				'--chunksize', str(chunksize)], env=env).decode('utf-8').split()
+			print('{0:>8s}  {1:>7s}  {2:>9s}  {3:>13s}'.format(method, *out[-3:]))
+	finally:
+		rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='benchmark creating jobs')
+	parser.add_argument('--jobs', dest='jobs', type=int, default=100000)
+	parser.add_argument('--chunksize', dest='chunksize', type=int, default=64)
+	parser.add_argument('--method', dest='method', choices=METHODS, default=None, help='run only this way (used internally)')
+	args = parser.parse_args()
+	if args.method:
+		run_method(args.method, args.jobs, args.chunksize)
+	else:
+		bench(job_count=args.jobs, chunksize=args.chunksize)
@@ -0,0 +1,47 @@
+
+"""
+	benchmark of the job distribution algorithms: cost and runtime for 1k, 10k and 100k jobs
+	(run directly: python -m test.bench_distribute [--skip-montecarlo-above N])
+"""
+
+from argparse import ArgumentParser
+from random import Random
+from time import time
+from fenpei.distribute import DISTRIBUTION_METHODS, distribution_cost
+
+
+def make_problem(job_count, fill=1., seed=42):
+	"""
+	Random job weights and node slots, with `fill` times as much job weight as there are slots.
+	"""
+	rand = Random(seed)
+	weights = [rand.choice((1, 1, 1, 2, 2, 4, 8)) for k in range(job_count)]
+	slots = []
+	while sum(slots) < sum(weights) / fill:
+		slots.append(rand.choice((8, 12, 16, 24, 32)))
+	return weights, slots
+
+
+def bench(sizes=(1000, 10000, 100000), fills=(0.9, 2.), skip_montecarlo_above=None):
+	print('{0:>8s}  {1:>6s}  {2:>6s}  {3:>12s}  {4:>14s}  {5:>9s}'.format('jobs', 'nodes', 'fill', 'method', 'cost', 'time (s)'))
+	for size in sizes:
+		for fill in fills:
+			weights, slots = make_problem(size, fill=fill)
+			for name, method in sorted(DISTRIBUTION_METHODS.items()):
+				if name == 'montecarlo' and skip_montecarlo_above is not None and size > skip_montecarlo_above:
+					print('{0:8d}  {1:6d}  {2:6.1f}  {3:>12s}  {4:>14s}  {5:>9s}'.format(size, len(slots), fill, name, 'skipped', '-'))
+					continue
+				start = time()
+				assignment = method(weights, slots)
+				duration = time() - start
+				print('{0:8d}  {1:6d}  {2:6.1f}  {3:>12s}  {4:14.2f}  {5:9.3f}'.format(size, len(slots), fill, name,
+					distribution_cost(weights, slots, assignment), duration))
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='benchmark job distribution algorithms')
+	parser.add_argument('--skip-montecarlo-above', dest='skip', type=int, default=None)
+	args = parser.parse_args()
+	bench(skip_montecarlo_above=args.skip)
+
+
@@ -0,0 +1,63 @@
+"""
+	benchmark of looking up jobs in a queue: compare_jobs with a pass over all jobs each call (like before) and
+	through the queue's job index, and the duplicate parameters report
+	(run directly: python -m test.bench_job_index [--jobs N] [--calls N])
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from os import environ
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+
+KEYS = (('alpha', 'beta', 'label'), ('name',), ('alpha', 'beta', 'gamma', 'label'))
+
+
+def bench(job_count=200000, calls=3):
+	tmp = mkdtemp(prefix='fenpei_bench')
+	environ['CALC_DIR'] = join(tmp, 'calc')
+	from fenpei.job_sh_single import ShJobSingle
+	from fenpei.queue import Queue
+	from fenpei.utils import compare_jobs
+
+	class BenchJob(ShJobSingle):
+		__slots__ = ()
+
+		@classmethod
+		def get_default_subs(cls, version=1):
+			return OrderedDict([('alpha', 0), ('beta', 0), ('gamma', 1.), ('label', '')])
+
+		@classmethod
+		def run_file(cls):
+			return 'run.sh'
+
+	try:
+		jobs = [BenchJob(name='job{0:d}'.format(k), batch_name='batch', subs=dict(alpha=k % 1000, beta=k // 1000,
+			label='point{0:d}'.format(k % 100))) for k in range(job_count)]
+		start = time()
+		queue = Queue(jobs=jobs)
+		queue.show = 0
+		print('{0:d} jobs added in {1:.3f}s'.format(len(jobs), time() - start))
+		print('{0:>8s}  {1:>6s}  {2:>9s}'.format('method', 'calls', 'time (s)'))
+		for label, compare in (('linear', lambda key: compare_jobs(queue.jobs, key)), ('index', queue.compare_jobs)):
+			start = time()
+			for k in range(calls):
+				for key in KEYS:
+					compare(key)
+			print('{0:>8s}  {1:6d}  {2:9.3f}'.format(label, calls * len(KEYS), time() - start))
+		start = time()
+		groups = queue.duplicate_parameters()
+		print('found {0:d} groups of duplicate parameters in {1:.3f}s'.format(len(groups), time() - start))
+	finally:
+		rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='benchmark the job index of queues')
+	parser.add_argument('--jobs', dest='jobs', type=int, default=200000)
+	parser.add_argument('--calls', dest='calls', type=int, default=3)
+	args = parser.parse_args()
+	bench(job_count=args.jobs, calls=args.calls)
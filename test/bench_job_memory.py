@@ -0,0 +1,89 @@
+
+"""
+	benchmark of the memory used by ShJobSingle jobs: with a copy of the substitutions per file plus every parameter
+	as an attribute (like before), with a shared substitution view (now), and without __dict__ (__slots__ = ())
+	(run directly: python -m test.bench_job_memory [--jobs N] [--styles copied,shared,compact])
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from copy import copy
+from gc import collect
+from os import environ
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+from tracemalloc import get_traced_memory, start as trace_start, stop as trace_stop
+
+
+SUB_FILES = ('run.sh', 'input.in', 'settings.conf')
+NOSUB_FILES = ('basis.dat', 'program.bin')
+
+
+STYLES = ('copied', 'shared', 'compact')
+
+
+def bench(job_count=100000, styles=STYLES):
+	tmp = mkdtemp(prefix='fenpei_bench')
+	environ['CALC_DIR'] = join(tmp, 'calc')
+	from fenpei.job_sh_single import ShJobSingle
+	for name in SUB_FILES + NOSUB_FILES:
+		with open(join(tmp, name), 'w+') as fh:
+			fh.write('{{ alpha }}\n')
+
+	class BenchJob(ShJobSingle):
+		@classmethod
+		def get_default_subs(cls, version=1):
+			return OrderedDict([('alpha', 0), ('beta', 0), ('gamma', 1.), ('method', 'ccsd'), ('basis', 'cc-pvdz'),
+				('steps', 100), ('tolerance', 1e-8), ('label', '')])
+
+		@classmethod
+		def get_sub_files(cls):
+			return [join(tmp, name) for name in SUB_FILES]
+
+		@classmethod
+		def get_nosub_files(cls):
+			return [join(tmp, name) for name in NOSUB_FILES]
+
+		@classmethod
+		def run_file(cls):
+			return 'run.sh'
+
+	class CopiedSubsJob(BenchJob):
+		""" Like the jobs before the substitutions were shared. """
+		def __init__(self, *args, **kwargs):
+			super(CopiedSubsJob, self).__init__(*args, **kwargs)
+			for key, val in self.substitutions.items():
+				self.__dict__[key] = val
+			self.files = {fileinfo: (None if subs is None else copy(self.substitutions))
+				for (fileinfo, subs) in self.files.items()}
+
+	class CompactJob(BenchJob):
+		__slots__ = ()
+
+	print('{0:>8s}  {1:>7s}  {2:>9s}  {3:>16s}'.format('jobs', 'style', 'time (s)', 'peak memory (MB)'))
+	try:
+		for label, JobCls in (('copied', CopiedSubsJob), ('shared', BenchJob), ('compact', CompactJob)):
+			if label not in styles:
+				continue
+			collect()
+			trace_start()
+			start = time()
+			jobs = [JobCls(name='job{0:d}'.format(k), batch_name='batch', subs=dict(alpha=k % 13, beta=k % 7,
+				label='point{0:d}'.format(k))) for k in range(job_count)]
+			duration = time() - start
+			peak = get_traced_memory()[1]
+			trace_stop()
+			print('{0:8d}  {1:>7s}  {2:9.3f}  {3:16.1f}'.format(len(jobs), label, duration, peak / 1e6))
+			del jobs
+	finally:
+		rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='benchmark memory use of jobs with substitutions')
+	parser.add_argument('--jobs', dest='jobs', type=int, default=100000)
+	parser.add_argument('--styles', dest='styles', type=str, default=','.join(STYLES))
+	args = parser.parse_args()
+	bench(job_count=args.jobs, styles=args.styles.split(','))
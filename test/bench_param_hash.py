@@ -0,0 +1,71 @@
+"""
+	benchmark of hashing and deduplicating ShJobSingle parameters: pickle per value (like before) and the canonical
+	text hashed with xxh64, per job and with param_hashes
+	(run directly: python -m test.bench_param_hash [--jobs N])
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict, defaultdict
+from os import environ
+from os.path import join
+from pickle import dumps
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+import xxhash
+
+
+def pickle_hash(job):
+	""" The hash like it was calculated before. """
+	h = xxhash.xxh32()
+	for nm in sorted(job.parameter_names):
+		h.update(dumps(job.substitutions[nm]))
+	return h.hexdigest()
+
+
+def bench(job_count=200000):
+	tmp = mkdtemp(prefix='fenpei_bench')
+	environ['CALC_DIR'] = join(tmp, 'calc')
+	from fenpei.job_sh_single import ShJobSingle, param_hashes
+
+	class BenchJob(ShJobSingle):
+		__slots__ = ()
+
+		@classmethod
+		def get_default_subs(cls, version=1):
+			return OrderedDict([('alpha', 0), ('beta', 0), ('gamma', 1.), ('method', 'ccsd'), ('basis', 'cc-pvdz'),
+				('steps', 100), ('tolerance', 1e-8), ('label', '')])
+
+		@classmethod
+		def run_file(cls):
+			return 'run.sh'
+
+	try:
+		start = time()
+		""" every parameter combination occurs twice (with different names) """
+		jobs = [BenchJob(name='job{0:d}'.format(k), batch_name='batch', subs=dict(alpha=(k // 2) % 1000,
+			beta=k // 2000, label='point{0:d}'.format((k // 2) % 100))) for k in range(job_count)]
+		print('created {0:d} jobs in {1:.3f}s'.format(len(jobs), time() - start))
+		print('{0:>12s}  {1:>9s}  {2:>10s}'.format('method', 'time (s)', 'duplicates'))
+		for label, hash_all in (
+				('pickle', lambda jobs: [pickle_hash(job) for job in jobs]),
+				('per job', lambda jobs: [job.param_hash for job in jobs]),
+				('param_hashes', param_hashes),):
+			for job in jobs:
+				job._param_hash = None
+			start = time()
+			groups = defaultdict(list)
+			for job, hsh in zip(jobs, hash_all(jobs)):
+				groups[hsh].append(job)
+			duplicates = sum(len(group) - 1 for group in groups.values())
+			print('{0:>12s}  {1:9.3f}  {2:10d}'.format(label, time() - start, duplicates))
+	finally:
+		rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='benchmark hashing job parameters')
+	parser.add_argument('--jobs', dest='jobs', type=int, default=200000)
+	args = parser.parse_args()
+	bench(job_count=args.jobs)
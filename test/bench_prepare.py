@@ -0,0 +1,81 @@
+
+"""
+	benchmark of preparing ShJobSingle jobs that all use one jinja2 template, with and without the template cache
+	(run directly: python -m test.bench_prepare [--jobs N])
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from os import environ
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+
+TEMPLATE = '''#!/bin/bash
+# job {{ name }} in batch {{ batch_name }}
+{% for k in range(repeats) %}
+echo "step {{ k }}: alpha={{ alpha }} beta={{ beta }}"
+{% endfor %}
+{% if beta > 10 %}
+echo "large beta"
+{% endif %}
+'''
+
+
+def bench(job_count=10000):
+	tmp = mkdtemp(prefix='fenpei_bench')
+	environ['CALC_DIR'] = join(tmp, 'calc')
+	from fenpei.job_sh_single import ShJobSingle
+	from fenpei.queue_local import LocalQueue
+	from fenpei.utils import TEMPLATE_CACHE, substitute_jinja2
+	template_path = join(tmp, 'run.sh')
+	with open(template_path, 'w+') as fh:
+		fh.write(TEMPLATE)
+
+	class BenchJob(ShJobSingle):
+		@classmethod
+		def get_default_subs(cls, version=1):
+			return OrderedDict([('alpha', 0), ('beta', 0), ('repeats', 1)])
+
+		@classmethod
+		def get_sub_files(cls):
+			return [template_path]
+
+		@classmethod
+		def run_file(cls):
+			return 'run.sh'
+
+	print('{0:>6s}  {1:>7s}  {2:>10s}  {3:>11s}  {4:>6s}  {5:>7s}'.format('cache', 'jobs', 'render (s)', 'prepare (s)',
+		'hits', 'misses'))
+	try:
+		for maxsize in (256, 0):
+			TEMPLATE_CACHE.clear()
+			TEMPLATE_CACHE.maxsize = maxsize
+			batch = 'bench{0:d}'.format(maxsize)
+			jobs = [BenchJob(name='job{0:d}'.format(k), batch_name=batch, subs=dict(alpha=k % 7, beta=k % 23, repeats=5))
+				for k in range(job_count)]
+			queue = LocalQueue(jobs=jobs)
+			queue.show = 0
+			""" only the substitution, then the whole preparation (which includes it) """
+			start = time()
+			for job in jobs:
+				substitute_jinja2(TEMPLATE, job.substitutions, filename=template_path)
+			render_duration = time() - start
+			TEMPLATE_CACHE.clear()
+			start = time()
+			queue.prepare(parallel=True)
+			prepare_duration = time() - start
+			print('{0:>6s}  {1:7d}  {2:10.3f}  {3:11.3f}  {4:6d}  {5:7d}'.format('on' if maxsize else 'off', job_count,
+				render_duration, prepare_duration, TEMPLATE_CACHE.hits, TEMPLATE_CACHE.misses))
+			rmtree(join(tmp, 'calc', batch))
+	finally:
+		rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='benchmark preparing jobs with one jinja2 template')
+	parser.add_argument('--jobs', dest='jobs', type=int, default=10000)
+	args = parser.parse_args()
+	bench(job_count=args.jobs)
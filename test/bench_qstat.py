@@ -0,0 +1,93 @@
+
+"""
+	benchmark of parsing `qstat -xml -r` output: the old minidom parser versus the streaming parser, for 50k jobs
+	(run directly: python -m test.bench_qstat [--jobs N])
+"""
+
+from argparse import ArgumentParser
+from io import BytesIO
+from time import time
+from tracemalloc import get_traced_memory, start as trace_start, stop as trace_stop
+from xml.dom.minidom import parse
+from fenpei.queue_qsub import parse_qstat
+
+
+JOB_XML = '''    <job_list state="{list_state:s}">
+      <JB_job_number>{nr:d}</JB_job_number>
+      <JAT_prio>0.50500</JAT_prio>
+      <JB_name>job_{nr:d}_with_a_long_descriptive_name</JB_name>
+      <JB_owner>user{user:d}</JB_owner>
+      <state>{state:s}</state>
+      <JAT_start_time>2016-01-01T12:00:00</JAT_start_time>
+      <queue_name>{queue:s}</queue_name>
+      <slots>1</slots>
+      <full_job_name>job_{nr:d}_with_a_long_descriptive_name</full_job_name>
+      <hard_request name="h_vmem" resource_contribution="0.000000">4G</hard_request>
+      <hard_req_queue>queuename</hard_req_queue>
+    </job_list>
+'''
+
+
+def make_qstat_xml(job_count):
+	"""
+	Synthetic qstat xml: a quarter of the jobs is pending (no queue yet), the rest runs on 500 nodes.
+	"""
+	running, pending = [], []
+	for nr in range(1, job_count + 1):
+		if nr % 4:
+			running.append(JOB_XML.format(list_state='running', nr=nr, user=nr % 7, state='r',
+				queue='queuename@node{0:d}.cluster'.format(nr % 500)))
+		else:
+			pending.append(JOB_XML.format(list_state='pending', nr=nr, user=nr % 7, state='qw', queue=''))
+	return ('<?xml version="1.0"?>\n<job_info>\n  <queue_info>\n' + ''.join(running) +
+		'  </queue_info>\n  <job_info>\n' + ''.join(pending) + '  </job_info>\n</job_info>\n').encode('utf-8')
+
+
+def parse_qstat_minidom(source):
+	"""
+	The previous implementation, for comparison.
+	"""
+	dom = parse(source)
+	jobelem = dom.getElementsByTagName('job_info')
+	joblist = jobelem[0].getElementsByTagName('job_list')
+	jobs = []
+	for job in joblist:
+		jobstate = job.getElementsByTagName('state')[0].childNodes[0].data
+		try:
+			qstatqueue = job.getElementsByTagName('queue_name')[0].childNodes[0].data
+		except IndexError:
+			qstatqueue = '(no queue yet)'
+		try:
+			node = qstatqueue.split('@')[1].split('.')[0]
+		except IndexError:
+			node = None
+		jobs.append({
+			'pid': int(job.getElementsByTagName('JB_job_number')[0].childNodes[0].data),
+			'name': job.getElementsByTagName('JB_name')[0].childNodes[0].data,
+			'user': job.getElementsByTagName('JB_owner')[0].childNodes[0].data,
+			'queue': qstatqueue,
+			'node': node,
+			'state': jobstate,
+		})
+	return jobs
+
+
+def bench(job_count=50000):
+	xml = make_qstat_xml(job_count)
+	print('{0:d} jobs, {1:.1f} MB of xml'.format(job_count, len(xml) / 1e6))
+	print('{0:>10s}  {1:>9s}  {2:>15s}  {3:>7s}'.format('parser', 'time (s)', 'peak memory (MB)', 'jobs'))
+	for name, func in (('minidom', parse_qstat_minidom), ('iterparse', parse_qstat)):
+		trace_start()
+		start = time()
+		jobs = func(BytesIO(xml))
+		duration = time() - start
+		peak = get_traced_memory()[1]
+		trace_stop()
+		print('{0:>10s}  {1:9.3f}  {2:15.1f}  {3:7d}'.format(name, duration, peak / 1e6, len(jobs)))
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='benchmark qstat xml parsing')
+	parser.add_argument('--jobs', dest='jobs', type=int, default=50000)
+	args = parser.parse_args()
+	bench(job_count=args.jobs)
@@ -0,0 +1,24 @@
+
+"""
+	helpers shared by the tests
+"""
+
+from os import chmod, environ, pathsep
+from os.path import join
+
+
+def fake_exe(tmpdir, monkeypatch, name, script):
+	"""
+	Write an executable `name` (like ssh or qsub) into `tmpdir` and put that directory first on the PATH, so that
+	it is used instead of the real command for the rest of the test.
+
+	:return: the path of the executable.
+	"""
+	directory = str(tmpdir)
+	pth = join(directory, name)
+	with open(pth, 'w+') as fh:
+		fh.write(script)
+	chmod(pth, 0o755)
+	if environ['PATH'].split(pathsep)[0] != directory:
+		monkeypatch.setenv('PATH', directory + pathsep + environ['PATH'])
+	return pth
@@ -0,0 +1,91 @@
+
+"""
+	test jobs that declare __slots__: no __dict__, derived directories, shared batch names and layouts, pickling
+"""
+
+from collections import OrderedDict
+from os.path import join
+from pickle import dumps, loads
+from pytest import raises
+import fenpei.job
+from fenpei.job import Job
+from fenpei.job_sh_single import ShJobSingle
+
+
+class CompactJob(ShJobSingle):
+
+	__slots__ = ()
+
+	@classmethod
+	def get_default_subs(cls, version=1):
+		return OrderedDict([('alpha', 0), ('beta', 'b')])
+
+	@classmethod
+	def run_file(cls):
+		return 'run.sh'
+
+
+class CompactBaseJob(Job):
+
+	__slots__ = ()
+
+
+def make_jobs(tmpdir, monkeypatch, count=3):
+	src = tmpdir.mkdir('src')
+	src.join('run.sh').write('echo {{ alpha }}')
+	src.join('data.dat').write('data')
+	calc = str(tmpdir.mkdir('calc'))
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', calc)
+	monkeypatch.setattr(CompactJob, 'get_sub_files', classmethod(lambda cls: [str(src.join('run.sh'))]))
+	monkeypatch.setattr(CompactJob, 'get_nosub_files', classmethod(lambda cls: [str(src.join('data.dat'))]))
+	return calc, [CompactJob(name='job{0:d}'.format(k), subs=dict(alpha=k), batch_name=''.join(['bat', 'ch']))
+		for k in range(count)]
+
+
+def test_compact_fields(tmpdir, monkeypatch):
+	calc, jobs = make_jobs(tmpdir, monkeypatch)
+	job = jobs[1]
+	assert not hasattr(job, '__dict__')
+	with raises(AttributeError):
+		job.something_else = 1
+	assert job.alpha == 1 and job.beta == 'b'
+	assert job.directory == join(calc, 'batch', 'job1')
+	assert job.parameter_file_path == join(calc, 'batch', 'job1', 'parameters.json')
+	assert jobs[0].batch_name is jobs[2].batch_name
+	assert jobs[0].parameter_names is jobs[2].parameter_names
+	assert jobs[0]._file_layout is jobs[2]._file_layout
+	views = [subs for subs in job.files.values() if subs is not None]
+	assert len(views) == 1 and views[0]['alpha'] == 1 and len(job.files) == 2
+	fileinfo = next(iter(job.files))
+	with raises(TypeError):
+		job.files[fileinfo] = None
+	with raises(AttributeError):
+		job.files.update({})
+	job.files = {fileinfo: None}
+	assert dict(job.files) == {fileinfo: None}
+	job.files[fileinfo] = job.substitutions
+	assert job.files[fileinfo] is job.substitutions
+	assert jobs[0]._file_layout is jobs[2]._file_layout
+	job.directory = join(str(tmpdir), 'elsewhere')
+	assert job.parameter_file_path == join(str(tmpdir), 'elsewhere', 'parameters.json')
+	base = CompactBaseJob(name='base', batch_name=False)
+	assert not hasattr(base, '__dict__')
+	assert base.node is None and base.pid is None and base.queue is None
+	assert base.directory == join(calc, 'base')
+
+
+def test_compact_prepare_and_pickle(tmpdir, monkeypatch):
+	calc, jobs = make_jobs(tmpdir, monkeypatch)
+	job = jobs[2]
+	assert job.prepare()
+	assert job.is_prepared()
+	assert tmpdir.join('calc', 'batch', 'job2', 'run.sh').read() == 'echo 2'
+	job.check_config()
+	copied = loads(dumps(job))
+	assert copied.name == 'job2' and copied.alpha == 2 and copied.status == job.status
+	assert copied.directory == job.directory
+	assert copied._file_layout is job._file_layout and copied.parameter_names is job.parameter_names
+	assert sorted(copied.files.keys()) == sorted(job.files.keys())
+	assert copied.is_prepared()
+
+
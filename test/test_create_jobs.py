@@ -0,0 +1,60 @@
+
+"""
+	test creating jobs as a stream: parameters are taken a window at a time (in this process or in worker
+	processes), and invalid jobs are skipped
+"""
+
+from io import StringIO
+import fenpei.utils
+from fenpei.job import Job
+from fenpei.utils import iter_jobs, create_jobs, ParameterValidationError
+
+
+class CountJob(Job):
+
+	def __init__(self, name, alpha, *args, **kwargs):
+		if alpha == 3:
+			raise ParameterValidationError('alpha can not be 3')
+		super(CountJob, self).__init__(name, *args, **kwargs)
+		self.alpha = alpha
+
+
+def test_iter_jobs_lazy():
+	taken = []
+	def params():
+		for k in range(10):
+			taken.append(k)
+			yield dict(name='job{0:d}'.format(k), alpha=k)
+	jobs = iter_jobs(CountJob, params(), parallel=False, default_batch='stream', window=4)
+	first = next(jobs)
+	assert first.alpha == 0 and first.batch_name == 'stream'
+	assert taken == [0, 1, 2, 3]
+	assert [job.alpha for job in jobs] == [1, 2, 4, 5, 6, 7, 8, 9]
+	assert taken == list(range(10))
+
+
+def test_iter_jobs_parallel():
+	taken = []
+	def params():
+		for k in range(20):
+			taken.append(k)
+			yield dict(name='job{0:d}'.format(k), alpha=k)
+	jobs = iter_jobs(CountJob, params(), parallel=True, default_batch='stream', chunksize=2, window=4)
+	first = next(jobs)
+	assert first.alpha == 0 and first.batch_name == 'stream'
+	""" the next window is being created while the first one is used """
+	assert taken == list(range(8))
+	assert [job.alpha for job in jobs] == [k for k in range(1, 20) if k != 3]
+	assert len(create_jobs(CountJob, (dict(name='job{0:d}'.format(k), alpha=k) for k in range(10)),
+		default_batch='stream', window=3)) == 9
+
+
+def test_create_jobs_skipped(monkeypatch):
+	err = StringIO()
+	monkeypatch.setattr(fenpei.utils, 'stderr', err)
+	jobs = create_jobs(CountJob, (dict(name='job{0:d}'.format(k), alpha=k) for k in range(5)), parallel=False,
+		default_batch='stream')
+	assert [job.alpha for job in jobs] == [0, 1, 2, 4]
+	assert 'skipping 1 of 5 jobs' in err.getvalue()
+
+
@@ -0,0 +1,70 @@
+
+"""
+	test the job distribution algorithms, their statistics and the running loads of DistributionState
+"""
+
+from random import seed
+from pytest import raises
+from fenpei.distribute import distribute_lpt, distribute_monte_carlo, distribution_cost, DistributionState
+from fenpei.job import Job
+from fenpei.queue import Queue
+from test.bench_distribute import make_problem
+
+
+def test_lpt_deterministic_and_better_than_montecarlo():
+	weights, slots = make_problem(2000, fill=0.9)
+	assignment = distribute_lpt(weights, slots)
+	assert list(assignment) == list(distribute_lpt(weights, slots))
+	assert 0 <= assignment.min() and assignment.max() < len(slots)
+	assert distribution_cost(weights, slots, assignment) <= distribution_cost(weights, slots, distribute_monte_carlo(weights, slots))
+
+
+def test_queue_distribution_methods():
+	queue = Queue(jobs=[Job(name='job{0:d}'.format(k), weight=1 + k % 3, batch_name=False) for k in range(50)])
+	queue.show = 0
+	queue.nodes, queue.slots = ['node1', 'node2', 'node3'], [4, 8, 16]
+	for method in ('lpt', 'montecarlo', lambda weights, slots: [0] * len(weights)):
+		distribution = queue.distribute_jobs(method=method)
+		assert sorted(distribution.keys()) == [0, 1, 2]
+		assert sorted(sum(distribution.values(), []), key=lambda job: job.name) == sorted(queue.jobs, key=lambda job: job.name)
+	assert queue.distribute_jobs(method='montecarlo', max_reject_spree=50)
+	for method in ('lpt', lambda weights, slots: [0] * len(weights)):
+		with raises(ValueError):
+			queue.distribute_jobs(method=method, max_reject_spree=50)
+
+
+
+
+def test_lpt_stats():
+	weights, slots, stats = [3, 3, 2, 2, 2], [6, 6], {}
+	assignment = distribute_lpt(weights, slots, stats=stats)
+	assert list(assignment) == [0, 1, 0, 1, 0]
+	assert abs(distribution_cost(weights, slots, assignment) - (1 + 6. / 7 + 6. / 5)) < 1e-9
+	""" one step that finds no move that lowers the cost """
+	assert stats == {'steps': 1, 'moves': 0}
+	distribute_lpt(weights, [12], stats=stats)
+	assert stats == {'steps': 0, 'moves': 0}
+
+
+def test_distribution_state():
+	state = DistributionState([1., 2., 4.], 2)
+	for job, node in ((0, 0), (1, 0), (2, 1)):
+		state.add(job, node)
+	assert state.loads == [3., 4.]
+	state.move(0, 0, 1)
+	assert state.jobs == [[1], [2, 0]] and state.loads == [2., 5.]
+	state.swap(0, 0, 1, 0)
+	assert state.jobs == [[2], [1, 0]] and state.loads == [4., 3.]
+	assert list(state.assignment()) == [1, 1, 0]
+	assert (state.moves, state.swaps) == (1, 1)
+
+
+def test_monte_carlo_stats():
+	seed(4)
+	weights, slots = make_problem(200, fill=0.9)
+	stats = {}
+	distribute_monte_carlo(weights, slots, stats=stats)
+	assert stats['moves'] + stats['swaps'] <= stats['steps']
+	assert stats['moves'] + stats['swaps'] > 0
+	distribute_monte_carlo(weights, [10], stats=stats)
+	assert stats == {'steps': 0, 'moves': 0, 'swaps': 0}
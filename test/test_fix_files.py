@@ -0,0 +1,103 @@
+
+"""
+	test that file specifications are expanded correctly, cached between jobs, and expanded again after changes
+"""
+
+from collections import OrderedDict
+from os.path import join
+from pytest import raises
+import fenpei.job
+import fenpei.job_sh
+from fenpei.job_sh import ShJob, expand_files
+from fenpei.job_sh_single import ShJobSingle
+from fenpei.utils import create_jobs
+
+
+class TreeJob(ShJobSingle):
+
+	@classmethod
+	def get_default_subs(cls, version=1):
+		return OrderedDict([('alpha', 0)])
+
+	@classmethod
+	def run_file(cls):
+		return 'run.sh'
+
+
+def _make_tree(tmpdir):
+	tpl = tmpdir.mkdir('tpl')
+	tpl.join('run.sh').write('#!/bin/sh\n')
+	tpl.mkdir('sub').join('b.dat').write('b')
+	tpl.join('sub').mkdir('deeper').join('c.dat').write('c')
+	return str(tmpdir), tpl
+
+
+def test_expand_dirs(tmpdir):
+	root, tpl = _make_tree(tmpdir)
+	into = (root, 'tpl', 'tpl')
+	contents = (join(root, 'tpl'), '', '')
+	expanded = expand_files((into, contents))
+	assert expanded[into] == [(root, 'tpl/run.sh', 'tpl/run.sh'), (root, 'tpl/sub/b.dat', 'tpl/sub/b.dat'),
+		(root, 'tpl/sub/deeper/c.dat', 'tpl/sub/deeper/c.dat')]
+	assert expanded[contents] == [(join(root, 'tpl'), 'run.sh', 'run.sh'), (join(root, 'tpl'), 'sub/b.dat', 'sub/b.dat'),
+		(join(root, 'tpl'), 'sub/deeper/c.dat', 'sub/deeper/c.dat')]
+	with raises(ShJob.FileNotFound):
+		expand_files(((root, 'missing.dat', 'missing.dat'),), ShJob.FileNotFound)
+
+
+def test_cache_and_changes(tmpdir, monkeypatch):
+	root, tpl = _make_tree(tmpdir)
+	monkeypatch.setattr(fenpei.job_sh, '_EXPANDED_FILES', {})
+	specs = ((join(root, 'tpl'), '', ''),)
+	first = expand_files(specs)
+	assert expand_files(specs) is first
+	tpl.join('sub', 'deeper').join('d.dat').write('d')
+	second = expand_files(specs)
+	assert second is not first
+	assert (join(root, 'tpl'), 'sub/deeper/d.dat', 'sub/deeper/d.dat') in second[specs[0]]
+	tpl.join('sub', 'b.dat').remove()
+	assert (join(root, 'tpl'), 'sub/b.dat', 'sub/b.dat') not in expand_files(specs)[specs[0]]
+
+
+def test_instance_files(tmpdir, monkeypatch):
+	root, tpl = _make_tree(tmpdir)
+	extra = tmpdir.join('extra.dat')
+	extra.write('extra')
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', join(root, 'calc'))
+	monkeypatch.setattr(TreeJob, 'get_sub_files', classmethod(lambda cls: [str(tpl.join('run.sh'))]))
+	plain = TreeJob(name='plain', subs={}, batch_name='batch')
+	more = TreeJob(name='more', subs={}, batch_name='batch', nosub_files=[str(extra)])
+	again = TreeJob(name='again', subs={}, batch_name='batch')
+	assert sorted(target for _, _, target in plain.files) == ['run.sh']
+	assert sorted(target for _, _, target in more.files) == ['extra.dat', 'run.sh']
+	assert sorted(target for _, _, target in again.files) == ['run.sh']
+	assert more.files[(root, 'extra.dat', 'extra.dat')] is None
+	assert more.files[(str(tpl), 'run.sh', 'run.sh')]['name'] == 'more'
+
+def test_checked_once_per_batch(tmpdir, monkeypatch):
+	root, tpl = _make_tree(tmpdir)
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', join(root, 'calc'))
+	monkeypatch.setattr(fenpei.job_sh, '_EXPANDED_FILES', {})
+	monkeypatch.setattr(TreeJob, 'get_sub_files', classmethod(lambda cls: [str(tpl)]))
+	checks = []
+	unchanged = fenpei.job_sh._mtimes_unchanged
+	monkeypatch.setattr(fenpei.job_sh, '_mtimes_unchanged', lambda mtimes: checks.append(1) or unchanged(mtimes))
+	jobs = create_jobs(TreeJob, ({'name': 'job{0:d}'.format(k), 'subs': {}} for k in range(20)),
+		parallel=False, default_batch='batch')
+	assert len(jobs) == 20
+	assert len(checks) == 0
+	TreeJob(name='single', subs={}, batch_name='batch')
+	TreeJob(name='other', subs={}, batch_name='batch')
+	assert len(checks) == 2
+	create_jobs(TreeJob, ({'name': 'again{0:d}'.format(k), 'subs': {}} for k in range(20)),
+		parallel=False, default_batch='batch')
+	assert len(checks) == 3
+
+
+def test_cache_bounded(tmpdir, monkeypatch):
+	root, tpl = _make_tree(tmpdir)
+	monkeypatch.setattr(fenpei.job_sh, '_EXPANDED_FILES', {})
+	monkeypatch.setattr(fenpei.job_sh, '_EXPANDED_FILES_LIMIT', 3)
+	for name in ('run.sh', 'sub', 'sub/b.dat', 'sub/deeper', 'sub/deeper/c.dat'):
+		expand_files(((str(tpl), name, name),))
+		assert len(fenpei.job_sh._EXPANDED_FILES) <= 3
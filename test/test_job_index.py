@@ -0,0 +1,113 @@
+
+"""
+	test the job index of queues: compare_jobs, duplicate paths and parameters, and --jobs filtering
+"""
+
+from collections import OrderedDict
+from pickle import dumps, loads
+from pytest import raises
+import fenpei.job
+import fenpei.job_index
+from fenpei.job_sh_single import ShJobSingle
+from fenpei.queue import Queue
+from fenpei.utils import compare_jobs
+
+
+class IndexJob(ShJobSingle):
+
+	@classmethod
+	def get_default_subs(cls, version=1):
+		return OrderedDict([('alpha', 0), ('beta', 0)])
+
+	@classmethod
+	def run_file(cls):
+		return 'run.sh'
+
+
+def make_queue(tmpdir, monkeypatch):
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', str(tmpdir))
+	jobs = [IndexJob(name='job{0:d}'.format(k), subs=dict(alpha=k % 3, beta=k // 3), batch_name='batch')
+		for k in range(9)]
+	queue = Queue(jobs=jobs)
+	queue.show = 0
+	return queue
+
+
+def test_compare_jobs(tmpdir, monkeypatch):
+	queue = make_queue(tmpdir, monkeypatch)
+	calls = []
+	def counting_getter(parameters):
+		getter = fenpei.job_index.attrgetter(*parameters)
+		def get_key(job):
+			calls.append(job)
+			return getter(job) if len(parameters) > 1 else (getter(job),)
+		return get_key
+	monkeypatch.setattr(fenpei.job_index, '_key_getter', counting_getter)
+	jobmap = queue.compare_jobs(('alpha', 'beta'))
+	assert jobmap == compare_jobs(queue.jobs, ('alpha', 'beta'))
+	assert list(jobmap.values()) == queue.jobs
+	assert queue.compare_jobs(['alpha', 'beta']) == jobmap and len(calls) == 9
+	with raises(AssertionError):
+		queue.compare_jobs('alpha')
+	assert list(queue.compare_jobs('alpha', filter=lambda job: job.beta == 1).keys()) == [(0,), (1,), (2,)]
+	del calls[:]
+	queue.add_job(IndexJob(name='job9', subs=dict(alpha=0, beta=3), batch_name='batch'))
+	""" both cached sets of parameters are updated for the new job, instead of being rebuilt """
+	assert queue.compare_jobs(('alpha', 'beta'))[(0, 3)].name == 'job9' and len(calls) == 2
+	queue.jobs = queue.jobs[:4]
+	assert len(queue.compare_jobs(('alpha', 'beta'))) == 4
+
+
+def test_duplicates(tmpdir, monkeypatch):
+	queue = make_queue(tmpdir, monkeypatch)
+	assert queue.duplicate_parameters() == []
+	with raises(AssertionError):
+		queue.compare_jobs('unknown')
+	queue.add_jobs([IndexJob(name='copy', subs=dict(alpha=1, beta=2), batch_name='other'),
+		IndexJob(name='job7', subs=dict(alpha=1, beta=2), batch_name='other')])
+	groups = queue.duplicate_parameters()
+	assert len(groups) == 1 and [job.name for job in groups[0]] == ['job7', 'copy', 'job7']
+	queue._same_path_check(fail=True)
+	queue.add_job(IndexJob(name='job3', subs=dict(alpha=5), batch_name='batch'))
+	with raises(AssertionError):
+		queue._same_path_check(fail=True)
+	assert loads(dumps(queue.job_index)).count == 0
+
+
+def test_filter_jobs(tmpdir, monkeypatch):
+	queue = make_queue(tmpdir, monkeypatch)
+	names = lambda jobs: [job.name for job in jobs]
+	assert names(queue.filter_jobs('job5 job1 job[7-8]', queue.jobs)) == ['job1', 'job5', 'job7', 'job8']
+	assert names(queue.filter_jobs('job?', queue.jobs[:3])) == ['job0', 'job1', 'job2']
+	with raises(ValueError):
+		queue.filter_jobs('job1 nojob', queue.jobs)
+	with raises(ValueError):
+		queue.filter_jobs('x*', queue.jobs)
+	listing = tmpdir.join('jobs.txt')
+	listing.write('job4\n\njob2\n')
+	assert names(queue.filter_jobs(str(listing), queue.jobs)) == ['job2', 'job4']
+
+
+
+
+def test_changed_attributes(tmpdir, monkeypatch):
+	queue = make_queue(tmpdir, monkeypatch)
+	for job in queue.jobs:
+		job.gamma = int(job.name[3:])
+	assert list(queue.compare_jobs('gamma').keys())[:2] == [(0,), (1,)]
+	queue.jobs[0].gamma = 50
+	assert list(queue.compare_jobs('gamma').keys())[:2] == [(50,), (1,)]
+	assert queue.compare_jobs('gamma') == compare_jobs(queue.jobs, 'gamma')
+	assert ('alpha', 'beta') not in queue.job_index._by_params
+	queue.compare_jobs(('alpha', 'beta'))
+	assert ('alpha', 'beta') in queue.job_index._by_params and ('gamma',) not in queue.job_index._by_params
+
+
+def test_hash_collisions(tmpdir, monkeypatch):
+	queue = make_queue(tmpdir, monkeypatch)
+	for job in queue.jobs:
+		job._param_hash = 'same'
+	queue.add_job(IndexJob(name='copy', subs=dict(alpha=1, beta=2), batch_name='other'))
+	queue.jobs[-1]._param_hash = 'same'
+	groups = queue.duplicate_parameters()
+	assert [[job.name for job in group] for group in groups] == [['job7', 'copy']]
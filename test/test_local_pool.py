@@ -0,0 +1,110 @@
+
+"""
+	test that the local pool starts jobs as slots free up, and that LocalQueue uses it to start jobs
+"""
+
+from os.path import join, exists
+from pickle import dumps, loads
+from time import sleep
+from bardeen.system import mkdirp
+from fenpei.job import Job
+from fenpei.local_pool import LocalPool
+from fenpei.queue_local import LocalQueue
+
+
+class SleepJob(Job):
+
+	def is_prepared(self):
+		return True
+
+	def is_complete(self):
+		return exists(join(self.directory, 'done'))
+
+	def start_cmd(self):
+		return 'touch done'
+
+
+def _make_jobs(tmpdir, count, weight=1):
+	jobs = []
+	for k in range(count):
+		job = SleepJob(name='job{0:d}'.format(k), weight=weight, batch_name=False)
+		job.directory = join(str(tmpdir), job.name)
+		mkdirp(job.directory)
+		jobs.append(job)
+	return jobs
+
+
+def test_pool_slots(tmpdir):
+	pool = LocalPool(slots=4)
+	jobs = _make_jobs(tmpdir, 7, weight=2)
+	started = []
+	for job in jobs:
+		assert pool.submit(job, 'sleep 0.3', on_start=started.append)
+	assert not pool.submit(jobs[-1], 'sleep 0.3')
+	assert len(started) == 2 and len(pool.pending) == 5
+	assert pool.running_pids() == frozenset(started)
+	assert pool.join(timeout=5)
+	assert len(started) == 7
+	assert pool.wait(timeout=5)
+	assert pool.used == 0 and not pool.failed
+	copy = loads(dumps(pool))
+	assert copy.slots == 4 and not copy.running
+
+
+def test_pool_heavy_job(tmpdir):
+	pool = LocalPool(slots=2)
+	light, heavy = _make_jobs(tmpdir, 2)
+	heavy.weight = 5
+	pool.submit(light, 'sleep 0.2')
+	pool.submit(heavy, 'sleep 0')
+	assert len(pool.pending) == 1
+	assert pool.wait(timeout=5)
+
+
+def test_local_queue_pool(tmpdir):
+	jobs = _make_jobs(tmpdir, 12)
+	queue = LocalQueue(jobs=jobs, slots=3, use_pool=True)
+	queue.show = 0
+	queue.start()
+	assert len(queue.local_pool.pending) <= 9
+	assert queue.local_pool.wait(timeout=10)
+	for job in jobs:
+		assert exists(join(job.directory, 'done'))
+		node, pid = job.node, job.pid
+		job.node = job.pid = None
+		assert job.load()
+		assert (job.node, job.pid) == (node, pid)
+		assert isinstance(pid, int)
+	queue.process_snapshot.expire()
+	assert not jobs[0].is_running()
+	assert queue.slots == [3]
+
+
+class SlowJob(SleepJob):
+
+	def start_cmd(self):
+		return 'sleep 0.3'
+
+
+class MissingJob(SleepJob):
+
+	def start_cmd(self):
+		return './does-not-exist'
+
+
+def test_local_queue_failed_start(tmpdir, monkeypatch):
+	jobs = [SlowJob(name='job{0:d}'.format(k), batch_name=False) for k in range(2)] + \
+		[MissingJob(name='missing', batch_name=False)]
+	for job in jobs:
+		job.directory = join(str(tmpdir), job.name)
+		mkdirp(job.directory)
+	queue = LocalQueue(jobs=jobs, slots=1, use_pool=True)
+	logged = []
+	monkeypatch.setattr(queue, '_log', lambda txt, level=1: logged.append(txt))
+	queue.start()
+	assert 'started 1 jobs' in logged
+	assert '2 jobs are queued until slots are free' in logged
+	assert queue.local_pool.wait(timeout=10)
+	assert [job for job, err in queue.local_pool.failed] == [jobs[-1]]
+	assert any(txt.startswith('job missing could not be started') for txt in logged)
+	assert jobs[-1].pid is None
@@ -0,0 +1,103 @@
+
+"""
+	test putting files in job directories with each link mode, the fallbacks, and the prepare summary
+"""
+
+from collections import OrderedDict
+from errno import EXDEV, EEXIST
+from os import stat
+from os.path import islink, join
+from pytest import raises
+import fenpei.job
+import fenpei.materialize
+from fenpei.job_sh_single import ShJobSingle
+from fenpei.materialize import materialize
+from fenpei.queue_local import LocalQueue
+
+
+class LinkJob(ShJobSingle):
+
+	@classmethod
+	def get_default_subs(cls, version=1):
+		return OrderedDict([('alpha', 0)])
+
+	@classmethod
+	def run_file(cls):
+		return 'run.sh'
+
+
+def test_modes(tmpdir):
+	source = tmpdir.join('source.dat')
+	source.write('data')
+	source = str(source)
+	assert materialize(source, str(tmpdir.join('sym')), 'symlink') == 'symlink'
+	assert islink(str(tmpdir.join('sym')))
+	assert materialize(source, str(tmpdir.join('hard')), 'hardlink') == 'hardlink'
+	assert stat(str(tmpdir.join('hard'))).st_ino == stat(source).st_ino
+	assert materialize(source, str(tmpdir.join('clone')), 'reflink') in ('reflink', 'copy')
+	assert materialize(source, str(tmpdir.join('copy')), 'copy') == 'copy'
+	for name in ('clone', 'copy'):
+		assert tmpdir.join(name).read() == 'data'
+		assert stat(str(tmpdir.join(name))).st_ino != stat(source).st_ino
+
+
+def test_fallback_remembered(tmpdir, monkeypatch):
+	calls = []
+	def cross_device_link(source, dest):
+		calls.append(dest)
+		raise OSError(EXDEV, 'Invalid cross-device link')
+	monkeypatch.setitem(fenpei.materialize.MAKERS, 'hardlink', cross_device_link)
+	monkeypatch.setattr(fenpei.materialize, '_unsupported', set())
+	source = tmpdir.join('source.dat')
+	source.write('data')
+	for k in range(3):
+		assert materialize(str(source), str(tmpdir.join('dest{0:d}'.format(k))), 'hardlink') in ('reflink', 'copy')
+		assert tmpdir.join('dest{0:d}'.format(k)).read() == 'data'
+	assert len(calls) == 1
+
+
+def test_other_errors_raised(tmpdir):
+	source = tmpdir.join('source.dat')
+	source.write('data')
+	tmpdir.join('dest').write('existing')
+	with raises(OSError) as err:
+		materialize(str(source), str(tmpdir.join('dest')), 'symlink')
+	assert err.value.errno == EEXIST
+	assert tmpdir.join('dest').read() == 'existing'
+
+
+def test_prepare_summary(tmpdir, monkeypatch):
+	src = tmpdir.mkdir('src')
+	src.join('run.sh').write('#!/bin/sh\necho {{ alpha }}\n')
+	src.join('static.dat').write('static\n')
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', str(tmpdir.mkdir('calc')))
+	monkeypatch.setattr(LinkJob, 'get_sub_files', classmethod(lambda cls: [str(src.join('run.sh'))]))
+	monkeypatch.setattr(LinkJob, 'get_nosub_files', classmethod(lambda cls: [str(src.join('static.dat'))]))
+	jobs = [LinkJob(name='job{0:d}'.format(k), subs=dict(alpha=k), batch_name='batch', link_mode='hardlink')
+		for k in range(5)]
+	queue = LocalQueue(jobs=jobs)
+	logged = []
+	monkeypatch.setattr(queue, '_log', lambda txt, level=1: logged.append(txt))
+	queue.prepare(parallel=False)
+	assert 'added files: 5 hardlink' in logged
+	for job in jobs:
+		assert stat(join(job.directory, 'static.dat')).st_ino == stat(str(src.join('static.dat'))).st_ino
+
+
+def test_hardlink_permissions(tmpdir, monkeypatch):
+	src = tmpdir.mkdir('src')
+	src.join('run.sh').write('#!/bin/sh\necho hi\n')
+	src.join('static.dat').write('static\n')
+	for name in ('run.sh', 'static.dat'):
+		src.join(name).chmod(0o644)
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', str(tmpdir.mkdir('calc')))
+	monkeypatch.setattr(LinkJob, 'get_nosub_files', classmethod(lambda cls: [str(src.join('run.sh')), str(src.join('static.dat'))]))
+	job = LinkJob(name='job', subs=dict(alpha=1), batch_name='batch', link_mode='hardlink')
+	job.queue = LocalQueue(jobs=[job])
+	job.queue.show = 0
+	job.prepare()
+	assert stat(join(job.directory, 'static.dat')).st_ino == stat(str(src.join('static.dat'))).st_ino
+	assert stat(join(job.directory, 'run.sh')).st_ino != stat(str(src.join('run.sh'))).st_ino
+	assert stat(join(job.directory, 'run.sh')).st_mode & 0o777 == 0o750
+	for name in ('run.sh', 'static.dat'):
+		assert stat(str(src.join(name))).st_mode & 0o777 == 0o644
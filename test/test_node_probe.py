@@ -0,0 +1,59 @@
+
+"""
+	test concurrent node probing, using a fake ssh that sleeps depending on the node name
+	(node 'n0.5' answers after 0.5s; 'hang' never answers in time)
+"""
+
+from time import time
+from fenpei.queue import Queue
+from test.conftest import fake_exe
+
+
+FAKE_SSH = '''#!/bin/sh
+while [ $# -gt 2 ]; do shift; done
+node="$1"
+if [ "$node" = "hang" ]; then sleep 30; fi
+sleep "${node#n}"
+exec bash -c "$2"
+'''
+
+
+class ProbeQueue(Queue):
+
+	def load_nodes(self, memory_time=None):
+		return False
+
+	def save_nodes(self):
+		pass
+
+
+def _fake_ssh_queue(tmpdir, monkeypatch, nodes):
+	fake_exe(tmpdir, monkeypatch, 'ssh', FAKE_SSH)
+	queue = ProbeQueue()
+	queue.show = 0
+	queue.nodes = list(nodes)
+	return queue
+
+
+def test_probe_wall_time_close_to_slowest(tmpdir, monkeypatch):
+	nodes = ['n0.6'] * 8 + ['n0.2'] * 4
+	queue = _fake_ssh_queue(tmpdir, monkeypatch, nodes)
+	queue.node_workers = len(nodes)
+	start = time()
+	queue.node_availability()
+	duration = time() - start
+	assert queue.nodes == nodes
+	assert len(queue.slots) == len(nodes)
+	assert duration < 0.6 * 3, 'probing took {0:.2f}s, serial would be {1:.2f}s'.format(duration, 8 * 0.6 + 4 * 0.2)
+
+
+def test_probe_timeout_treated_as_inaccessible(tmpdir, monkeypatch):
+	queue = _fake_ssh_queue(tmpdir, monkeypatch, ['n0', 'hang', 'n0.1'])
+	queue.probe_timeout = 1
+	start = time()
+	queue.node_availability()
+	assert time() - start < 5
+	assert queue.nodes == ['n0', 'n0.1']
+	assert len(queue.slots) == 2
+
+
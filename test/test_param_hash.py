@@ -0,0 +1,63 @@
+
+"""
+	test parameter hashes: stored per job, canonical (independent of dict order), and the same in batches
+"""
+
+from collections import OrderedDict
+from pickle import dumps, loads
+import fenpei.job
+from fenpei.job_sh_single import ShJobSingle, param_hashes, _canonical
+
+
+class HashJob(ShJobSingle):
+
+	@classmethod
+	def get_default_subs(cls, version=1):
+		return OrderedDict([('alpha', 0), ('beta', 'b'), ('gamma', None)])
+
+	@classmethod
+	def run_file(cls):
+		return 'run.sh'
+
+
+def test_canonical():
+	assert _canonical({'b': 1, 'a': [1.5, 'x']}) == _canonical(OrderedDict([('a', [1.5, 'x']), ('b', 1)]))
+	assert _canonical({'b': 1, 'a': [1.5, 'x']}) == "{'a': [1.5, 'x'], 'b': 1}"
+	assert len({_canonical(1), _canonical(1.), _canonical(True), _canonical('1')}) == 4
+	assert _canonical(('a, b',)) != _canonical(('a', 'b'))
+	assert _canonical({3, 1, 2}) == _canonical(frozenset((2, 3, 1))) != _canonical(set()) != _canonical({})
+	class Number(float):
+		pass
+	assert _canonical(Number(2.5)) == _canonical(2.5)
+	for value in ((), (1,), (None, True, 2, 2.5, 'x', b'y', 1j)):
+		assert _canonical(value) == repr(value)
+	assert _canonical((Number(2.5), 'x')) == repr((2.5, 'x'))
+
+
+def test_param_hash(tmpdir, monkeypatch):
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', str(tmpdir))
+	one = HashJob(name='one', subs=dict(alpha=1, gamma={'x': 1, 'y': 2}), batch_name='batch')
+	two = HashJob(name='two', subs=dict(gamma={'y': 2, 'x': 1}, alpha=1), batch_name='batch')
+	other = HashJob(name='other', subs=dict(alpha=1.), batch_name='batch')
+	assert one.param_hash == two.param_hash
+	assert one.param_hash != other.param_hash
+	assert one._param_hash == one.param_hash and not hasattr(ShJobSingle, '_HASH_CACHE')
+	assert loads(dumps(one)).param_hash == one.param_hash
+	""" a new job (which may get the id of a deleted one) has its own hash """
+	expected = HashJob(name='expected', subs=dict(alpha=5), batch_name='batch').param_hash
+	for k in range(20):
+		job = HashJob(name='job{0:d}'.format(k), subs=dict(alpha=k % 2 * 5), batch_name='batch')
+		assert (job.param_hash == expected) == (k % 2 == 1)
+		del job
+
+
+def test_param_hashes(tmpdir, monkeypatch):
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', str(tmpdir))
+	jobs = [HashJob(name='job{0:d}'.format(k), subs=dict(alpha=k % 3), batch_name='batch') for k in range(9)]
+	known = jobs[4].param_hash
+	hashes = param_hashes(jobs)
+	assert hashes[4] == known
+	assert hashes == [job.param_hash for job in jobs]
+	assert len(set(hashes)) == 3 and hashes[0] == hashes[3] == hashes[6]
+
+
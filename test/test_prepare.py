@@ -0,0 +1,77 @@
+
+"""
+	test preparing a batch of ShJobSingle jobs through the queue, without starting processes, and jobs whose
+	prepare doesn't take sources
+"""
+
+from collections import OrderedDict
+from os import stat
+from os.path import join, islink
+from stat import S_IMODE
+import subprocess
+import fenpei.job
+from fenpei.job import Job
+from fenpei.job_sh import ShJob
+from fenpei.job_sh_single import ShJobSingle
+from fenpei.queue_local import LocalQueue
+
+
+class RunJob(ShJobSingle):
+
+	@classmethod
+	def get_default_subs(cls, version=1):
+		return OrderedDict([('alpha', 0)])
+
+	@classmethod
+	def run_file(cls):
+		return 'run.sh'
+
+
+def _no_processes(*args, **kwargs):
+	raise AssertionError('no process should be started to prepare jobs')
+
+
+def test_prepare_batch(tmpdir, monkeypatch):
+	src = tmpdir.mkdir('src')
+	src.join('run.sh').write('#!/bin/sh\necho "alpha={{ alpha }} for {{ name }}"\n')
+	src.join('static.dat').write('static\n')
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', str(tmpdir.mkdir('calc')))
+	monkeypatch.setattr(RunJob, 'get_sub_files', classmethod(lambda cls: [str(src.join('run.sh'))]))
+	monkeypatch.setattr(RunJob, 'get_nosub_files', classmethod(lambda cls: [str(src.join('static.dat'))]))
+	jobs = [RunJob(name='job{0:d}'.format(k), subs=dict(alpha=k), batch_name='batch') for k in range(40)]
+	queue = LocalQueue(jobs=jobs)
+	queue.show = 0
+	monkeypatch.setattr(subprocess.Popen, '__init__', _no_processes)
+	queue.prepare(parallel=True)
+	for k, job in enumerate(jobs):
+		with open(join(job.directory, 'run.sh'), 'r') as fh:
+			assert fh.read() == '#!/bin/sh\necho "alpha={0:d} for job{0:d}"'.format(k)
+		assert islink(join(job.directory, 'static.dat'))
+		assert S_IMODE(stat(job.directory).st_mode) == 0o750
+		assert S_IMODE(stat(join(job.directory, 'run.sh')).st_mode) == 0o750
+		assert job.is_prepared()
+
+
+class CustomJob(Job):
+
+	def is_prepared(self):
+		return False
+
+	def prepare(self, silent=False):
+		return True
+
+
+def test_prepare_without_sources(monkeypatch):
+	jobs = [CustomJob(name='custom{0:d}'.format(k), batch_name=False) for k in range(3)]
+	queue = LocalQueue(jobs=jobs)
+	logged = []
+	monkeypatch.setattr(queue, '_log', lambda txt, level=1: logged.append(txt))
+	queue.prepare(parallel=False)
+	assert 'prepared 3 jobs' in logged
+	""" positional arguments are not taken as sources """
+	job = RunJob(name='positional', subs={}, batch_name=False)
+	received = []
+	monkeypatch.setattr(Job, 'prepare', lambda self, silent=False, *args, **kwargs: received.append(silent))
+	monkeypatch.setattr(RunJob, 'is_prepared', lambda self: True)
+	ShJob.prepare(job, True)
+	assert received == [True]
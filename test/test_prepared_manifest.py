@@ -0,0 +1,52 @@
+
+"""
+	test that a prepared job is recognized by its manifest, and the deep verification
+"""
+
+from collections import OrderedDict
+from os import remove
+from os.path import exists, join
+import fenpei.job
+import fenpei.job_sh
+from fenpei.job_sh_single import ShJobSingle
+
+
+class RunJob(ShJobSingle):
+
+	@classmethod
+	def get_default_subs(cls, version=1):
+		return OrderedDict([('alpha', 0)])
+
+	@classmethod
+	def run_file(cls):
+		return 'run.sh'
+
+
+def test_manifest(tmpdir, monkeypatch):
+	src = tmpdir.mkdir('src')
+	src.join('run.sh').write('#!/bin/sh\necho {{ alpha }}\n')
+	for k in range(20):
+		src.join('input{0:d}.dat'.format(k)).write('input')
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', str(tmpdir.mkdir('calc')))
+	monkeypatch.setattr(RunJob, 'get_sub_files', classmethod(lambda cls: [str(src.join('run.sh'))]))
+	monkeypatch.setattr(RunJob, 'get_nosub_files', classmethod(lambda cls:
+		[str(src.join('input{0:d}.dat'.format(k))) for k in range(20)]))
+	job = RunJob(name='job', subs=dict(alpha=1), batch_name='batch')
+	job._log = lambda txt, *args, **kwargs: logged.append(txt)
+	logged = []
+	assert not job.is_prepared()
+	assert job.prepare()
+	assert exists(join(job.directory, job.PREPARED_MANIFEST))
+	checked = []
+	monkeypatch.setattr(fenpei.job_sh, 'isfile', lambda pth: checked.append(pth) or exists(pth))
+	assert job.is_prepared()
+	assert checked == [join(job.directory, job.PREPARED_MANIFEST)]
+	assert job.is_prepared(deep=True)
+	src.join('run.sh').write('#!/bin/sh\necho changed {{ alpha }}\n')
+	assert job.is_prepared(deep=True)
+	assert any('different files or templates' in txt for txt in logged)
+	remove(join(job.directory, 'input3.dat'))
+	assert job.is_prepared()
+	assert not job.is_prepared(deep=True)
+	remove(join(job.directory, job.PREPARED_MANIFEST))
+	assert not job.is_prepared()
@@ -0,0 +1,129 @@
+
+"""
+	test checking processes through /proc, locally and through a (fake) ssh command
+"""
+
+from os import getpid
+from os.path import join
+from subprocess import Popen, check_output
+from time import sleep
+from bardeen.system import mkdirp
+from fenpei.job import Job
+from fenpei.proc import alive_pids, parse_stat, parse_stats, remote_stat_cmd
+from fenpei.queue import Queue
+from fenpei.queue_local import LocalQueue
+from test.conftest import fake_exe
+
+
+FAKE_SSH = '''#!/bin/sh
+while [ $# -gt 2 ]; do shift; done
+echo "$2" >> "{log:s}"
+exec bash -c "$2"
+'''
+
+
+class StartedJob(Job):
+
+	def is_prepared(self):
+		return True
+
+	def is_complete(self):
+		return False
+
+
+def test_parse_stat():
+	proc = parse_stat('1234 (my (odd) name) S 1 1234 1234 0 -1 4194560 128 0 0 0 0 0 0 0 20 0 1 0')
+	assert proc == {'pid': 1234, 'name': 'my (odd) name', 'state': 'S', 'ppid': 1}
+
+
+def test_alive_pids():
+	zombie = Popen(['true'])
+	sleep(0.3)
+	assert alive_pids([getpid(), 999999999, zombie.pid]) == frozenset([getpid()])
+	zombie.wait()
+
+
+def test_remote_stat_cmd():
+	outp = check_output(['bash', '-c', remote_stat_cmd([getpid(), 999999999])], universal_newlines=True)
+	assert [proc['pid'] for proc in parse_stats(outp)] == [getpid()]
+
+
+def test_only_job_pids_checked(tmpdir, monkeypatch):
+	log = join(str(tmpdir), 'ssh.log')
+	fake_exe(tmpdir, monkeypatch, 'ssh', FAKE_SSH.format(log=log))
+	jobs = []
+	for k in range(6):
+		job = StartedJob(name='job{0:d}'.format(k), batch_name=False)
+		job.directory = join(str(tmpdir), job.name)
+		mkdirp(job.directory)
+		if k < 4:
+			job.node, job.pid = 'node{0:d}'.format(k % 2), getpid() if k % 2 else 999999990 + k
+			job.save()
+			job.node = job.pid = None
+		jobs.append(job)
+	queue = Queue(jobs=jobs)
+	queue.show = 0
+	status = queue.get_status()
+	assert len(status[Job.RUNNING]) == 2
+	assert len(status[Job.CRASHED]) == 2
+	assert queue.watched_pids == {'node0': {999999990, 999999992}, 'node1': {getpid()}}
+	with open(log, 'r') as fh:
+		calls = fh.read().splitlines()
+	assert sorted(calls) == sorted([remote_stat_cmd([999999990, 999999992]), remote_stat_cmd([getpid()])])
+
+
+class CountingJob(StartedJob):
+
+	loads = []
+
+	def load(self):
+		self.loads.append(self.name)
+		return super(CountingJob, self).load()
+
+
+def test_watched_pids_once_per_pass(tmpdir, monkeypatch):
+	jobs = []
+	for k in range(20):
+		job = CountingJob(name='job{0:d}'.format(k), batch_name=False)
+		job.directory = join(str(tmpdir), job.name)
+		mkdirp(job.directory)
+		if k < 10:
+			job.node, job.pid = 'node{0:d}'.format(k), 999999990 + k
+			job.save()
+			job.node = job.pid = None
+		jobs.append(job)
+	queue = Queue(jobs=jobs)
+	queue.show = 0
+	refreshes = []
+	monkeypatch.setattr(queue, '_load_processes', lambda node: refreshes.append(node) or [])
+	del CountingJob.loads[:]
+	status = queue.get_status()
+	assert len(status[Job.CRASHED]) == 10
+	assert len(refreshes) == 10
+	""" once to find the pids to watch, once for the status of each job """
+	assert len(CountingJob.loads) <= 2 * len(jobs)
+
+
+class SleepingJob(StartedJob):
+
+	def start_cmd(self):
+		return 'sleep 5'
+
+
+def test_status_after_start(tmpdir):
+	jobs = []
+	for k in range(3):
+		job = SleepingJob(name='job{0:d}'.format(k), batch_name=False)
+		job.directory = join(str(tmpdir), job.name)
+		mkdirp(job.directory)
+		jobs.append(job)
+	queue = LocalQueue(jobs=jobs)
+	queue.show = 0
+	queue.start()
+	sleep(1)
+	try:
+		status = queue.get_status()
+		assert len(status[Job.RUNNING]) == 3
+		assert sorted(queue.watched_pids['localhost']) == sorted(int(job.pid) for job in jobs)
+	finally:
+		queue.kill(all=True)
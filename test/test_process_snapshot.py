@@ -0,0 +1,100 @@
+
+"""
+	test that a status pass loads the processes once per node (all at once), using a fake ssh that logs calls, and
+	that nodes are loaded without blocking readers of other nodes
+"""
+
+from os import getpid
+from os.path import join
+from pickle import dumps, loads
+from threading import Thread
+from time import sleep, time
+from bardeen.system import mkdirp
+from fenpei.job import Job
+from fenpei.queue import Queue
+from fenpei.snapshot import ProcessSnapshot
+from test.conftest import fake_exe
+
+
+FAKE_SSH = '''#!/bin/sh
+while [ $# -gt 2 ]; do shift; done
+echo "$1" >> "{log:s}"
+exec bash -c "$2"
+'''
+
+
+class StartedJob(Job):
+
+	def is_prepared(self):
+		return True
+
+	def is_complete(self):
+		return False
+
+
+def test_one_ps_per_node(tmpdir, monkeypatch):
+	log = join(str(tmpdir), 'ssh.log')
+	fake_exe(tmpdir, monkeypatch, 'ssh', FAKE_SSH.format(log=log))
+	jobs = []
+	for k in range(200):
+		job = StartedJob(name='job{0:d}'.format(k), batch_name=False)
+		job.directory = join(str(tmpdir), job.name)
+		mkdirp(job.directory)
+		job.node = 'node{0:d}'.format(k % 4)
+		job.pid = getpid() if k % 2 else 999999999
+		job.save()
+		job.node = job.pid = None
+		jobs.append(job)
+	queue = Queue(jobs=jobs)
+	queue.show = 0
+	status = queue.get_status()
+	assert len(status[Job.RUNNING]) == 100
+	assert len(status[Job.CRASHED]) == 100
+	with open(log, 'r') as fh:
+		calls = fh.read().splitlines()
+	assert sorted(calls) == ['node0', 'node1', 'node2', 'node3']
+	queue.process_snapshot.expire()
+	assert jobs[1].is_running()
+	assert jobs[3].is_running()
+	with open(log, 'r') as fh:
+		assert len(fh.read().splitlines()) == 8
+
+
+
+
+def _slow_load(node):
+	sleep(0.3)
+	return [{'pid': int(node[4:])}]
+
+
+def test_first_pass_concurrent():
+	snapshot = ProcessSnapshot(workers=8)
+	start = time()
+	nodes = ['node{0:d}'.format(k) for k in range(6)]
+	assert snapshot.get_pids('node0', _slow_load, refresh=lambda: nodes) == frozenset([0])
+	assert time() - start < 6 * 0.3 / 2
+	loaded = time()
+	assert [snapshot.get_pids(node, _slow_load) for node in nodes] == [frozenset([k]) for k in range(6)]
+	assert time() - loaded < 0.3
+
+
+def test_readers_not_blocked():
+	snapshot = ProcessSnapshot(max_age=None)
+	snapshot.get_pids('node1', _slow_load)
+	loader = Thread(target=snapshot.get_pids, args=('node2', _slow_load))
+	loader.start()
+	sleep(0.05)
+	start = time()
+	assert snapshot.get_pids('node1', _slow_load) == frozenset([1])
+	assert time() - start < 0.1
+	""" a second reader of the node that is being loaded waits for it, instead of loading it again """
+	assert snapshot.get_pids('node2', lambda node: None) == frozenset([2])
+	loader.join()
+
+
+def test_node_workers_follow_queue():
+	queue = Queue()
+	assert queue.process_snapshot.workers == queue.node_workers == 16
+	queue.node_workers = 3
+	assert queue.process_snapshot.workers == 3
+	assert loads(dumps(queue)).process_snapshot.workers == 3
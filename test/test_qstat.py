@@ -0,0 +1,204 @@
+
+"""
+	test the streaming qstat xml parser, that QsubQueue checks running jobs against one qstat call,
+	and array job submission (using a fake qstat, qsub and qdel)
+"""
+
+from os import environ, listdir
+from os.path import join, exists
+from subprocess import check_call
+from pytest import raises
+from bardeen.system import mkdirp
+import fenpei.queue_qsub
+from fenpei.job import Job
+from fenpei.queue_qsub import QsubQueue, parse_qstat, task_ids
+from test.bench_qstat import make_qstat_xml
+from test.conftest import fake_exe
+
+
+FAKE_QSTAT = '''#!/bin/sh
+echo call >> "{log:s}"
+cat "{xml:s}"
+'''
+
+FAKE_QSUB = '''#!/bin/sh
+echo "$@" >> "{log:s}"
+echo "Your job-array $((4200 + $(wc -l < "{log:s}"))).1-6:1 ("name") has been submitted"
+'''
+
+ARRAY_QSTAT = '''<?xml version="1.0"?>
+<job_info>
+  <queue_info>
+    <job_list state="running">
+      <JB_job_number>4201</JB_job_number>
+      <JB_name>array</JB_name>
+      <JB_owner>user</JB_owner>
+      <state>r</state>
+      <queue_name>queuename@node1.cluster</queue_name>
+      <tasks>1</tasks>
+    </job_list>
+  </queue_info>
+  <job_info>
+    <job_list state="pending">
+      <JB_job_number>4201</JB_job_number>
+      <JB_name>array</JB_name>
+      <JB_owner>user</JB_owner>
+      <state>qw</state>
+      <queue_name></queue_name>
+      <tasks>3-5:2</tasks>
+    </job_list>
+  </job_info>
+</job_info>
+'''
+
+
+class EchoJob(Job):
+
+	def is_prepared(self):
+		return True
+
+	def is_complete(self):
+		return False
+
+	def start_cmd(self):
+		return 'echo "done $SGE_TASK_ID" > out.txt'
+
+
+class TestQsubQueue(QsubQueue):
+
+	def load_nodes(self, memory_time=None):
+		return False
+
+
+def test_parse_qstat(tmpdir):
+	pth = join(str(tmpdir), 'qstat.xml')
+	with open(pth, 'wb') as fh:
+		fh.write(make_qstat_xml(8))
+	jobs = parse_qstat(pth)
+	assert list(jobs.keys()) == [1, 2, 3, 5, 6, 7, 4, 8]
+	assert jobs[3]['node'] == 'node3'
+	assert jobs[3]['queue'] == 'queuename@node3.cluster'
+	assert jobs[3]['state'] == 'r'
+	assert jobs[3]['user'] == 'user3'
+	assert jobs[4]['node'] is None
+	assert jobs[4]['queue'] == '(no queue yet)'
+	assert jobs[4]['state'] == 'qw'
+
+
+def test_task_ids():
+	assert task_ids('4') == [4]
+	assert task_ids('1-7:2,9') == [1, 3, 5, 7, 9]
+
+
+def test_one_qstat_per_pass(tmpdir, monkeypatch):
+	log = join(str(tmpdir), 'qstat.log')
+	xml = join(str(tmpdir), 'qstat.xml')
+	with open(xml, 'wb') as fh:
+		fh.write(make_qstat_xml(20))
+	fake_exe(tmpdir, monkeypatch, 'qstat', FAKE_QSTAT.format(log=log, xml=xml))
+	queue = QsubQueue()
+	queue.show = 0
+	with queue.process_snapshot.pinned():
+		assert 7 in queue.process_ids('node7')
+		assert 20 in queue.process_ids('node0')
+		assert 21 not in queue.process_ids('node1')
+	with open(log, 'r') as fh:
+		""" one call from the qstat availability test, one to load the queue """
+		assert len(fh.read().splitlines()) == 2
+
+
+def test_array_submission(tmpdir, monkeypatch):
+	tmp = str(tmpdir)
+	log, xml = join(tmp, 'qsub.log'), join(tmp, 'qstat.xml')
+	fake_exe(tmpdir, monkeypatch, 'qsub', FAKE_QSUB.format(log=log))
+	fake_exe(tmpdir, monkeypatch, 'qstat', FAKE_QSTAT.format(log=join(tmp, 'qstat.log'), xml=xml))
+	fake_exe(tmpdir, monkeypatch, 'qdel', '#!/bin/sh\necho "$@" >> "{0:s}"\n'.format(join(tmp, 'qdel.log')))
+	monkeypatch.setattr(fenpei.queue_qsub, 'CALC_DIR', tmp)
+	with open(xml, 'w+') as fh:
+		fh.write(ARRAY_QSTAT)
+	jobs = []
+	for k in range(12):
+		job = EchoJob(name='job{0:d}'.format(k), batch_name='batch', force_node='node1' if k % 2 else None)
+		job.directory = join(tmp, 'batch', job.name)
+		mkdirp(job.directory)
+		jobs.append(job)
+	queue = TestQsubQueue(jobs=jobs, use_arrays=True)
+	queue.show = 0
+	queue.start()
+	with open(log, 'r') as fh:
+		calls = fh.read().splitlines()
+	assert len(calls) == 4
+	arrays, cleanups = calls[0::2], calls[1::2]
+	assert all('-t 1-6' in call for call in arrays)
+	assert '-q queuename@node1' in arrays[1]
+	assert len(set(call.split('-N ')[1].split()[0] for call in arrays)) == 2
+	assert '-hold_jid 4201 ' in cleanups[0] and '-hold_jid 4203 ' in cleanups[1]
+	pids = []
+	for job in jobs:
+		job.node = job.pid = None
+		assert job.load()
+		pids.append(job.pid)
+	assert pids[:4] == ['4201.1', '4203.1', '4201.2', '4203.2']
+	""" run the array tasks like grid engine would """
+	for call in arrays:
+		script = call.split()[-1].strip('\'')
+		for task in range(1, 7):
+			check_call([script], env=dict(environ, SGE_TASK_ID=str(task)))
+	for job in jobs:
+		with open(join(job.directory, 'out.txt'), 'r') as fh:
+			assert fh.read().strip() == 'done {0:s}'.format(job.pid.split('.')[1])
+	""" the cleanup jobs remove the map files and scripts """
+	assert len(listdir(join(tmp, '.fenpei_arrays'))) == 4
+	for call in cleanups:
+		check_call(['bash', '-c', call[call.index('rm -f'):]])
+	assert listdir(join(tmp, '.fenpei_arrays')) == []
+	""" status and kill for array tasks """
+	queue.process_snapshot.expire()
+	assert jobs[0].is_running()
+	assert jobs[4].is_running()
+	assert not jobs[2].is_running()
+	assert jobs[0].kill()
+	with open(join(tmp, 'qdel.log'), 'r') as fh:
+		assert fh.read().strip() == '4201 -t 1'
+
+
+def test_forced_queue_logged_once(tmpdir, monkeypatch):
+	tmp = str(tmpdir)
+	fake_exe(tmpdir, monkeypatch, 'qsub', FAKE_QSUB.format(log=join(tmp, 'qsub.log')))
+	fake_exe(tmpdir, monkeypatch, 'qstat', FAKE_QSTAT.format(log=join(tmp, 'qstat.log'), xml=join(tmp, 'qstat.xml')))
+	monkeypatch.setattr(fenpei.queue_qsub, 'CALC_DIR', tmp)
+	with open(join(tmp, 'qstat.xml'), 'w+') as fh:
+		fh.write(ARRAY_QSTAT)
+	jobs = []
+	for k, node in enumerate(('node1', 'node1', 'node2')):
+		job = EchoJob(name='job{0:d}'.format(k), batch_name='batch', force_node=node)
+		job.directory = join(tmp, 'batch', job.name)
+		mkdirp(job.directory)
+		jobs.append(job)
+	queue = TestQsubQueue(jobs=jobs, use_arrays=True)
+	messages = []
+	monkeypatch.setattr(queue, '_log', lambda txt, level=1: messages.append(txt))
+	queue.run_cmds_batch(jobs, [job.start_cmd() for job in jobs], node=None)
+	forced = [txt for txt in messages if 'forced queue' in txt]
+	assert len(forced) == 3
+	assert 'queuename@node2' in forced[2]
+
+
+def test_failed_array_removes_files(tmpdir, monkeypatch):
+	tmp = str(tmpdir)
+	fake_exe(tmpdir, monkeypatch, 'qsub', '#!/bin/sh\n')
+	fake_exe(tmpdir, monkeypatch, 'qstat', FAKE_QSTAT.format(log=join(tmp, 'qstat.log'), xml=join(tmp, 'qstat.xml')))
+	monkeypatch.setattr(fenpei.queue_qsub, 'CALC_DIR', tmp)
+	with open(join(tmp, 'qstat.xml'), 'w+') as fh:
+		fh.write(ARRAY_QSTAT)
+	jobs = []
+	for k in range(3):
+		job = EchoJob(name='job{0:d}'.format(k), batch_name='batch')
+		job.directory = join(tmp, 'batch', job.name)
+		mkdirp(job.directory)
+		jobs.append(job)
+	queue = TestQsubQueue(jobs=jobs, use_arrays=True)
+	queue.show = 0
+	with raises(QsubQueue.CmdException):
+		queue.run_cmd_array(jobs, [job.start_cmd() for job in jobs])
+	assert listdir(join(tmp, '.fenpei_arrays')) == []
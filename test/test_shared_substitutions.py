@@ -0,0 +1,45 @@
+
+"""
+	test that ShJobSingle shares one read-only substitution view between files, and exposes parameters as attributes
+"""
+
+from collections import OrderedDict
+from pickle import dumps, loads
+from pytest import raises
+import fenpei.job
+from fenpei.job_sh_single import ShJobSingle
+
+
+class ParamJob(ShJobSingle):
+
+	@classmethod
+	def get_default_subs(cls, version=1):
+		return OrderedDict([('alpha', 0), ('beta', 'b')])
+
+	@classmethod
+	def run_file(cls):
+		return 'run.sh'
+
+
+def test_shared_view(tmpdir, monkeypatch):
+	src = tmpdir.mkdir('src')
+	for name in ('run.sh', 'one.in', 'two.in'):
+		src.join(name).write('{{ alpha }}')
+	monkeypatch.setattr(fenpei.job, 'CALC_DIR', str(tmpdir.mkdir('calc')))
+	monkeypatch.setattr(ParamJob, 'get_sub_files', classmethod(lambda cls:
+		[str(src.join(name)) for name in ('run.sh', 'one.in', 'two.in')]))
+	job = ParamJob(name='job', subs=dict(alpha=3), batch_name='batch')
+	views = list(job.files.values())
+	assert all(view is views[0] for view in views)
+	assert views[0]['alpha'] == 3 and views[0]['name'] == 'job'
+	with raises(TypeError):
+		views[0]['alpha'] = 4
+	assert job.alpha == 3 and job.beta == 'b'
+	assert 'alpha' not in job.__dict__
+	assert not hasattr(job, 'gamma')
+	job.substitutions['alpha'] = 5
+	assert job.alpha == 5 and views[0]['alpha'] == 5
+	copied = loads(dumps(job))
+	assert copied.alpha == 5
+	copied_views = list(copied.files.values())
+	assert copied_views[0]['alpha'] == 5 and all(view is copied_views[0] for view in copied_views)
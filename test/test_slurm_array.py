@@ -0,0 +1,148 @@
+
+"""
+	test submitting slurm job arrays, using a fake sinfo, sbatch and squeue
+"""
+
+from os import environ, listdir
+from os.path import join, exists
+from subprocess import check_call
+from pytest import raises
+from bardeen.system import mkdirp
+import fenpei.queue_slurm
+from fenpei.job import Job
+from fenpei.queue_slurm import SlurmQueue
+from test.conftest import fake_exe
+
+
+FAKE_SBATCH = '''#!/bin/sh
+echo "$@" >> "{log:s}"
+echo "Submitted batch job $((4200 + $(wc -l < "{log:s}")))"
+'''
+
+FAKE_SQUEUE = '''#!/bin/sh
+echo "JOBID NODELIST PARTITION STATE NAME"
+cat "{listing:s}"
+'''
+
+
+class EchoJob(Job):
+
+	def is_prepared(self):
+		return True
+
+	def is_complete(self):
+		return False
+
+	def start_cmd(self):
+		return 'echo "done $SLURM_ARRAY_TASK_ID" > out.txt'
+
+
+class TestSlurmQueue(SlurmQueue):
+
+	def load_nodes(self, memory_time=None):
+		return False
+
+
+def test_array_submission(tmpdir, monkeypatch):
+	tmp = str(tmpdir)
+	log, listing = join(tmp, 'sbatch.log'), join(tmp, 'squeue.txt')
+	fake_exe(tmpdir, monkeypatch, 'sbatch', FAKE_SBATCH.format(log=log))
+	fake_exe(tmpdir, monkeypatch, 'squeue', FAKE_SQUEUE.format(listing=listing))
+	fake_exe(tmpdir, monkeypatch, 'sinfo', '#!/bin/sh\n')
+	fake_exe(tmpdir, monkeypatch, 'scancel', '#!/bin/sh\necho "$@" >> "{0:s}"\n'.format(join(tmp, 'scancel.log')))
+	monkeypatch.setattr(fenpei.queue_slurm, 'CALC_DIR', tmp)
+	with open(listing, 'w+') as fh:
+		fh.write('')
+	jobs = []
+	for k in range(12):
+		job = EchoJob(name='job{0:d}'.format(k), weight=1 + (k % 2), batch_name='batch')
+		job.directory = join(tmp, 'batch', job.name)
+		mkdirp(job.directory)
+		jobs.append(job)
+	queue = TestSlurmQueue(jobs=jobs, partition='test', use_arrays=True)
+	queue.show = 0
+	queue.start()
+	with open(log, 'r') as fh:
+		calls = fh.read().splitlines()
+	assert len(calls) == 4
+	arrays, cleanups = calls[0::2], calls[1::2]
+	assert all('--array 0-5' in call for call in arrays)
+	assert len(set(call.split('--job-name ')[1].split()[0] for call in arrays)) == 2
+	assert 'afterany:4201' in cleanups[0] and 'afterany:4203' in cleanups[1]
+	pids = []
+	for job in jobs:
+		job.node = job.pid = None
+		assert job.load()
+		pids.append(job.pid)
+	assert sorted(pids) == sorted('420{0:d}_{1:d}'.format(arr, idx) for arr in (1, 3) for idx in range(6))
+	""" run the array tasks like slurm would """
+	for call in arrays:
+		script = call.split()[-1].strip('\'')
+		for index in range(6):
+			check_call([script], env=dict(environ, SLURM_ARRAY_TASK_ID=str(index)))
+	for job in jobs:
+		assert exists(join(job.directory, 'out.txt'))
+	""" the cleanup jobs remove the map files and scripts """
+	assert len(listdir(join(tmp, '.fenpei_arrays'))) == 4
+	for call in cleanups:
+		check_call(['bash', '-c', call.split('--wrap ')[1]])
+	assert listdir(join(tmp, '.fenpei_arrays')) == []
+	""" status and kill for array tasks """
+	with open(listing, 'w+') as fh:
+		fh.write('{0:s} node1 test RUNNING batch_123_12\n'.format(jobs[0].pid))
+	assert jobs[0].is_running()
+	assert not jobs[1].is_running()
+	assert jobs[0].kill()
+	with open(join(tmp, 'scancel.log'), 'r') as fh:
+		assert fh.read().strip() == jobs[0].pid
+
+
+def test_single_squeue_per_status(tmpdir, monkeypatch):
+	tmp = str(tmpdir)
+	listing, squeue_log = join(tmp, 'squeue.txt'), join(tmp, 'squeue.log')
+	fake_exe(tmpdir, monkeypatch, 'squeue', 'echo "$@" >> "{0:s}"\n'.format(squeue_log) + FAKE_SQUEUE.format(listing=listing))
+	fake_exe(tmpdir, monkeypatch, 'sinfo', '#!/bin/sh\n')
+	jobs = []
+	with open(listing, 'w+') as fh:
+		for k in range(30):
+			job = EchoJob(name='job{0:d}'.format(k), batch_name='batch')
+			job.directory = join(tmp, 'batch', job.name)
+			mkdirp(job.directory)
+			job.node, job.pid = 'test', '77_{0:d}'.format(k)
+			job.save()
+			jobs.append(job)
+			if k % 3:
+				fh.write('77_{0:d} node1 test RUNNING name\n'.format(k))
+	queue = TestSlurmQueue(jobs=jobs, partition='test')
+	queue.show = 0
+	for limit in (100, 10):
+		queue.squeue_jobs_limit = limit
+		for job in jobs:
+			job._last_status_time = 0
+		status = queue.get_status()
+		assert len(status[Job.RUNNING]) == 20 and len(status[Job.CRASHED]) == 10
+	with open(squeue_log, 'r') as fh:
+		calls = fh.read().splitlines()
+	assert len(calls) == 2
+	assert '--jobs 77_0,77_1,' in calls[0]
+	assert '--jobs' not in calls[1]
+
+
+
+
+def test_failed_array_removes_files(tmpdir, monkeypatch):
+	tmp = str(tmpdir)
+	fake_exe(tmpdir, monkeypatch, 'sbatch', '#!/bin/sh\n')
+	fake_exe(tmpdir, monkeypatch, 'sinfo', '#!/bin/sh\n')
+	monkeypatch.setattr(fenpei.queue_slurm, 'CALC_DIR', tmp)
+	jobs = []
+	for k in range(3):
+		job = EchoJob(name='job{0:d}'.format(k), batch_name='batch')
+		job.directory = join(tmp, 'batch', job.name)
+		mkdirp(job.directory)
+		jobs.append(job)
+	queue = TestSlurmQueue(jobs=jobs, partition='test', use_arrays=True)
+	queue.show = 0
+	with raises(SlurmQueue.CmdException):
+		queue.run_cmd_array(jobs, [job.start_cmd() for job in jobs])
+	assert listdir(join(tmp, '.fenpei_arrays')) == []
@@ -0,0 +1,58 @@
+
+"""
+	test that commands reuse one ssh control connection per node, using a fake ssh that logs its arguments
+"""
+
+from gc import collect
+from os.path import join
+from weakref import ref
+from fenpei.queue import Queue
+from fenpei.shell import run_cmds_on, SSHPool
+from fenpei.utils import thread_map
+from test.conftest import fake_exe
+
+
+FAKE_SSH = '''#!/bin/sh
+echo "$@" >> "{log:s}"
+for last; do true; done
+case "$*" in *"-O exit"*) exit 0;; esac
+exec bash -c "$last"
+'''
+
+
+def test_commands_share_control_path(tmpdir, monkeypatch):
+	log = join(str(tmpdir), 'ssh.log')
+	fake_exe(tmpdir, monkeypatch, 'ssh', FAKE_SSH.format(log=log))
+	queue = Queue()
+	queue.show = 0
+	for k in range(3):
+		assert run_cmds_on(['echo hi'], node='node1', queue=queue) == ['hi']
+	run_cmds_on(['echo hi'], node='node2', queue=queue)
+	control_dir = queue.ssh_pool.control_dir
+	queue.close()
+	with open(log, 'r') as fh:
+		calls = fh.read().splitlines()
+	assert len(calls) == 6
+	assert all('ControlPath={0:s}/%C'.format(control_dir) in call for call in calls)
+	assert all('ControlMaster=auto' in call for call in calls[:4])
+	assert sorted(call.split()[-1] for call in calls[4:]) == ['node1', 'node2']
+	assert all('-O exit' in call for call in calls[4:])
+	assert queue.ssh_pool.control_dir is None
+
+
+
+
+def test_concurrent_and_collectable():
+	pool = SSHPool()
+	cmds = thread_map(pool.ssh_cmd, ['node{0:d}'.format(k % 4) for k in range(64)], workers=16)
+	assert len(set(cmd.split('ControlPath=')[1].split()[0] for cmd in cmds)) == 1
+	assert len(pool.nodes) == 4
+	""" (without the nodes, closing doesn't call ssh) """
+	pool.nodes.clear()
+	pool.close()
+	assert pool.control_dir is None
+	queue = Queue()
+	queue_ref = ref(queue)
+	del queue
+	collect()
+	assert queue_ref() is None
@@ -0,0 +1,99 @@
+
+"""
+	test that Queue.start launches all jobs of a node with one remote command, using a fake ssh that logs calls
+"""
+
+from os.path import join
+from bardeen.system import mkdirp
+from fenpei.job import Job
+from fenpei.queue import Queue
+from test.conftest import fake_exe
+
+
+FAKE_SSH = '''#!/bin/sh
+while [ $# -gt 2 ]; do shift; done
+echo "$1" >> "{log:s}"
+exec bash -c "$2"
+'''
+
+
+class SleepJob(Job):
+
+	def is_prepared(self):
+		return True
+
+	def is_complete(self):
+		return False
+
+	def start_cmd(self):
+		return 'sleep 0'
+
+
+class FixedQueue(Queue):
+
+	def load_nodes(self, memory_time=None):
+		return False
+
+	def distribute_jobs(self, jobs=None, max_reject_spree=None):
+		self.distribution = dict((nr, jobs[nr::len(self.nodes)]) for nr in range(len(self.nodes)))
+		return self.distribution
+
+
+def test_one_remote_call_per_node(tmpdir, monkeypatch):
+	log = join(str(tmpdir), 'ssh.log')
+	fake_exe(tmpdir, monkeypatch, 'ssh', FAKE_SSH.format(log=log))
+	jobs = []
+	for k in range(30):
+		job = SleepJob(name='job{0:d}'.format(k), batch_name=False)
+		job.directory = join(str(tmpdir), job.name)
+		mkdirp(job.directory)
+		jobs.append(job)
+	queue = FixedQueue(jobs=jobs)
+	queue.show = 0
+	queue.parallel = True
+	queue.launch_chunk = 8
+	queue.nodes = ['node1', 'node2', 'node3']
+	queue.slots = [10, 10, 10]
+	queue.start()
+	with open(log, 'r') as fh:
+		calls = fh.read().splitlines()
+	used_nodes = set(job.node for job in jobs)
+	expected_calls = sum((len(jobs) + 7) // 8 for jobs in queue.distribution.values())
+	assert len(calls) == expected_calls
+	assert set(calls) == used_nodes
+	for job in jobs:
+		node, pid = job.node, job.pid
+		job.node = job.pid = None
+		assert job.load()
+		assert (job.node, job.pid) == (node, int(pid))
+		assert job.status == job.RUNNING
+
+
+
+
+class CustomStartJob(SleepJob):
+
+	started = []
+
+	def start(self, node, *args, **kwargs):
+		self.started.append(self.name)
+		return True
+
+
+class CustomCmdJob(CustomStartJob):
+
+	def start_cmd(self):
+		return 'sleep 1'
+
+
+def test_custom_start_not_bypassed(tmpdir):
+	assert SleepJob(name='plain', batch_name=False).batch_start_cmd() == 'sleep 0'
+	assert CustomStartJob(name='custom', batch_name=False).batch_start_cmd() is None
+	assert CustomCmdJob(name='both', batch_name=False).batch_start_cmd() == 'sleep 1'
+	queue = FixedQueue(jobs=[CustomStartJob(name='job{0:d}'.format(k), batch_name=False) for k in range(3)])
+	queue.show = 0
+	queue.nodes, queue.slots = ['node1'], [10]
+	for job in queue.jobs:
+		job.directory = join(str(tmpdir), job.name)
+	assert queue._start_on_node(('node1', queue.jobs)) == 3
+	assert CustomStartJob.started == ['job0', 'job1', 'job2']
@@ -0,0 +1,82 @@
+
+"""
+	test that the status index skips checking completed jobs, unless their files change, and always checks crashed ones
+"""
+
+from os.path import join
+from bardeen.system import mkdirp
+import fenpei.status_index
+from fenpei.job import Job
+from fenpei.queue import Queue
+
+
+class CountingJob(Job):
+
+	checks = 0
+
+	def is_prepared(self):
+		return True
+
+	def is_complete(self):
+		CountingJob.checks += 1
+		return int(self.name[3:]) % 2 == 0
+
+
+def test_index_skips_final_jobs(tmpdir, monkeypatch):
+	monkeypatch.setattr(fenpei.status_index, 'CALC_DIR', str(tmpdir))
+	jobs = []
+	for k in range(20):
+		job = CountingJob(name='job{0:d}'.format(k), batch_name='batch')
+		job.directory = join(str(tmpdir), 'batch', job.name)
+		mkdirp(job.directory)
+		jobs.append(job)
+	queue = Queue(jobs=jobs)
+	queue.show = 0
+	queue.status_index = True
+	status = queue.get_status()
+	assert len(status[Job.COMPLETED]) == 10 and len(status[Job.PREPARED]) == 10
+	assert CountingJob.checks == 20
+	CountingJob.checks = 0
+	for job in jobs:
+		job._last_status_time = 0
+	status = queue.get_status()
+	assert len(status[Job.COMPLETED]) == 10 and len(status[Job.PREPARED]) == 10
+	assert CountingJob.checks == 10
+	CountingJob.checks = 0
+	for job in jobs:
+		job._last_status_time = 0
+	with open(join(jobs[0].directory, 'new_file'), 'w+') as fh:
+		fh.write('changed')
+	queue.get_status()
+	assert CountingJob.checks == 11
+
+
+
+
+class RestartedJob(Job):
+
+	complete = False
+
+	def is_prepared(self):
+		return True
+
+	def is_complete(self):
+		return RestartedJob.complete
+
+
+def test_crashed_not_final(tmpdir, monkeypatch):
+	monkeypatch.setattr(fenpei.status_index, 'CALC_DIR', str(tmpdir))
+	job = RestartedJob(name='job', batch_name='batch')
+	job.directory = join(str(tmpdir), 'batch', job.name)
+	mkdirp(job.directory)
+	job.node, job.pid = 'node', 999999999
+	job.save()
+	queue = Queue(jobs=[job])
+	queue.show = 0
+	queue.status_index = True
+	monkeypatch.setattr(queue, '_load_processes', lambda node: [])
+	assert job in queue.get_status()[Job.CRASHED]
+	""" e.g. a restart that appended to existing output, which doesn't change the stamped modification times """
+	RestartedJob.complete = True
+	job._last_status_time = 0
+	assert job in queue.get_status()[Job.COMPLETED]
@@ -0,0 +1,36 @@
+
+"""
+	test that the % and .format formatters give the same output as formatting line by line, and report error lines
+"""
+
+from pytest import raises
+from fenpei.utils import FormattingException, substitute_pyformat, substitute_pypercent
+
+
+PERCENT_TEXT = 'a = %(a)d\r\nb = %(b)s\n\nc = 100%%\n'
+FORMAT_TEXT = 'a = {a:d}\r\nb = {b}\n\nc = {{100}}\n'
+SUBS = {'a': 4, 'b': 'one\ntwo'}
+
+
+def test_same_as_lines():
+	expected = 'a = 4\nb = one\ntwo\n\nc = 100%'
+	assert substitute_pypercent(PERCENT_TEXT, SUBS) == expected
+	assert substitute_pyformat(FORMAT_TEXT, SUBS) == expected.replace('100%', '{100}')
+
+
+def test_missing_key_line():
+	with raises(FormattingException) as err:
+		substitute_pypercent(PERCENT_TEXT + '%(d)s\n', SUBS, filename='in.txt')
+	assert str(err.value) == 'missing key "d" in substitution of "in.txt" on line 5; job not prepared'
+	with raises(FormattingException) as err:
+		substitute_pyformat(FORMAT_TEXT + '{d}\n', SUBS, filename='in.txt')
+	assert str(err.value) == 'missing key "d" in substitution of "in.txt" on line 5; job not prepared'
+
+
+def test_format_error_line():
+	with raises(FormattingException) as err:
+		substitute_pyformat('x\n{a:q}\n', SUBS, filename='in.txt')
+	assert str(err.value) == 'substitution of "in.txt" on line 2 encountered a formatting error; job not prepared'
+	with raises(FormattingException) as err:
+		substitute_pypercent('x\ny\n%(a)Q\n', SUBS, filename='in.txt')
+	assert 'on line 3' in str(err.value)
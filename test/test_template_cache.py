@@ -0,0 +1,40 @@
+
+"""
+	test that jinja2 templates are compiled once per content, and evicted least-recently-used first
+"""
+
+from jinja2 import TemplateSyntaxError, UndefinedError
+from pytest import raises
+from fenpei.utils import TemplateCache, TEMPLATE_CACHE, substitute_jinja2
+
+
+def test_hits_and_misses():
+	cache = TemplateCache(maxsize=2)
+	first = cache.get('a={{ a }}', filename='one.txt')
+	assert cache.get('a={{ a }}', filename='one.txt') is first
+	assert cache.get('a={{ a }}!', filename='one.txt') is not first
+	assert (cache.hits, cache.misses) == (1, 2)
+	cache.get('a={{ a }}', filename='one.txt')
+	cache.get('b={{ b }}', filename='two.txt')
+	cache.get('a={{ a }}!', filename='one.txt')
+	assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_no_caching():
+	cache = TemplateCache(maxsize=0)
+	cache.get('x', filename='x.txt')
+	cache.get('x', filename='x.txt')
+	assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_substitute_jinja2():
+	TEMPLATE_CACHE.clear()
+	for k in range(3):
+		assert substitute_jinja2('n={{ n }}\n{% if n %}\nyes\n{% endif %}\n', {'n': k}, filename='n.txt') == \
+			'n={0:d}\n{1:s}'.format(k, 'yes\n' if k else '')
+	assert (TEMPLATE_CACHE.hits, TEMPLATE_CACHE.misses) == (2, 1)
+	with raises(UndefinedError):
+		substitute_jinja2('{{ missing }}', {}, filename='n.txt')
+	with raises(TemplateSyntaxError) as err:
+		substitute_jinja2('{% if %}', {}, filename='broken.txt')
+	assert 'broken.txt' in str(err.value)
@@ -0,0 +1,48 @@
+
+"""
+	test the thread pool map used for IO-bound job operations
+"""
+
+from time import sleep, time
+from pytest import raises
+from fenpei.utils import thread_map
+
+
+def _slow_square(x):
+	sleep(0.05)
+	return x * x
+
+
+def _fail_on_three(x):
+	if x == 3:
+		raise ValueError('three')
+	return x
+
+
+def test_ordered_and_concurrent():
+	start = time()
+	assert thread_map(_slow_square, range(40), workers=20) == [x * x for x in range(40)]
+	assert time() - start < 40 * 0.05 / 4
+
+
+def test_exceptions_propagate():
+	with raises(ValueError):
+		thread_map(_fail_on_three, range(10), workers=4)
+
+
+def _exit_on_three(x):
+	if x == 3:
+		exit()
+	return x
+
+
+def test_system_exit_propagates():
+	with raises(SystemExit):
+		thread_map(_exit_on_three, range(10), workers=4)
+
+
+def test_serial_fallback():
+	assert thread_map(_fail_on_three, [1, 2], workers=1) == [1, 2]
+	assert thread_map(_fail_on_three, []) == []
+
+